@@ -127,7 +127,12 @@ export function createConnection(ip, port) {
             return
         }
 
-        if (m.name == 'HITL') {
+        if (m.name == 'ECHO') {
+            // latency trace, only sent after ECHO ON
+            sendFullMessage(`ECHO ${m.ID}`)
+            return
+
+        } else if (m.name == 'HITL') {
             if (m.INFO == 'CONNECTION_FAILED') {
                 FM.alertBannerRed('Connection Failed. Please check the settings, and try again.')
             }
@@ -71,6 +71,7 @@ export function createPlaybackMenu() {
     menu.appendChild(container)
 
     let bar = FM.addDiv('bar','statusBar')
+    bar.addEventListener('click', sendSeekPlayback)
     container.appendChild(bar)
     bar.appendChild(FM.addDiv('prog','progBar'))
     bar.appendChild(FM.addDiv('dot','dot'))
@@ -208,6 +209,19 @@ export function sendFFPlayback() {
     C.sendFullMessage('AIRCRAFT None PLAYBACK FF')
 }
 
+/**
+ * @function <a name="sendSeekPlayback">sendSeekPlayback</a>
+ * @description Sends seek message to server, jumps to the clicked spot on the progress bar.
+ * @param e {event} click event on the progress bar
+ * @memberof module:eventFunctions
+ */
+export function sendSeekPlayback(e) {
+    let bar = document.getElementById('bar')
+    let rect = bar.getBoundingClientRect()
+    let percent = Math.min(Math.max((e.clientX - rect.left) / rect.width * 100, 0), 100)
+    C.sendFullMessage(`AIRCRAFT None PLAYBACK SEEK_PERCENT ${percent.toFixed(2)}`)
+}
+
 /**
  * @function <a name="sendSkipPlayback">sendSkipPlayback</a>
  * @description Sends skip message to server.
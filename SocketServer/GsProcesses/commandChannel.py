@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+#
+# Author: Andrew Peters
+#
+# Copyright 2019 United States Government as represented by the Administrator of the National Aeronautics
+# and Space Administration. All Rights Reserved.
+#  
+# Disclaimers
+# No Warranty: THE SUBJECT SOFTWARE IS PROVIDED "AS IS" WITHOUT ANY WARRANTY OF ANY
+# KIND, EITHER EXPRESSED, IMPLIED, OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, ANY
+# WARRANTY THAT THE SUBJECT SOFTWARE WILL CONFORM TO SPECIFICATIONS, ANY IMPLIED
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, OR FREEDOM FROM
+# INFRINGEMENT, ANY WARRANTY THAT THE SUBJECT SOFTWARE WILL BE ERROR FREE, OR ANY
+# WARRANTY THAT DOCUMENTATION, IF PROVIDED, WILL CONFORM TO THE SUBJECT SOFTWARE.
+# THIS AGREEMENT DOES NOT, IN ANY MANNER, CONSTITUTE AN ENDORSEMENT BY GOVERNMENT
+# AGENCY OR ANY PRIOR RECIPIENT OF ANY RESULTS, RESULTING DESIGNS, HARDWARE,
+# SOFTWARE PRODUCTS OR ANY OTHER APPLICATIONS RESULTING FROM USE OF THE SUBJECT
+# SOFTWARE.  FURTHER, GOVERNMENT AGENCY DISCLAIMS ALL WARRANTIES AND LIABILITIES
+# REGARDING THIRD-PARTY SOFTWARE, IF PRESENT IN THE ORIGINAL SOFTWARE, AND
+# DISTRIBUTES IT "AS IS."
+#  
+# Waiver and Indemnity:  RECIPIENT AGREES TO WAIVE ANY AND ALL CLAIMS AGAINST THE UNITED
+# STATES GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR
+# RECIPIENT.  IF RECIPIENT'S USE OF THE SUBJECT SOFTWARE RESULTS IN ANY LIABILITIES,
+# DEMANDS, DAMAGES, EXPENSES OR LOSSES ARISING FROM SUCH USE, INCLUDING ANY
+# DAMAGES FROM PRODUCTS BASED ON, OR RESULTING FROM, RECIPIENT'S USE OF THE SUBJECT
+# SOFTWARE, RECIPIENT SHALL INDEMNIFY AND HOLD HARMLESS THE UNITED STATES
+# GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR RECIPIENT,
+# TO THE EXTENT PERMITTED BY LAW.  RECIPIENT'S SOLE REMEDY FOR ANY SUCH MATTER SHALL
+# BE THE IMMEDIATE, UNILATERAL TERMINATION OF THIS AGREEMENT.
+#
+
+import queue
+import logging
+import threading
+from multiprocessing import Pipe
+
+
+BACKLOG = 100  # commands waiting for a busy or dead aircraft before new ones are dropped
+
+
+# One way pipe carrying commands from the socket server to an aircraft process.
+# poll() is a local check on the pipe, it does not go through another process,
+# and fileno() lets the aircraft loop wait on it next to the mavlink socket.
+# The aircraft leaves commands unread while one is running and a dead one
+# never reads them, so the server never writes the pipe itself. send() only
+# queues, a daemon thread does the writes and may block on a full pipe.
+class CommandChannel:
+    def __init__(self, message=None):
+        self.reader, self.writer = Pipe(duplex=False)
+        self.pending = None
+        self.thread = None
+        self.dropped = 0
+        if message is not None:
+            self.send(message)
+
+    def __getstate__(self):
+        # the aircraft process only gets the pipe
+        return {'reader': self.reader, 'writer': self.writer,
+                'pending': None, 'thread': None, 'dropped': 0}
+
+    # server side
+    def send(self, message):
+        # False when the backlog is full and the command was dropped
+        if self.pending is None:
+            self.pending = queue.Queue(BACKLOG)
+            self.thread = threading.Thread(target=self.write, daemon=True)
+            self.thread.start()
+        try:
+            self.pending.put_nowait(message)
+        except queue.Full:
+            self.dropped += 1
+            logger = logging.getLogger()
+            logger.info('SERVER: Command backlog full, dropped {}'.format(message))
+            return False
+        return True
+
+    def write(self):
+        while True:
+            message = self.pending.get()
+            if message is None:
+                return
+            try:
+                self.writer.send(message)
+            except (OSError, ValueError):
+                # closed
+                return
+
+    # aircraft process side
+    def poll(self, timeout=0):
+        return self.reader.poll(timeout)
+
+    def recv(self):
+        return self.reader.recv()
+
+    def fileno(self):
+        return self.reader.fileno()
+
+    def close(self):
+        # after the aircraft process has exited, a write still blocked on
+        # the pipe fails once the reader is closed and the thread ends
+        if self.pending is not None:
+            try:
+                self.pending.put_nowait(None)
+            except queue.Full:
+                pass
+        self.reader.close()
+        if self.thread is not None:
+            self.thread.join(1)
+        self.writer.close()
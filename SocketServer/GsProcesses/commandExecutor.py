@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+#
+# Author: Andrew Peters
+#
+# Copyright 2019 United States Government as represented by the Administrator of the National Aeronautics
+# and Space Administration. All Rights Reserved.
+#  
+# Disclaimers
+# No Warranty: THE SUBJECT SOFTWARE IS PROVIDED "AS IS" WITHOUT ANY WARRANTY OF ANY
+# KIND, EITHER EXPRESSED, IMPLIED, OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, ANY
+# WARRANTY THAT THE SUBJECT SOFTWARE WILL CONFORM TO SPECIFICATIONS, ANY IMPLIED
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, OR FREEDOM FROM
+# INFRINGEMENT, ANY WARRANTY THAT THE SUBJECT SOFTWARE WILL BE ERROR FREE, OR ANY
+# WARRANTY THAT DOCUMENTATION, IF PROVIDED, WILL CONFORM TO THE SUBJECT SOFTWARE.
+# THIS AGREEMENT DOES NOT, IN ANY MANNER, CONSTITUTE AN ENDORSEMENT BY GOVERNMENT
+# AGENCY OR ANY PRIOR RECIPIENT OF ANY RESULTS, RESULTING DESIGNS, HARDWARE,
+# SOFTWARE PRODUCTS OR ANY OTHER APPLICATIONS RESULTING FROM USE OF THE SUBJECT
+# SOFTWARE.  FURTHER, GOVERNMENT AGENCY DISCLAIMS ALL WARRANTIES AND LIABILITIES
+# REGARDING THIRD-PARTY SOFTWARE, IF PRESENT IN THE ORIGINAL SOFTWARE, AND
+# DISTRIBUTES IT "AS IS."
+#  
+# Waiver and Indemnity:  RECIPIENT AGREES TO WAIVE ANY AND ALL CLAIMS AGAINST THE UNITED
+# STATES GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR
+# RECIPIENT.  IF RECIPIENT'S USE OF THE SUBJECT SOFTWARE RESULTS IN ANY LIABILITIES,
+# DEMANDS, DAMAGES, EXPENSES OR LOSSES ARISING FROM SUCH USE, INCLUDING ANY
+# DAMAGES FROM PRODUCTS BASED ON, OR RESULTING FROM, RECIPIENT'S USE OF THE SUBJECT
+# SOFTWARE, RECIPIENT SHALL INDEMNIFY AND HOLD HARMLESS THE UNITED STATES
+# GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR RECIPIENT,
+# TO THE EXTENT PERMITTED BY LAW.  RECIPIENT'S SOLE REMEDY FOR ANY SUCH MATTER SHALL
+# BE THE IMMEDIATE, UNILATERAL TERMINATION OF THIS AGREEMENT.
+#
+
+
+import time
+import logging
+
+import GsProcesses.dispatcher as DP
+
+
+# Commands that talk back and forth with the aircraft are written as
+# generators. They send, then yield a WaitFor and get back the message that
+# matched, or None when the wait timed out:
+#
+#     master.mav.param_set_send(...)
+#     msg_in = yield CE.WaitFor(['PARAM_VALUE'], .5)
+#
+# The executor resumes the generator from the aircraft loop as messages
+# arrive and timers expire, so telemetry keeps going while it runs. A
+# command returns its result with return, a caller inside another command
+# gets it with yield from.
+#
+# A WaitFor is a dispatcher waiter, the executor registers it with its
+# dispatcher and the reply is picked out by message id.
+WaitFor = DP.Waiter
+
+
+def Sleep(seconds):
+    # a wait that no message matches
+    return WaitFor([], seconds)
+
+
+class CommandExecutor:
+    def __init__(self, dispatcher=None):
+        if dispatcher is None:
+            dispatcher = DP.Dispatcher()
+        self.dispatcher = dispatcher
+        self.task = None
+        self.name = None
+        self.wait = None
+        self.result = None
+        self.started = 0
+
+    def busy(self):
+        return self.task is not None
+
+    def start(self, name, task):
+        # runs the command up to its first wait
+        logger = logging.getLogger()
+        if self.task is not None:
+            logger.warning('COMMAND: {} started while {} is running, stopping {}'.format(
+                name, self.name, self.name))
+            if self.wait is not None:
+                self.dispatcher.cancel(self.wait)
+            self.task.close()
+        self.task = task
+        self.name = name
+        self.result = None
+        self.started = time.time()
+        self.resume(None)
+
+    def resume(self, value):
+        logger = logging.getLogger()
+        self.wait = None
+        try:
+            wait = self.task.send(value)
+            wait.callback = self.resume
+            self.wait = self.dispatcher.add(wait)
+        except StopIteration as e:
+            self.finish(e.value)
+        except Exception:
+            logger.exception('COMMAND: {} failed'.format(self.name))
+            self.finish(None)
+
+    def finish(self, result):
+        logger = logging.getLogger()
+        logger.info('COMMAND: {} done in {:.2f}s'.format(self.name, time.time() - self.started))
+        self.result = result
+        self.task = None
+        self.wait = None
+
+    def offer(self, msg):
+        # True if the running command took the message
+        return self.dispatcher.take(msg)
+
+    def poll(self, now=None):
+        # resumes a command whose wait has run out
+        self.dispatcher.expire(now)
+
+    def timeout(self):
+        # seconds until the running command needs to be resumed, None if idle
+        return self.dispatcher.timeout()
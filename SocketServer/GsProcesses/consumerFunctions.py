@@ -44,6 +44,8 @@ from multiprocessing import Process
 import GsProcesses.mavlinkCommands as MF
 import GsProcesses.gfManager as GF
 import GsProcesses.checkIcConfig as CC
+import GsProcesses.missionProtocol as MP
+import GsProcesses.commandExecutor as CE
 
 
 def requestNewAircraft(msg, BAUD, UDP_PORT_2, HOST):
@@ -164,35 +166,34 @@ def shutdownProcesses(pid_list):
 
 
 def requestWaypoints(msg_in, ac, m, mlog, forwarding):
+    # command generator, run by the CommandExecutor
     logger = logging.getLogger()
     logger.info('IC {}: Mission Count {}'.format(ac, msg_in))
-    has_next = False
     if msg_in is None:
         print('Failed to recieve mission count, WP.')
         return '"None"'
-    if int(msg_in.count) > 0:
-        has_next = True
-    i = 0
+    items = yield from MP.download(m, mlog, forwarding, mavutil.mavlink.MAV_MISSION_TYPE_MISSION,
+                              count=msg_in.count)
+    if items is None:
+        print('Failed to recieve mission items, WP.')
+        return '"None"'
+    return missionListMsg(ac, items)
+
+
+def missionListMsg(ac, items):
+    logger = logging.getLogger()
     msg_list = []
     vel = 0
-    while has_next:
-        msg_item = MF.requestWaypoints(i, m, mlog, forwarding)
-
-        if msg_item is not None and msg_item.seq == i:
-            logger.info('IC {}: {}'.format(ac, msg_item))
-            msg_part = '{ "SEQ":' + str(msg_item.seq) + \
-                ', "LAT":' + str(msg_item.x) + \
-                ', "LNG":' + str(msg_item.y) + \
-                ', "ALT":' + str(msg_item.z) + '}'
-            if msg_item.command == 178:
-                vel = msg_item.param2
+    for msg_item in items:
+        logger.info('IC {}: {}'.format(ac, msg_item))
+        msg_part = '{ "SEQ":' + str(msg_item.seq) + \
+            ', "LAT":' + str(msg_item.x) + \
+            ', "LNG":' + str(msg_item.y) + \
+            ', "ALT":' + str(msg_item.z) + '}'
+        if msg_item.command == 178:
+            vel = msg_item.param2
 
-            msg_list.append(msg_part)
-            i += 1
-            if i >= msg_in.count:
-                has_next = False
-        else:
-            logger.info('mission item {} {}'.format(i, msg_item))
+        msg_list.append(msg_part)
 
     msg = '{"AIRCRAFT":' + ac + ','+ '"TYPE":"WP", "LIST":['
     msg = msg + (', ').join(msg_list) + '], "VEL":' + str(vel) + ', "FILE":"false"}'
@@ -201,6 +202,7 @@ def requestWaypoints(msg_in, ac, m, mlog, forwarding):
 
 
 def requestVert(msg_in, ac, m, mlog, forwarding):
+    # command generator, run by the CommandExecutor
     # msg_item
     # seq = fence number (zero based)
     # frame = type (in or ex)
@@ -216,45 +218,43 @@ def requestVert(msg_in, ac, m, mlog, forwarding):
     #                     "roof": roof, "Vertices": Vertices}
     logger = logging.getLogger()
     logger.info('IC {}: Mission Count {}'.format(ac, msg_in))
-    has_next = False
     if msg_in is None:
         print('Failed to recieve mission count, GF.')
         return '"None"'
-    if int(msg_in.count) > 0:
-        has_next = True
-    i = 0  # point count total
+    items = yield from MP.download(m, mlog, forwarding, mavutil.mavlink.MAV_MISSION_TYPE_FENCE,
+                              count=msg_in.count)
+    if items is None:
+        print('Failed to recieve mission items, GF.')
+        return '"None"'
     v_list =[]
     f_list = []
     p_id = 0 # point id per fence
     f_id = 0 # fence id
     fence = {}
-    while has_next:
-        msg_item = MF.requestVert(i, m, mlog, forwarding)
-        if msg_item is not None and msg_item.mission_type != 1:
+    for msg_item in items:
+        if msg_item.mission_type != 1:
             msg = '{"AIRCRAFT" : ' + ac + ', "TYPE":"GF", "LIST":[ ], "FILE" : "False"}'
             return msg
-        if msg_item is not None and msg_item.param2 == p_id:
-            if f_id == msg_item.seq:
-                logger.info('IC {}: {}'.format(ac, msg_item))
-                v_list.append((msg_item.x, msg_item.y))
-                fence = {"id": msg_item.seq +1,
-                         "type":  msg_item.frame,
-                         "numV":  msg_item.param1,
-                         "floor":  msg_item.param3,
-                         "roof":  msg_item.param4,
-                         "Vertices":  v_list}
-                p_id +=1
-            i += 1
-            if i >= msg_in.count:
-                f_list.append(fence)
-                has_next = False
-        elif msg_item is not None:
+        if msg_item.param2 != p_id:
+            # first vertex of the next fence
             f_id +=1
             p_id = 0
             f_list.append(fence)
             fence = []
             v_list = []
-            logger.info('mission item {} {}'.format(i, msg_item))
+            logger.info('mission item {} {}'.format(msg_item.seq, msg_item))
+        if f_id == msg_item.seq:
+            logger.info('IC {}: {}'.format(ac, msg_item))
+            v_list.append((msg_item.x, msg_item.y))
+            fence = {"id": msg_item.seq +1,
+                     "type":  msg_item.frame,
+                     "numV":  msg_item.param1,
+                     "floor":  msg_item.param3,
+                     "roof":  msg_item.param4,
+                     "Vertices":  v_list}
+        p_id +=1
+    if len(items) > 0:
+        f_list.append(fence)
 
     logger.info('IC {}: Fence List: {}'.format(ac, f_list))
 
@@ -269,40 +269,18 @@ def requestVert(msg_in, ac, m, mlog, forwarding):
     return msg
 
 def requestReplan(msg_in, ac, m, mlog, forwarding):
+    # command generator, run by the CommandExecutor
     logger = logging.getLogger()
     logger.info('IC {}: Mission Count {}'.format(ac, msg_in))
-    has_next = False
     if msg_in is None:
         print('Failed to recieve mission count, RP.')
         return '"None"'
-    if int(msg_in.count) > 0:
-        has_next = True
-    i = 0
-    msg_list = []
-    vel = 0
-    while has_next:
-        msg_item = MF.requestReplan(i, m, mlog, forwarding)
-
-        if msg_item is not None and msg_item.seq == i:
-            logger.info('IC {}: {}'.format(ac, msg_item))
-            msg_part = '{ "SEQ":' + str(msg_item.seq) + \
-                ', "LAT":' + str(msg_item.x) + \
-                ', "LNG":' + str(msg_item.y) + \
-                ', "ALT":' + str(msg_item.z) + '}'
-            if msg_item.command == 178:
-                vel = msg_item.param2
-
-            msg_list.append(msg_part)
-            i += 1
-            if i >= msg_in.count:
-                has_next = False
-        else:
-            logger.info('mission item {} {}'.format(i, msg_item))
-
-    msg = '{"AIRCRAFT":' + ac + ','+ '"TYPE":"REPLAN", "LIST":['
-    msg = msg + (', ').join(msg_list) + '], "VEL":' + str(vel) + ', "FILE":"false"}'
-
-    return msg
+    items = yield from MP.download(m, mlog, forwarding, mavutil.mavlink.MAV_MISSION_TYPE_RALLY,
+                              count=msg_in.count)
+    if items is None:
+        print('Failed to recieve mission items, RP.')
+        return '"None"'
+    return missionListMsg(ac, items)
 
 
 def sendVert(msg_in, ac):
@@ -457,6 +435,7 @@ def sendWaypoints(wp_list, ac):
 
 
 def loadFlightPlan(ac, consumer_message, q, master, mlog, forwarding):
+    # command generator, run by the CommandExecutor
     logger = logging.getLogger()
     logger.info('')
     logger.info('*******************************************************')
@@ -473,74 +452,32 @@ def loadFlightPlan(ac, consumer_message, q, master, mlog, forwarding):
     sim_type = consumer_message[6]
     wp_list = list(zip(lats, lngs, alts))
 
-    # Let the system know how many wp's to expect
-    msg_in = MF.sendMissionCount(wp_list, master, mlog, forwarding)
+    # [wp0, change speed, wp1, ...], the aircraft asks for each one
+    radius = 10
+    items = MP.waypointItems(wp_list, radius, float(consumer_message[4]))
+    print(wp_list)
+
+    def setHome():
+        # set home location to first point
+        MF.setHome(wp_list[0], master, mlog, forwarding)
+
+    def progress(done, total):
+        logger.info('IC {}: Point sent: {} of {}'.format(ac, done, total))
+        q.put(
+            aircraft + '"TYPE" : "WAYPOINTLOAD", "INFO" : "SENT WAYPOINT '+str(done - 1)+'"}')
+
     logger.info('IC {}: send mission count'.format(ac))
     q.put(aircraft + '"TYPE" : "WAYPOINTLOAD", "INFO" : "SEND MISSION COUNT"}')
+    upload = yield from MP.upload(master, mlog, forwarding, items, on_first=setHome, progress=progress)
 
-    # Send the wp's
-    radius = 10
-    seq = 0
-
-    if msg_in is'NONE' or msg_in is None:
+    if upload.state == MP.DONE:
+        logger.info('IC {}: End load wp.'.format(ac))
+        q.put(aircraft + '"TYPE" : "WAYPOINTLOAD", "INFO" : "SUCCESS"}')
+    else:
         logger.info(
-            'IC {}: Timeout Reached. Waypoint Load Failed'.format(ac))
+            'IC {}: Waypoint Load Failed, {}'.format(ac, upload.error))
         q.put(aircraft + '"TYPE" : "WAYPOINTLOAD", "INFO" : "LOAD FAILED TIMEOUT REACHED"}')
 
-    else:
-        logger.info('IC {}: message in {}'.format(ac, msg_in))
-
-        # set home location to first point
-        MF.setHome(wp_list[int(msg_in.seq)], master, mlog, forwarding)
-
-        # Send start point
-        msg_in = MF.sendWaypoint(wp_list[int(msg_in.seq)], radius, int(msg_in.seq), master, mlog, forwarding)
-        logger.info('IC {}: Point sent: {}'.format(ac, wp_list[0]))
-        logger.info('IC {}: Message In: {}'.format(ac, msg_in))
-
-        msg_in = MF.sendVelocity(
-            float(consumer_message[4]), master, mlog, forwarding)
-        logger.info('IC {}: Velocity sent: {}'.format(
-            ac, consumer_message[4]))
-        logger.info('IC {}: Message In: {}'.format(ac, msg_in))
-        print(wp_list)
-        # Send the Waypoints
-        while True:
-            if msg_in is'NONE' or msg_in is None:
-                logger.info(
-                    'IC {}: Timeout Reached. Waypoint Load Failed'.format(ac))
-                q.put(aircraft + '"TYPE" : "WAYPOINTLOAD", "INFO" : "LOAD FAILED TIMEOUT REACHED"}')
-                return
-            elif str(msg_in).find('MISSION_ACK') == 0:
-                logger.info('IC {}: message in {}'.format(ac, msg_in))
-                if int(msg_in.type) != 0:
-                    logger.info(
-                        'IC {}: End load wp. Mission Load Failed'.format(ac))
-                    q.put(aircraft + '"TYPE" : "WAYPOINTLOAD", "INFO" : "LOAD FAILED TIMEOUT REACHED"}')
-                else:
-                    logger.info('IC {}: End load wp.'.format(ac))
-                    q.put(aircraft + '"TYPE" : "WAYPOINTLOAD", "INFO" : "SUCCESS"}')
-                break
-            else:
-
-                seq = int(msg_in.seq)
-                print(seq, wp_list[seq-1])
-                item = wp_list[seq-1]
-                logger.info('IC {0}: Sending waypoint {1}, {2}'.format(ac, item, [
-                    float(item[0]),
-                    float(item[1]),
-                    float(item[2]),
-                    mavutil.mavlink.MAV_MISSION_TYPE_ALL,
-                    master]))
-
-                msg_in = MF.sendWaypoint(
-                    item, radius, seq, master, mlog, forwarding)
-                logger.info('IC {}: Point sent: {}'.format(
-                    ac, item))
-
-                q.put(
-                    aircraft + '"TYPE" : "WAYPOINTLOAD", "INFO" : "SENT WAYPOINT '+str(seq)+'"}')
-
     logger.info('*******************************************************')
     logger.info('')
 
@@ -576,6 +513,7 @@ def loadFlightPlanFile(ac, consumer_message, q, master, mlog):
         q.put('{"AIRCRAFT":'+ac+', "name":"LOAD" , "INFO":"FAIL", "MSG":"'+str(e)+'"}')
 
 def loadGeoFence(ac, consumer_message, q, master, mlog, forwarding):
+    # command generator, run by the CommandExecutor
     logger = logging.getLogger()
     logger.info('')
     logger.info('*******************************************************')
@@ -595,8 +533,8 @@ def loadGeoFence(ac, consumer_message, q, master, mlog, forwarding):
     f_type = consumer_message[6]
 
     q.put(aircraft + '"TYPE" : "GEOFENCELOAD", "INFO" : "START"}')
-    msg_in = MF.sendGFEnable(index, f_type, total,
-                             floor, roof, master, mlog, forwarding)
+    msg_in = yield from MF.sendGFEnable(index, f_type, total,
+                                        floor, roof, master, mlog, forwarding)
 
     # send points
     while True:
@@ -626,7 +564,7 @@ def loadGeoFence(ac, consumer_message, q, master, mlog, forwarding):
                                                                      float(
                                                                          item[1])
                                                                      ]))
-            msg_in = MF.sendGFPoint(seq, total, item, master, mlog, forwarding)
+            msg_in = yield from MF.sendGFPoint(seq, total, item, master, mlog, forwarding)
     logger.info('IC {}: msg_in {}'.format(ac, msg_in))
     logger.info('*******************************************************')
     logger.info('')
@@ -658,6 +596,7 @@ def loadGeoFenceFile(ac, consumer_message, q, master, mlog):
 
 
 def loadParamFile(ac, consumer_message, q, master, mlog):
+    # command generator, run by the CommandExecutor
     logger = logging.getLogger()
     dir = os.path.dirname(os.path.realpath(__file__))
     try:
@@ -680,8 +619,8 @@ def loadParamFile(ac, consumer_message, q, master, mlog):
                                             words[0].encode('utf8'),
                                             float(words[1]),
                                             mavutil.mavlink.MAV_PARAM_TYPE_REAL32)
-                    msg_in = master.recv_match(type='PARAM_VALUE',
-                                            blocking=True, timeout=.5)
+                    msg_in = yield CE.WaitFor(['PARAM_VALUE'], .5,
+                                              lambda m, name=words[0]: m.param_id == name)
 
                     if msg_in != None:
                         break
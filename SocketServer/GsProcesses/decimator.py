@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+#
+# Author: Andrew Peters
+#
+# Copyright 2019 United States Government as represented by the Administrator of the National Aeronautics
+# and Space Administration. All Rights Reserved.
+#  
+# Disclaimers
+# No Warranty: THE SUBJECT SOFTWARE IS PROVIDED "AS IS" WITHOUT ANY WARRANTY OF ANY
+# KIND, EITHER EXPRESSED, IMPLIED, OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, ANY
+# WARRANTY THAT THE SUBJECT SOFTWARE WILL CONFORM TO SPECIFICATIONS, ANY IMPLIED
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, OR FREEDOM FROM
+# INFRINGEMENT, ANY WARRANTY THAT THE SUBJECT SOFTWARE WILL BE ERROR FREE, OR ANY
+# WARRANTY THAT DOCUMENTATION, IF PROVIDED, WILL CONFORM TO THE SUBJECT SOFTWARE.
+# THIS AGREEMENT DOES NOT, IN ANY MANNER, CONSTITUTE AN ENDORSEMENT BY GOVERNMENT
+# AGENCY OR ANY PRIOR RECIPIENT OF ANY RESULTS, RESULTING DESIGNS, HARDWARE,
+# SOFTWARE PRODUCTS OR ANY OTHER APPLICATIONS RESULTING FROM USE OF THE SUBJECT
+# SOFTWARE.  FURTHER, GOVERNMENT AGENCY DISCLAIMS ALL WARRANTIES AND LIABILITIES
+# REGARDING THIRD-PARTY SOFTWARE, IF PRESENT IN THE ORIGINAL SOFTWARE, AND
+# DISTRIBUTES IT "AS IS."
+#  
+# Waiver and Indemnity:  RECIPIENT AGREES TO WAIVE ANY AND ALL CLAIMS AGAINST THE UNITED
+# STATES GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR
+# RECIPIENT.  IF RECIPIENT'S USE OF THE SUBJECT SOFTWARE RESULTS IN ANY LIABILITIES,
+# DEMANDS, DAMAGES, EXPENSES OR LOSSES ARISING FROM SUCH USE, INCLUDING ANY
+# DAMAGES FROM PRODUCTS BASED ON, OR RESULTING FROM, RECIPIENT'S USE OF THE SUBJECT
+# SOFTWARE, RECIPIENT SHALL INDEMNIFY AND HOLD HARMLESS THE UNITED STATES
+# GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR RECIPIENT,
+# TO THE EXTENT PERMITTED BY LAW.  RECIPIENT'S SOLE REMEDY FOR ANY SUCH MATTER SHALL
+# BE THE IMMEDIATE, UNILATERAL TERMINATION OF THIS AGREEMENT.
+#
+
+
+import time
+
+
+DEFAULT_RATES = 'GLOBAL_POSITION_INT:10,ATTITUDE:20'
+
+# each of these carries a different item every time (a parameter, a text,
+# an intruder, a mission item), keeping only the latest would lose data
+NEVER_LIMIT = set(['PARAM_VALUE', 'STATUSTEXT', 'TRAFFIC', 'ADSB_VEHICLE',
+                   'MISSION_COUNT', 'MISSION_ITEM', 'MISSION_ITEM_INT',
+                   'MISSION_ACK', 'MISSION_REQUEST', 'COMMAND_ACK'])
+
+
+def parseRates(text):
+    # 'GLOBAL_POSITION_INT:10,ATTITUDE:20' -> {'GLOBAL_POSITION_INT': 10.0, 'ATTITUDE': 20.0}
+    rates = {}
+    for item in text.split(','):
+        if ':' not in item:
+            continue
+        msg_type, hz = item.split(':', 1)
+        try:
+            rates[msg_type.strip().upper()] = float(hz)
+        except ValueError:
+            continue
+    return rates
+
+
+# Limits each (aircraft, TYPE) to a max rate.
+# The first message after a quiet period goes out right away, messages that
+# come in faster than the rate are held and only the latest one is kept.
+# due() returns the held messages once their time comes, so the last
+# sample always gets through. Types without a rate are never held.
+class Decimator:
+    def __init__(self, rates=None):
+        self.periods = {}  # {TYPE: seconds between messages}
+        self.next = {}     # {key: earliest time the next message can go}
+        self.pending = {}  # {key: latest held item}
+        if rates is not None:
+            for msg_type, hz in rates.items():
+                self.setRate(msg_type, hz)
+
+    def setRate(self, msg_type, hz):
+        # hz <= 0 removes the limit, returns False if the type can't be limited
+        if msg_type in NEVER_LIMIT:
+            return False
+        if hz <= 0:
+            self.periods.pop(msg_type, None)
+        else:
+            self.periods[msg_type] = 1.0 / hz
+        return True
+
+    def clear(self):
+        self.periods = {}
+
+    def hasRates(self):
+        return len(self.periods) > 0 or len(self.pending) > 0
+
+    def getRates(self):
+        return {k: round(1.0 / v, 3) for k, v in self.periods.items()}
+
+    def offer(self, key, msg_type, item, now=None):
+        # True means send it now, False means it is held
+        period = self.periods.get(msg_type)
+        if period is None:
+            return True
+        if now is None:
+            now = time.time()
+        if now >= self.next.get(key, 0):
+            self.next[key] = now + period
+            self.pending.pop(key, None)
+            return True
+        self.pending[key] = item
+        return False
+
+    def due(self, now=None):
+        if len(self.pending) == 0:
+            return []
+        if now is None:
+            now = time.time()
+        ready = [k for k in self.pending if self.next.get(k, 0) <= now]
+        items = []
+        for key in ready:
+            items.append(self.pending.pop(key))
+            period = self.periods.get(key[1])
+            if period is not None:
+                self.next[key] = now + period
+        return items
+
+    def timeout(self, now=None):
+        # seconds until the next held message is due, None if nothing is held
+        if len(self.pending) == 0:
+            return None
+        if now is None:
+            now = time.time()
+        return max(0, min(self.next.get(k, 0) for k in self.pending) - now)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+#
+# Author: Andrew Peters
+#
+# Copyright 2019 United States Government as represented by the Administrator of the National Aeronautics
+# and Space Administration. All Rights Reserved.
+#  
+# Disclaimers
+# No Warranty: THE SUBJECT SOFTWARE IS PROVIDED "AS IS" WITHOUT ANY WARRANTY OF ANY
+# KIND, EITHER EXPRESSED, IMPLIED, OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, ANY
+# WARRANTY THAT THE SUBJECT SOFTWARE WILL CONFORM TO SPECIFICATIONS, ANY IMPLIED
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, OR FREEDOM FROM
+# INFRINGEMENT, ANY WARRANTY THAT THE SUBJECT SOFTWARE WILL BE ERROR FREE, OR ANY
+# WARRANTY THAT DOCUMENTATION, IF PROVIDED, WILL CONFORM TO THE SUBJECT SOFTWARE.
+# THIS AGREEMENT DOES NOT, IN ANY MANNER, CONSTITUTE AN ENDORSEMENT BY GOVERNMENT
+# AGENCY OR ANY PRIOR RECIPIENT OF ANY RESULTS, RESULTING DESIGNS, HARDWARE,
+# SOFTWARE PRODUCTS OR ANY OTHER APPLICATIONS RESULTING FROM USE OF THE SUBJECT
+# SOFTWARE.  FURTHER, GOVERNMENT AGENCY DISCLAIMS ALL WARRANTIES AND LIABILITIES
+# REGARDING THIRD-PARTY SOFTWARE, IF PRESENT IN THE ORIGINAL SOFTWARE, AND
+# DISTRIBUTES IT "AS IS."
+#  
+# Waiver and Indemnity:  RECIPIENT AGREES TO WAIVE ANY AND ALL CLAIMS AGAINST THE UNITED
+# STATES GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR
+# RECIPIENT.  IF RECIPIENT'S USE OF THE SUBJECT SOFTWARE RESULTS IN ANY LIABILITIES,
+# DEMANDS, DAMAGES, EXPENSES OR LOSSES ARISING FROM SUCH USE, INCLUDING ANY
+# DAMAGES FROM PRODUCTS BASED ON, OR RESULTING FROM, RECIPIENT'S USE OF THE SUBJECT
+# SOFTWARE, RECIPIENT SHALL INDEMNIFY AND HOLD HARMLESS THE UNITED STATES
+# GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR RECIPIENT,
+# TO THE EXTENT PERMITTED BY LAW.  RECIPIENT'S SOLE REMEDY FOR ANY SUCH MATTER SHALL
+# BE THE IMMEDIATE, UNILATERAL TERMINATION OF THIS AGREEMENT.
+#
+
+
+import time
+
+from pymavlink import mavutil
+
+
+# Routes received messages by MAVLink id, a dict lookup per message.
+#
+# Handlers get every message of their types that no waiter took:
+#
+#     dispatcher.on(['STATUSTEXT'], onStatusText)
+#     dispatcher.handle(msg, q)    # calls onStatusText(msg, q)
+#
+# Waiters are one shot. The first message of their types that passes match
+# completes them, or None when the timeout runs out first, and it is not
+# handled any further. Waiting on a reply leaves the rest of the traffic to
+# the handlers.
+def msgId(name):
+    # the id of a message name in the current dialect
+    return getattr(mavutil.mavlink, 'MAVLINK_MSG_ID_' + name)
+
+
+class Waiter:
+    def __init__(self, types, timeout=2, match=None, callback=None):
+        self.types = types
+        self.ids = [msgId(x) for x in types]
+        self.timeout = timeout
+        self.match = match
+        self.callback = callback
+        self.deadline = None
+        self.msg = None
+        self.done = False
+
+    def complete(self, msg):
+        self.msg = msg
+        self.done = True
+        if self.callback is not None:
+            self.callback(msg)
+
+
+class Dispatcher:
+    def __init__(self, default=None):
+        self.handlers = {}  # msg id: handler
+        self.waiters = {}  # msg id: [waiter], oldest first
+        self.pending = []  # every waiter, for the timeouts
+        self.default = default  # handler for types without one
+
+    def on(self, types, handler):
+        for x in types:
+            self.handlers[msgId(x)] = handler
+
+    def add(self, waiter):
+        # starts the waiter's timeout
+        waiter.deadline = time.time() + waiter.timeout
+        for i in waiter.ids:
+            self.waiters.setdefault(i, []).append(waiter)
+        self.pending.append(waiter)
+        return waiter
+
+    def waitFor(self, types, timeout=2, match=None, callback=None):
+        return self.add(Waiter(types, timeout, match, callback))
+
+    def cancel(self, waiter):
+        for i in waiter.ids:
+            waiters = self.waiters.get(i)
+            if waiters is not None and waiter in waiters:
+                waiters.remove(waiter)
+                if len(waiters) == 0:
+                    del self.waiters[i]
+        if waiter in self.pending:
+            self.pending.remove(waiter)
+
+    def take(self, msg):
+        # True if a waiter took the message
+        waiters = self.waiters.get(msg.get_msgId())
+        if waiters is None:
+            return False
+        for w in waiters:
+            if w.match is None or w.match(msg):
+                self.cancel(w)
+                w.complete(msg)
+                return True
+        return False
+
+    def handle(self, msg, *args):
+        handler = self.handlers.get(msg.get_msgId(), self.default)
+        if handler is not None:
+            handler(msg, *args)
+
+    def dispatch(self, msg, *args):
+        if not self.take(msg):
+            self.handle(msg, *args)
+
+    def expire(self, now=None):
+        # completes the waiters whose timeout has run out with None
+        if len(self.pending) == 0:
+            return
+        if now is None:
+            now = time.time()
+        for w in [x for x in self.pending if now >= x.deadline]:
+            if w not in self.pending:
+                continue  # cancelled by an earlier callback
+            self.cancel(w)
+            w.complete(None)
+
+    def timeout(self):
+        # seconds until the next waiter times out, None if there are none
+        if len(self.pending) == 0:
+            return None
+        return max(0, min(x.deadline for x in self.pending) - time.time())
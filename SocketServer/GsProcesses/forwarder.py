@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+#
+# Author: Andrew Peters
+#
+# Copyright 2019 United States Government as represented by the Administrator of the National Aeronautics
+# and Space Administration. All Rights Reserved.
+#  
+# Disclaimers
+# No Warranty: THE SUBJECT SOFTWARE IS PROVIDED "AS IS" WITHOUT ANY WARRANTY OF ANY
+# KIND, EITHER EXPRESSED, IMPLIED, OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, ANY
+# WARRANTY THAT THE SUBJECT SOFTWARE WILL CONFORM TO SPECIFICATIONS, ANY IMPLIED
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, OR FREEDOM FROM
+# INFRINGEMENT, ANY WARRANTY THAT THE SUBJECT SOFTWARE WILL BE ERROR FREE, OR ANY
+# WARRANTY THAT DOCUMENTATION, IF PROVIDED, WILL CONFORM TO THE SUBJECT SOFTWARE.
+# THIS AGREEMENT DOES NOT, IN ANY MANNER, CONSTITUTE AN ENDORSEMENT BY GOVERNMENT
+# AGENCY OR ANY PRIOR RECIPIENT OF ANY RESULTS, RESULTING DESIGNS, HARDWARE,
+# SOFTWARE PRODUCTS OR ANY OTHER APPLICATIONS RESULTING FROM USE OF THE SUBJECT
+# SOFTWARE.  FURTHER, GOVERNMENT AGENCY DISCLAIMS ALL WARRANTIES AND LIABILITIES
+# REGARDING THIRD-PARTY SOFTWARE, IF PRESENT IN THE ORIGINAL SOFTWARE, AND
+# DISTRIBUTES IT "AS IS."
+#  
+# Waiver and Indemnity:  RECIPIENT AGREES TO WAIVE ANY AND ALL CLAIMS AGAINST THE UNITED
+# STATES GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR
+# RECIPIENT.  IF RECIPIENT'S USE OF THE SUBJECT SOFTWARE RESULTS IN ANY LIABILITIES,
+# DEMANDS, DAMAGES, EXPENSES OR LOSSES ARISING FROM SUCH USE, INCLUDING ANY
+# DAMAGES FROM PRODUCTS BASED ON, OR RESULTING FROM, RECIPIENT'S USE OF THE SUBJECT
+# SOFTWARE, RECIPIENT SHALL INDEMNIFY AND HOLD HARMLESS THE UNITED STATES
+# GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR RECIPIENT,
+# TO THE EXTENT PERMITTED BY LAW.  RECIPIENT'S SOLE REMEDY FOR ANY SUCH MATTER SHALL
+# BE THE IMMEDIATE, UNILATERAL TERMINATION OF THIS AGREEMENT.
+#
+
+
+import time
+import socket
+import struct
+import logging
+import selectors
+import threading
+from collections import deque
+
+import GsProcesses.logIndex as LI
+
+
+forwarders = []  # open forwarders in this process, closed by closeAll
+
+
+# Raw mavlink forwarding to one or more UDP targets.
+# send() writes the bytes read from the aircraft to every target as they
+# are, straight after the read and before any parsing, logging or json.
+# Nothing in the packets or in the master's mavlink state is changed.
+# A daemon thread waits on the target sockets and queues whatever comes
+# back. The aircraft loop, the only writer of the master and the tlog,
+# waits on fileno() and writes the queue out with flush(), so forwarded
+# packets never interleave with its own on a serial link.
+class Forwarder:
+    def __init__(self, master=None, mlog=None):
+        self.master = master
+        self.mlog = mlog
+        self.targets = {}  # {(host, port): [socket, packets out, bytes out, packets back, bytes back]}
+        self.lock = threading.Lock()
+        self.selector = selectors.DefaultSelector()
+        # wakes the thread when targets change
+        self.wake_r, self.wake_w = socket.socketpair()
+        self.wake_r.setblocking(False)
+        self.selector.register(self.wake_r, selectors.EVENT_READ, None)
+        # packets back for the master, readable ready_r means there are some
+        self.back = deque()
+        self.ready_r, self.ready_w = socket.socketpair()
+        self.ready_r.setblocking(False)
+        self.ready_w.setblocking(False)
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        forwarders.append(self)
+
+    def setLink(self, master, mlog):
+        self.master = master
+        self.mlog = mlog
+
+    def add(self, host, port):
+        addr = (socket.gethostbyname(host), int(port))
+        with self.lock:
+            if addr in self.targets:
+                return
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            s.setblocking(False)
+            self.targets[addr] = [s, 0, 0, 0, 0]
+            self.selector.register(s, selectors.EVENT_READ, addr)
+        self.wake()
+
+    def remove(self, host, port):
+        addr = (socket.gethostbyname(host), int(port))
+        with self.lock:
+            target = self.targets.pop(addr, None)
+            if target is not None:
+                self.selector.unregister(target[0])
+                target[0].close()
+        self.wake()
+
+    def clear(self):
+        with self.lock:
+            for addr, target in self.targets.items():
+                self.selector.unregister(target[0])
+                target[0].close()
+            self.targets.clear()
+        self.wake()
+
+    def hasTargets(self):
+        return len(self.targets) > 0
+
+    def getTargets(self):
+        return list(self.targets.keys())
+
+    def getStats(self):
+        with self.lock:
+            return {'{}:{}'.format(*addr): {'packets_out': t[1], 'bytes_out': t[2],
+                                            'packets_back': t[3], 'bytes_back': t[4]}
+                    for addr, t in self.targets.items()}
+
+    def wake(self):
+        try:
+            self.wake_w.send(b'x')
+        except OSError:
+            pass
+
+    def send(self, data):
+        # data is a list of raw datagrams or serial reads from the master
+        with self.lock:
+            for addr, target in self.targets.items():
+                s = target[0]
+                for m in data:
+                    try:
+                        s.sendto(m, addr)
+                    except (BlockingIOError, OSError):
+                        # target not listening or socket buffer full, drop it
+                        continue
+                    target[1] += 1
+                    target[2] += len(m)
+
+    def run(self):
+        logger = logging.getLogger()
+        while self.running:
+            for key, events in self.selector.select(timeout=1):
+                if key.data is None:
+                    try:
+                        while self.wake_r.recv(64):
+                            pass
+                    except (BlockingIOError, OSError):
+                        pass
+                    continue
+                try:
+                    m, addr = key.fileobj.recvfrom(65535)
+                except (BlockingIOError, OSError):
+                    continue
+                with self.lock:
+                    target = self.targets.get(key.data)
+                    if target is not None:
+                        target[3] += 1
+                        target[4] += len(m)
+                self.back.append(m)
+                try:
+                    self.ready_w.send(b'x')
+                except (BlockingIOError, OSError):
+                    # already readable
+                    pass
+
+    def fileno(self):
+        return self.ready_r.fileno()
+
+    def flush(self):
+        # aircraft loop, writes the packets queued for the master
+        logger = logging.getLogger()
+        try:
+            while self.ready_r.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+        while len(self.back) > 0:
+            m = self.back.popleft()
+            try:
+                self.toMaster(m)
+            except Exception:
+                logger.exception('FORWARD: Error writing to master')
+
+    def toMaster(self, m):
+        master = self.master
+        if master is None or master == 'NONE' or master == 'FILE' or master == 'END':
+            return
+        master.write(m)
+        mlog = self.mlog
+        if mlog is not None:
+            # log each packet with its own timestamp, like recvAndLog
+            usec = int(time.time() * 1.0e6)
+            stamp = struct.pack('>Q', usec & ~3 | 3)
+            x = bytearray()
+            pos = 0
+            while pos < len(m):
+                n = LI.packetLength(m, pos)
+                if n == 0 or pos + n > len(m):
+                    break
+                x += stamp + m[pos:pos + n]
+                pos += n
+            if len(x) > 0:
+                mlog.write(x)
+
+    def close(self):
+        if not self.running:
+            return
+        self.running = False
+        self.wake()
+        self.thread.join(2)
+        self.clear()
+        self.selector.close()
+        self.wake_r.close()
+        self.wake_w.close()
+        self.ready_r.close()
+        self.ready_w.close()
+        if self in forwarders:
+            forwarders.remove(self)
+
+
+def closeAll():
+    for f in forwarders[:]:
+        f.close()
@@ -37,8 +37,10 @@ import time
 import json
 import time
 import struct
+import signal
 import logging
 import traceback
+from multiprocessing.connection import wait
 
 from GsProcesses.traffic import Traffic as T
 from GsProcesses.trafficManager import TrafficManager
@@ -48,6 +50,16 @@ import GsProcesses.gfManager as GF
 import GsProcesses.readLogFile as RT
 import GsProcesses.playback as P
 import GsProcesses.IcClass as I
+import GsProcesses.telemetryEncoder as TE
+import GsProcesses.tlogWriter as TW
+import GsProcesses.msgLog as ML
+import GsProcesses.decimator as DM
+import GsProcesses.forwarder as FW
+import GsProcesses.missionProtocol as MP
+import GsProcesses.commandExecutor as CE
+import GsProcesses.dispatcher as DP
+import GsProcesses.metrics as MX
+import GsProcesses.profiler as PR
 
 from pymavlink import mavutil, mavwp, mavparm
 
@@ -78,29 +90,90 @@ has_heartbeat = False
 forwarding = None
 sim_type = None
 starttime_now = time.time()
+connecting_time = 0
+TICK = .1   # longest the loop sleeps, timers are checked at this rate
+POLL = .01  # used when the link has no fd to wait on
+encoder = TE.JsonEncoder()
+# max rates sent to the server per message type, WEBGS_RATES=TYPE:hz,TYPE:hz
+decimator = DM.Decimator(DM.parseRates(os.environ.get('WEBGS_RATES', DM.DEFAULT_RATES)))
+# routes every received message by id, to a waiting command or the
+# handler for its type, see the handlers after update_position
+dispatcher = DP.Dispatcher()
+# runs the commands that wait on the aircraft, one at a time, while the
+# loop keeps receiving. New commands are not read until it is done.
+executor = CE.CommandExecutor(dispatcher)
+profiler = PR.Profiler()  # AIRCRAFT <ac> PROFILE ..., see profiler.command
 
 
 def data(q, m):
+    # exit cleanly when the server terminates this process so the tlog
+    # buffer is written out and synced
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    # the server's metrics came along with the fork
+    MX.registry.clear()
+    try:
+        aircraftLoop(q, m)
+    finally:
+        if profiler.running():
+            profiler.stop()
+        FW.closeAll()
+        TW.closeAll()
+        ML.closeAll()
+
+
+def aircraftLoop(q, m):
     # Create a Trafic manager instance
     TM = TrafficManager()
     master = 'NONE'
     logger = logging.getLogger()
 
     mlog = None
+    metrics_time = time.time()
     while True:
+        # sleep until there is a packet, a command, or a timer is due
+        waitForWork(m, master)
+
+        # packets the forwarding targets sent back for the aircraft
+        if forwarding is not None:
+            forwarding.flush()
+
+        # this process's counters and latencies for the server's endpoint
+        if time.time() - metrics_time >= MX.INTERVAL:
+            metrics_time = time.time()
+            tlogGauges()
+            linkGauges(metrics_time)
+            forwardTotals()
+            q.put(MX.snapshotMsg(ac))
+
         # get messages from ac
         if master != 'NONE' or master != 'END':
             update_position(q, TM, master, mlog, forwarding)
 
-        # execute commands from gs
-        if len(m) > 0:
-            logger.info('IC {}: Message: {}'.format(ac, str(m[0])))
-            if m[0][1] != '-1':
-                master, mlog = completeCommands(q, m[0], TM, master, mlog)
+        # a running command whose wait has run out
+        executor.poll()
+
+        # a profile whose time is up
+        msg = profiler.poll()
+        if msg is not None:
+            q.put(msg)
 
-            if "NEW_AIRCRAFT" in m[0]:
+        # execute commands from gs
+        if not executor.busy() and m.poll():
+            command = m.recv()
+            logger.info('IC {}: Message: {}'.format(ac, str(command)))
+            if 'PROFILE' in command:
+                # PROFILE START [SAMPLE|CPROFILE] [seconds], PROFILE STOP
+                i = command.index('PROFILE')
+                q.put(PR.command(profiler, 'ac' + str(ac), command[i + 1:]))
+
+            elif command[1] != '-1':
+                master, mlog = completeCommands(q, command, TM, master, mlog)
+                if forwarding is not None:
+                    forwarding.setLink(master, mlog)
+
+            if "NEW_AIRCRAFT" in command:
                 global sim_type
-                sim_type = m[0][10]
+                sim_type = command[10]
                 logger.info('IC {}: Waiting for Icarous to load.'.format(ac))
 
                 # setup the .tlog
@@ -113,19 +186,16 @@ def data(q, m):
                     f.write('')
 
                 # connect to the log
-                mlog = mavutil.mavlink_connection(
-                    log, dialect='ardupilotmega', baud=BAUD, write=True, append=True)
+                mlog = TW.TlogWriter(log)
                 mavutil.set_dialect("ardupilotmega")
 
                 # give time for icarous to load
-                time.sleep(12)
-
-                logger.info('IC {}: Loading parameters.'.format(ac))
+                executor.start('NEW_AIRCRAFT', waitForIcarous(12))
 
-            elif 'PLAYBACK' in m[0]:
-                if 'START' in m[0]:
+            elif 'PLAYBACK' in command:
+                if 'START' in command:
                     master = 'FILE'
-                    log = m[0][4]
+                    log = command[4]
 
                     # check file exists
                     try:
@@ -159,26 +229,32 @@ def data(q, m):
                             '{"name":"IC_PLAYBACK", "INFO": "Playback error: Unknown file type.", "ecode":"2"}')
                         quit()
 
-                elif 'PLAY' in m[0]:
+                elif 'PLAY' in command:
                     logplayer.Play()
 
-                elif 'SHUTDOWN' in m[0]:
+                elif 'SHUTDOWN' in command:
                     q.put('{"AIRCRAFT":"PLAYBACK", "name":"SHUT_DOWN"}')
                     logger.info('IC Playback: Shutdown recieved')
                     logplayer = None
                     q.close()
                     master = 'END'
 
-                elif 'REW' in m[0]:
+                elif 'REW' in command:
                     logplayer.Rew()
-                elif 'FF' in m[0]:
+                elif 'FF' in command:
                     logplayer.FF()
-                elif 'SKIP' in m[0]:
-                    logplayer.SkipForward()
-
-            # Remove the completed command from the list
-            m.pop(0)
-            logger.info('IC {0}: List {0}: {1}'.format(ac, str(m)))
+                elif 'SKIP' in command:
+                    # SKIP <seconds>
+                    i = command.index('SKIP')
+                    logplayer.SkipForward(getFloat(command, i + 1, logplayer.skip_time))
+                elif 'SEEK_TIME' in command:
+                    # SEEK_TIME <seconds from the start of the log>
+                    i = command.index('SEEK_TIME')
+                    logplayer.SeekTime(getFloat(command, i + 1, 0))
+                elif 'SEEK_PERCENT' in command:
+                    # SEEK_PERCENT <0 - 100>
+                    i = command.index('SEEK_PERCENT')
+                    logplayer.SeekPercent(getFloat(command, i + 1, 0))
 
         # if shutdown recieved exit the process
         if master == 'END':
@@ -186,6 +262,124 @@ def data(q, m):
             quit()
 
 
+def tlogGauges():
+    # records waiting in each tlog writer's ring, the most there have been,
+    # and the records dropped when it was full
+    MX.registry.setTotal('tlog_dropped_total', sum(w.dropped for w in TW.writers))
+    for w in TW.writers:
+        x = w.getStats()
+        name = os.path.basename(w.path)
+        MX.registry.gauge('tlog_queue_depth', x['depth'], file=name)
+        MX.registry.gauge('tlog_queue_max_depth', x['max_depth'], file=name)
+
+
+def forwardTotals():
+    # packets and bytes to and from each forwarding target
+    if forwarding is None:
+        return
+    for target, x in forwarding.getStats().items():
+        for name, value in x.items():
+            MX.registry.setTotal('forward_{}_total'.format(name), value, target=target)
+
+
+def linkGauges(now):
+    # radio statistics per sender and window for the metrics snapshot,
+    # sender is sysid:compid or link for the whole link, see linkStats
+    for window, senders in MF.links.getStats(now).items():
+        for sender, x in senders.items():
+            labels = {'sender': sender, 'window': str(window)}
+            MX.registry.gauge('link_messages_per_second', x['rate'], **labels)
+            MX.registry.gauge('link_bytes_per_second', x['bytes'], **labels)
+            MX.registry.gauge('link_loss_percent', x['loss'], **labels)
+            MX.registry.gauge('link_bad_messages', x['bad'], **labels)
+            if 'jitter' in x:
+                MX.registry.gauge('link_jitter_seconds', x['jitter'] / 1000.0, **labels)
+
+
+def requestMission(q, ac_id, master, mlog, forwarding, mission_type, request, fail_name):
+    # command generator, MISSION_COUNT and then the items
+    logger = logging.getLogger()
+    msg_in = yield from MP.requestCount(master, mlog, forwarding, mission_type)
+
+    if str(msg_in) != 'NONE':
+        yield from requestItems(q, msg_in, ac_id, request, master, mlog, forwarding)
+    else:
+        q.put(
+            '{"name":"' + fail_name + '", "INFO":"FAIL. Message_Timeout_Reached"}')
+        logger.info(
+            '{} : FAIL : Message_Timeout_Reached'.format(fail_name))
+
+    logger.info(
+        '**************************************************************')
+    logger.info('')
+
+
+def requestItems(q, msg_in, ac_id, request, master, mlog, forwarding):
+    # command generator, the items once the count is known
+    msg = yield from request(msg_in, ac_id, master, mlog, forwarding)
+    q.put(str(msg))
+
+
+def startFlight(q, consumer_message, icarous_flag, launch, master, mlog, forwarding):
+    # command generator
+    logger = logging.getLogger()
+    yield from MF.startFlight(icarous_flag, launch, master, mlog, forwarding)
+    logger.info('IC {}: Flight Started'.format(ac))
+
+    q.put('{"AIRCRAFT" : '+consumer_message[-3]+', "TYPE":"STARTFLIGHT", "INFO": "SUCCESS"}')
+
+
+def changeParam(q, consumer_message, master, mlog, forwarding):
+    # command generator
+    logger = logging.getLogger()
+    yield from MF.changeParamFloat(consumer_message, master, mlog, forwarding)
+    q.put('{"name":"CHANGE_PARAM", "INFO": "SUCCESS. ' +
+          str(consumer_message)+'"}')
+    logger.info('IC {}: Change Params Success.'.format(ac))
+
+
+def waitForIcarous(seconds):
+    # command generator, telemetry keeps going while icarous loads
+    logger = logging.getLogger()
+    yield CE.Sleep(seconds)
+    logger.info('IC {}: Loading parameters.'.format(ac))
+
+
+def getFloat(command, i, default):
+    try:
+        return float(command[i])
+    except (IndexError, ValueError):
+        return default
+
+
+def waitForWork(m, master):
+    # Block on the command pipe and the mavlink fd instead of spinning on a
+    # non blocking recv. Returns the list of ready objects, empty on timeout.
+    # commands wait in the pipe while the executor is busy
+    waitables = [] if executor.busy() else [m.reader]
+    if forwarding is not None:
+        waitables.append(forwarding)
+    timeout = TICK
+    for wake in [decimator.timeout(), executor.timeout()]:
+        if wake is not None:
+            timeout = min(timeout, wake)
+    if MF.hasPending():
+        timeout = 0
+    elif master == 'FILE':
+        # sleep until the log player has the next message due
+        if logplayer is not None:
+            wake = logplayer.nextDue()
+            if wake is not None:
+                timeout = min(timeout, wake)
+    elif master != 'NONE' and master != 'END':
+        fd = getattr(master, 'fd', None)
+        if fd is not None:
+            waitables.append(fd)
+        else:
+            timeout = POLL
+    return wait(waitables, timeout)
+
+
 # ** ** ** ** ** ** ** ** ** ** ** ** ** ** ** ** ** ** ** ** ** ** ** ** ** ** * **
 #
 #  Messages from aircraft to frontend.
@@ -201,17 +395,23 @@ def update_position(q, TM, master, mlog, forwarding):
     global logplayer
     logger = logging.getLogger()
     global starttime_now
+    global connecting_time
     TM.update_traffic()
 
-    if has_heartbeat == False:
+    # send the latest held message of each rate limited type
+    for x in decimator.due():
+        putMsg(q, *x)
+
+    if has_heartbeat == False and time.time() - connecting_time >= .5:
+        connecting_time = time.time()
         if (ac == 'NONE'):
             id = '{"AIRCRAFT" : "' + str(ac) + '", "TYPE" : "CONNECTING"}'
         else:
             id = '{"AIRCRAFT" : ' + str(ac) + ', "TYPE" : "CONNECTING"}'
-        time.sleep(.5)
         q.put(id)
 
     # Receive and filter messages from each aircraft
+    msg_acs = None
     if master != 'NONE':
         if master != 'FILE':
             ret = MF.recvAndLog(master, mlog, forwarding)
@@ -226,171 +426,195 @@ def update_position(q, TM, master, mlog, forwarding):
                       ', "TYPE" : "RADIO_QUALITY", "PERCENT":' + str(percent) + ', "MISSING": '+str(missing)+'}')
         else:
             write_to_file = False
-            if logplayer is not None and not logplayer.paused:
-                message = logplayer.getNext()
-                stats = logplayer.getStats()
-
-                p_update = '{ "name" : "LOGPLAYER", "CURRENT" : ' + \
-                    str(stats[0])+', "TOTAL" : '+str(stats[1]) + \
-                    ', "PERCENT" : '+str(stats[2])+' }'
-
-                q.put(p_update)
-                if len(message) > 0:
-                    ac = str(message[0])
-                    msg_list = [message[1]]
+            if logplayer is not None and (not logplayer.paused or logplayer.hasSnapshot()):
+                # every message that is due, the player keeps the schedule
+                rows = logplayer.getBatch()
+                if time.time() - starttime_now >= .25:
+                    starttime_now = time.time()
+                    stats = logplayer.getStats()
+                    drift = logplayer.getDrift()
+                    p_update = '{ "name" : "LOGPLAYER", "CURRENT" : ' + \
+                        str(stats[0])+', "TOTAL" : '+str(stats[1]) + \
+                        ', "PERCENT" : '+str(stats[2]) + \
+                        ', "DRIFT" : '+str(round(drift[1] * 1000, 1))+' }'
+                    q.put(p_update)
+                if len(rows) > 0:
+                    msg_list = [x[1] for x in rows]
+                    msg_acs = [str(x[0]) for x in rows]
                 else:
                     return
             else:
                 return
 
         if write_to_file and msg_list[0] is not None:
-            with open('LogFiles/msg_in_{0}_{1}.txt'.format(da_formated, ac), 'a') as f:
-                for i in msg_list:
-                    f.write('Aircraft: ' + str(ac) + '; ' + str(i)+'\n')
+            ML.getMsgLog('LogFiles/msg_in_{0}_{1}.txt'.format(da_formated, ac)).log(ac, msg_list)
 
-        for msg in msg_list:
+        for i, msg in enumerate(msg_list):
+            if msg_acs is not None:
+                # playback batches can hold several aircraft
+                ac = msg_acs[i]
             if msg is not None:
-                # print(msg)
-                if 'BAD_DATA' in str(msg):
-                    # print(msg)
-                    return
-                if msg.name == "MISSION_COUNT":
-                    if msg.mission_type == 1:
-                        if logplayer is not None:
-                            v_count[ac] = msg.count
-                            f_list[ac] = 0
-                            # total number of verticies
-                            gf_list[ac] = [0] * msg.count
-                            logger.info('Vertex count:{}'.format(msg.count))
-
-                        # if rando message appears here re-request points
-                        else:
-                            class Empty:
-                                pass
-                            msg_in = Empty()
-                            msg_in.count = v_count[ac]
-                            msg = CF.requestVert(
-                                msg_in, ac, master, mlog, forwarding)
-                            q.put(str(msg))
-                    elif msg.mission_type == 2:
-                        r_count[ac] = msg.count
-                        r_list[ac] = [0] * msg.count
-                        logger.info('Replan count:{}'.format(msg.count))
-                        # request points
-                        if logplayer is None:
-                            class Empty:
-                                pass
-                            msg_in = Empty()
-                            msg_in.count = r_count[ac]
-                            msg = CF.requestReplan(
-                                msg_in, ac, master, mlog, forwarding)
-                            q.put(str(msg))
+                # replies to a running command go to the command, the rest
+                # to the handler for its type
+                dispatcher.dispatch(msg, q, master, mlog, forwarding)
+
+
+# Handlers for messages from the aircraft, called through the dispatcher
+# with (msg, q, master, mlog, forwarding). Types without a handler are sent
+# to the front end by sendMsg.
+
+def sendMsg(msg, q, master, mlog, forwarding, name=None):
+    # to the front end, unless its type is over its rate
+    if name is None:
+        # get_type() works on every pymavlink version, .name does not
+        name = msg.get_type()
+    if decimator.offer((ac, name), name, (ac, msg, name)):
+        putMsg(q, ac, msg, name)
+
+
+def putMsg(q, ac, msg, name):
+    # encode and queue one message for the server, timing both. Messages
+    # from the link go with their receive time, see metrics.Trace
+    t = time.perf_counter()
+    out = encoder.encode(ac, msg, name)
+    t1 = time.perf_counter()
+    recv = getattr(msg, '_monotonic', None)
+    if recv is None:
+        q.put(out)
+    else:
+        q.put((out, recv, time.monotonic()))
+    MX.registry.observe('stage_seconds', t1 - t, stage='encode')
+    MX.registry.observe('stage_seconds', time.perf_counter() - t1, stage='queue_put')
+
+
+def dropMsg(msg, *args):
+    pass
+
+
+def onMissionCount(msg, q, master, mlog, forwarding):
+    logger = logging.getLogger()
+    if msg.mission_type == 1:
+        if logplayer is not None:
+            v_count[ac] = msg.count
+            f_list[ac] = 0
+            # total number of verticies
+            gf_list[ac] = [0] * msg.count
+            logger.info('Vertex count:{}'.format(msg.count))
+
+        # if rando message appears here re-request points
+        else:
+            class Empty:
+                pass
+            msg_in = Empty()
+            msg_in.count = v_count[ac]
+            if not executor.busy():
+                executor.start('MISSION_COUNT', requestItems(
+                    q, msg_in, ac, CF.requestVert, master, mlog, forwarding))
+    elif msg.mission_type == 2:
+        r_count[ac] = msg.count
+        r_list[ac] = [0] * msg.count
+        logger.info('Replan count:{}'.format(msg.count))
+        # request points
+        if logplayer is None:
+            class Empty:
+                pass
+            msg_in = Empty()
+            msg_in.count = r_count[ac]
+            if not executor.busy():
+                executor.start('MISSION_COUNT', requestItems(
+                    q, msg_in, ac, CF.requestReplan, master, mlog, forwarding))
+    else:
+        wp_count[ac] = msg.count
+        wp_list[ac] = [0] * msg.count
+        logger.info('Mission count:{}'.format(msg.count))
+
+
+def onItemReached(msg, *args):
+    print(msg)
+
+
+def onMissionItem(msg, q, master, mlog, forwarding):
+    if logplayer is not None:
+
+        if ac not in wp_count:
+            return
+
+        if msg.mission_type == 2 and len(r_count) > 0:
+            if r_count[str(ac)] > 0:
+                r_list[str(ac)][int(msg.seq)] = msg
+                if int(msg.seq) == r_count[ac]-1:
+                    msg = CF.sendReplan(r_list, ac)
+                    q.put(msg)
+
+        elif msg.mission_type == 1 and len(gf_list[ac]) > 0:
+
+            f = int(msg.seq)  # fence number
+            numv = int(msg.param1)  # numv for this fence
+            thisv = int(msg.param2)  # id of this v in this fence
+
+            if v_count[ac] == 0:
+                v_count[ac] = numv
+            if f_list[ac] == 0:
+                f_list[f] = numv
+
+            # place this msg in the correct spot
+            n = 0
+            for i in range(f, 0, -1):
+                n = f_list[i-1] + n
+            n = n + thisv
+            gf_list[ac][n] = msg
+
+            # check if all messages have been recieved
+            if all(str(x) != '0' for x in gf_list[ac]):
+                #     # send the message
+                msg = CF.sendVert(gf_list, ac)
+                q.put(msg)
+
+        # need to catch not found error
+        elif (msg.mission_type == 0 or msg.mission_type == 255) and len(wp_count) > 0:
+            if wp_count[ac] > 0:
+                wp_list[str(ac)][msg.seq] = msg
+                if msg.seq == wp_count[ac]-1:
+                    if msg.get_msgId() == mavutil.mavlink.MAVLINK_MSG_ID_MISSION_ITEM_INT:
+                        msg = CF.sendWaypointsInt(wp_list, ac)
                     else:
-                        wp_count[ac] = msg.count
-                        wp_list[ac] = [0] * msg.count
-                        logger.info('Mission count:{}'.format(msg.count))
-                    return
+                        msg = CF.sendWaypoints(wp_list, ac)
+                    q.put(msg)
 
-                elif msg.name == 'MISSION_ACK':
-                    return
 
-                elif msg.name == 'MISSION_REQUEST':
-                    return
+def onParamValue(msg, *args):
+    if str(msg.param_id) == 'STAT_RUNTIME':
+        return
+    sendMsg(msg, *args)
 
-                elif msg.name == 'MISSION_ITEM_REACHED':
-                    print(msg)
-                    return
 
-                elif msg.name == "MISSION_ITEM" or msg.name == 'MISSION_ITEM_INT':
-                    if logplayer is not None:
-
-                        if ac not in wp_count:
-                            return
-
-                        if msg.mission_type == 2 and len(r_count) > 0:
-                            if r_count[str(ac)] > 0:
-                                r_list[str(ac)][int(msg.seq)] = msg
-                                if int(msg.seq) == r_count[ac]-1:
-                                    msg = CF.sendReplan(r_list, ac)
-                                    q.put(msg)
-
-                        elif msg.mission_type == 1 and len(gf_list[ac]) > 0:
-
-                            f = int(msg.seq)  # fence number
-                            numv = int(msg.param1)  # numv for this fence
-                            thisv = int(msg.param2)  # id of this v in this fence
-
-                            if v_count[ac] == 0:
-                                v_count[ac] = numv
-                            if f_list[ac] == 0:
-                                f_list[f] = numv
-
-                            # place this msg in the correct spot
-                            n = 0
-                            for i in range(f, 0, -1):
-                                n = f_list[i-1] + n
-                            n = n + thisv
-                            gf_list[ac][n] = msg
-
-                            # check if all messages have been recieved
-                            if all(str(x) != '0' for x in gf_list[ac]):
-                                #     # send the message
-                                msg = CF.sendVert(gf_list, ac)
-                                q.put(msg)
-
-                        # need to catch not found error
-                        elif (msg.mission_type == 0 or msg.mission_type == 255) and len(wp_count) > 0:
-                            if wp_count[ac] > 0:
-                                wp_list[str(ac)][msg.seq] = msg
-                                if msg.seq == wp_count[ac]-1:
-                                    if 'MISSION_ITEM_INT' in str(msg):
-                                        msg = CF.sendWaypointsInt(wp_list, ac)
-                                    else:
-                                        msg = CF.sendWaypoints(wp_list, ac)
-                                    q.put(msg)
-                    return
+def onStatusText(msg, *args):
+    logger = logging.getLogger()
+    logger.info('IC {} : {}'.format(ac, msg))
+    sendMsg(msg, *args)
 
-                elif msg.name == "PARAM_VALUE":
-                    if str(msg.param_id) == 'STAT_RUNTIME':
-                        return
-                    # elif logplayer is None:
-                    elif '"' not in msg.param_id:
-                        msg.param_id = '"'+msg.param_id+'"'
-                        # print(msg)
-
-                elif msg.name == "STATUSTEXT":
-                    logger.info('IC {} : {}'.format(ac, msg))
-                    msg.text = '"'+msg.text+'"'
-
-                elif msg.name == "ADSB_VEHICLE":
-                    # print(msg)
-                    # if msg.emitter_type == 255:
-                    #     TM.checkTrafficList(msg.ICAO_address)
-
-                    msg.name = "TRAFFIC"
-                    msg.TRAFFIC = msg.ICAO_address
-                    msg.TTYPE = 'ADSB'
-                    msg.LAT = msg.lat
-                    msg.LNG = msg.lon
-                    msg.VEL = msg.hor_velocity
-                    msg.HDG = msg.heading
-                    msg.ALT = msg.altitude
-                    msg.AC = ac
-                    msg.callsign = '"'+str(msg.callsign)+'"'
-                    msg.EMIT = msg.emitter_type
-
-                elif msg.name == 'HEARTBEAT' or msg.name == 'GLOBAL_POSITION_INT':
-                    has_heartbeat = True
-
-                # send the message to the front end
-                m = ''
-                for item in msg._fieldnames:
-                    m = m + ', "{}":{}'.format(item, msg.format_attr(item))
-
-                id = '{"AIRCRAFT" : ' + str(ac) + ', "TYPE" : "' + \
-                    str(msg.name) + '"' + m + '}'
-                # print('id', id)
-                q.put(id)
+
+def onAdsbVehicle(msg, *args):
+    # if msg.emitter_type == 255:
+    #     TM.checkTrafficList(msg.ICAO_address)
+    sendMsg(msg, *args, name='TRAFFIC')
+
+
+def onHeartbeat(msg, *args):
+    global has_heartbeat
+    has_heartbeat = True
+    sendMsg(msg, *args)
+
+
+dispatcher.default = sendMsg
+dispatcher.on(['BAD_DATA', 'MISSION_ACK', 'MISSION_REQUEST'], dropMsg)
+dispatcher.on(['MISSION_COUNT'], onMissionCount)
+dispatcher.on(['MISSION_ITEM_REACHED'], onItemReached)
+dispatcher.on(['MISSION_ITEM', 'MISSION_ITEM_INT'], onMissionItem)
+dispatcher.on(['PARAM_VALUE'], onParamValue)
+dispatcher.on(['STATUSTEXT'], onStatusText)
+dispatcher.on(['ADSB_VEHICLE'], onAdsbVehicle)
+dispatcher.on(['HEARTBEAT', 'GLOBAL_POSITION_INT'], onHeartbeat)
 
 
 # ** ** ** ** ** ** ** ** ** ** ** ** ** ** ** ** ** ** ** ** ** ** ** ** ** ** * **
@@ -437,8 +661,7 @@ def completeCommands(q, msg, TM, master, mlog):
                 ac, d_formated)
             with open(log, 'w') as f:
                 f.write('')
-            mlog = mavutil.mavlink_connection(
-                log, dialect='ardupilotmega', baud=BAUD, write=True, append=True)
+            mlog = TW.TlogWriter(log)
             mavutil.set_dialect("ardupilotmega")
 
             global hitl
@@ -464,78 +687,40 @@ def completeCommands(q, msg, TM, master, mlog):
             logger.info('')
             logger.info(
                 '**************************************************************')
-            msg_in = MF.requestCount(master, mlog, forwarding)
-
-            if str(msg_in) != 'NONE':
-                msg = CF.requestWaypoints(
-                    msg_in, consumer_message[1], master, mlog, forwarding)
-                q.put(str(msg))
-            else:
-                q.put(
-                    '{"name":"WAYPOINT_REQUEST", "INFO":"FAIL. Message_Timeout_Reached"}')
-                logger.info(
-                    'WAYPOINT_REQUEST : FAIL : Message_Timeout_Reached')
-
-            logger.info(
-                '**************************************************************')
-            logger.info('')
+            executor.start('REQUEST_WAYPOINTS', requestMission(
+                q, consumer_message[1], master, mlog, forwarding,
+                mavutil.mavlink.MAV_MISSION_TYPE_MISSION, CF.requestWaypoints, 'WAYPOINT_REQUEST'))
 
         elif 'REQUEST_FENCE' in consumer_message:
             logger.info('')
             logger.info(
                 '**************************************************************')
-            msg_in = MF.requestCountF(master, mlog, forwarding)
-
-            if str(msg_in) != 'NONE':
-                msg = CF.requestVert(
-                    msg_in, consumer_message[1], master, mlog, forwarding)
-                q.put(str(msg))
-            else:
-                q.put(
-                    '{"name":"VERT_REQUEST", "INFO":"FAIL. Message_Timeout_Reached"}')
-                logger.info(
-                    'VERT_REQUEST : FAIL : Message_Timeout_Reached')
-
-            logger.info(
-                '**************************************************************')
-            logger.info('')
+            executor.start('REQUEST_FENCE', requestMission(
+                q, consumer_message[1], master, mlog, forwarding,
+                mavutil.mavlink.MAV_MISSION_TYPE_FENCE, CF.requestVert, 'VERT_REQUEST'))
 
         elif 'REQUEST_REPLAN' in consumer_message:
             logger.info('')
             logger.info(
                 '**************************************************************')
-            msg_in = MF.requestCountR(master, mlog, forwarding)
-
-            if str(msg_in) != 'NONE':
-                msg = CF.requestReplan(
-                    msg_in, consumer_message[1], master, mlog, forwarding)
-                q.put(str(msg))
-            else:
-                q.put(
-                    '{"name":"WAYPOINT_REQUEST", "INFO":"FAIL. Message_Timeout_Reached"}')
-                logger.info(
-                    'WAYPOINT_REQUEST : FAIL : Message_Timeout_Reached')
-
-            logger.info(
-                '**************************************************************')
-            logger.info('')
+            executor.start('REQUEST_REPLAN', requestMission(
+                q, consumer_message[1], master, mlog, forwarding,
+                mavutil.mavlink.MAV_MISSION_TYPE_RALLY, CF.requestReplan, 'WAYPOINT_REQUEST'))
 
         elif 'ADSB_VEHICLE' in consumer_message:
             MF.sendTraffic(consumer_message, master)
 
         elif 'LOAD_FLIGHT_PLAN' in consumer_message:
-            CF.loadFlightPlan(ac, consumer_message, q,
-                              master, mlog, forwarding)
+            executor.start('LOAD_FLIGHT_PLAN', CF.loadFlightPlan(
+                ac, consumer_message, q, master, mlog, forwarding))
 
         elif 'FLIGHT_STARTED' in consumer_message:
             icarous_flag = consumer_message[-1]
             launch = consumer_message[-2]
 
             logger.info('IC {}: Icarous Flag: {}'.format(ac, icarous_flag))
-            MF.startFlight(icarous_flag, launch, master, mlog, forwarding)
-            logger.info('IC {}: Flight Started'.format(ac))
-
-            q.put('{"AIRCRAFT" : '+consumer_message[-3]+', "TYPE":"STARTFLIGHT", "INFO": "SUCCESS"}')
+            executor.start('FLIGHT_STARTED', startFlight(
+                q, consumer_message, icarous_flag, launch, master, mlog, forwarding))
 
         elif 'ADD_TRAFFIC' in consumer_message:
             # print(consumer_message)
@@ -564,7 +749,8 @@ def completeCommands(q, msg, TM, master, mlog):
             TM.remove_traffic(consumer_message)
 
         elif 'LOAD_GEOFENCE' in consumer_message:
-            CF.loadGeoFence(ac, consumer_message, q, master, mlog, forwarding)
+            executor.start('LOAD_GEOFENCE', CF.loadGeoFence(
+                ac, consumer_message, q, master, mlog, forwarding))
 
         elif 'REMOVE_GEOFENCE' in consumer_message:
             #  Not really working, just replacing the fence with another fence with no points
@@ -590,10 +776,8 @@ def completeCommands(q, msg, TM, master, mlog):
 
         elif 'CHANGE_PARAM' in consumer_message:
             logger.info('IC {}: trying to change params'.format(ac))
-            MF.changeParamFloat(consumer_message, master, mlog, forwarding)
-            q.put('{"name":"CHANGE_PARAM", "INFO": "SUCCESS. ' +
-                  str(consumer_message)+'"}')
-            logger.info('IC {}: Change Params Success.'.format(ac))
+            executor.start('CHANGE_PARAM', changeParam(
+                q, consumer_message, master, mlog, forwarding))
 
         elif 'LOAD_WP_FILE' in consumer_message:
             CF.loadFlightPlanFile(ac, consumer_message, q, master, mlog)
@@ -602,7 +786,8 @@ def completeCommands(q, msg, TM, master, mlog):
             CF.loadGeoFenceFile(ac, consumer_message, q, master, mlog)
 
         elif 'LOAD_PARAM_FILE' in consumer_message:
-            CF.loadParamFile(ac, consumer_message, q, master, mlog)
+            executor.start('LOAD_PARAM_FILE', CF.loadParamFile(
+                ac, consumer_message, q, master, mlog))
 
         elif 'SAVE' in consumer_message:
             CF.saveFile(ac, consumer_message, q, master, mlog)
@@ -614,15 +799,29 @@ def completeCommands(q, msg, TM, master, mlog):
             MF.sendUser3(consumer_message[1], master)
 
         elif 'FORWARD' in consumer_message:
+            # ['FORWARD', ip, port, baud] adds a target, baud is not used for udp
+            # ['FORWARD', 'STOP'] stops all, ['FORWARD', 'STOP', ip, port] stops one
             if consumer_message[1] == 'STOP':
-                forwarding.close()
-                forwarding = None
+                if forwarding is not None:
+                    before = forwarding.getTargets()
+                    if len(consumer_message) > 3:
+                        forwarding.remove(consumer_message[2], consumer_message[3])
+                    else:
+                        forwarding.clear()
+                    for addr in set(before) - set(forwarding.getTargets()):
+                        MX.registry.remove(target='{}:{}'.format(*addr))
+                    if not forwarding.hasTargets():
+                        forwarding.close()
+                        forwarding = None
             else:
-                device = 'udp:' + consumer_message[1]+':'+consumer_message[2]
-                baud = consumer_message[3]
-                print(device, baud)
-                forwarding = mavutil.mavlink_connection(
-                    device, baud=baud, input=False, dialect='ardupilotmega')
+                if forwarding is None:
+                    forwarding = FW.Forwarder(master, mlog)
+                try:
+                    forwarding.add(consumer_message[1], consumer_message[2])
+                except (OSError, ValueError, IndexError):
+                    logger.exception('IC {}: Bad forward target {}'.format(ac, consumer_message))
+            if forwarding is not None:
+                logger.info('IC {}: Forwarding to {}'.format(ac, forwarding.getTargets()))
         else:
             print('UNKNOWN MESSAGE: ', consumer_message)
 
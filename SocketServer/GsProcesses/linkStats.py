@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+#
+# Author: Andrew Peters
+#
+# Copyright 2019 United States Government as represented by the Administrator of the National Aeronautics
+# and Space Administration. All Rights Reserved.
+#  
+# Disclaimers
+# No Warranty: THE SUBJECT SOFTWARE IS PROVIDED "AS IS" WITHOUT ANY WARRANTY OF ANY
+# KIND, EITHER EXPRESSED, IMPLIED, OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, ANY
+# WARRANTY THAT THE SUBJECT SOFTWARE WILL CONFORM TO SPECIFICATIONS, ANY IMPLIED
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, OR FREEDOM FROM
+# INFRINGEMENT, ANY WARRANTY THAT THE SUBJECT SOFTWARE WILL BE ERROR FREE, OR ANY
+# WARRANTY THAT DOCUMENTATION, IF PROVIDED, WILL CONFORM TO THE SUBJECT SOFTWARE.
+# THIS AGREEMENT DOES NOT, IN ANY MANNER, CONSTITUTE AN ENDORSEMENT BY GOVERNMENT
+# AGENCY OR ANY PRIOR RECIPIENT OF ANY RESULTS, RESULTING DESIGNS, HARDWARE,
+# SOFTWARE PRODUCTS OR ANY OTHER APPLICATIONS RESULTING FROM USE OF THE SUBJECT
+# SOFTWARE.  FURTHER, GOVERNMENT AGENCY DISCLAIMS ALL WARRANTIES AND LIABILITIES
+# REGARDING THIRD-PARTY SOFTWARE, IF PRESENT IN THE ORIGINAL SOFTWARE, AND
+# DISTRIBUTES IT "AS IS."
+#  
+# Waiver and Indemnity:  RECIPIENT AGREES TO WAIVE ANY AND ALL CLAIMS AGAINST THE UNITED
+# STATES GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR
+# RECIPIENT.  IF RECIPIENT'S USE OF THE SUBJECT SOFTWARE RESULTS IN ANY LIABILITIES,
+# DEMANDS, DAMAGES, EXPENSES OR LOSSES ARISING FROM SUCH USE, INCLUDING ANY
+# DAMAGES FROM PRODUCTS BASED ON, OR RESULTING FROM, RECIPIENT'S USE OF THE SUBJECT
+# SOFTWARE, RECIPIENT SHALL INDEMNIFY AND HOLD HARMLESS THE UNITED STATES
+# GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR RECIPIENT,
+# TO THE EXTENT PERMITTED BY LAW.  RECIPIENT'S SOLE REMEDY FOR ANY SUCH MATTER SHALL
+# BE THE IMMEDIATE, UNILATERAL TERMINATION OF THIS AGREEMENT.
+#
+
+
+from pymavlink import mavutil
+
+
+WINDOWS = [1, 10, 60]  # seconds
+RECEIVED, LOST, BYTES, BAD = range(4)
+# an 8 bit sequence gap bigger than this is a repeated or reordered packet,
+# or a sender that restarted, not loss
+MAX_GAP = 128
+
+
+# Counts for the last 1, 10 and 60 seconds. Each second has a bucket in a
+# ring as long as the biggest window, and each window keeps a running total,
+# the bucket that falls out of a window is subtracted as the seconds go by.
+# Adding a message and reading a window do not depend on the window length.
+class Windows:
+    def __init__(self, windows=WINDOWS):
+        self.windows = windows
+        self.size = max(windows)
+        self.buckets = [[0, 0, 0, 0] for i in range(self.size)]
+        self.totals = [[0, 0, 0, 0] for w in windows]
+        self.sec = None
+
+    def advance(self, sec):
+        if self.sec is None or sec - self.sec > self.size:
+            # first message, or quiet for longer than every window
+            for b in self.buckets:
+                b[:] = [0, 0, 0, 0]
+            for t in self.totals:
+                t[:] = [0, 0, 0, 0]
+        else:
+            for t in range(self.sec + 1, sec + 1):
+                for total, w in zip(self.totals, self.windows):
+                    old = self.buckets[(t - w) % self.size]
+                    for f in range(4):
+                        total[f] -= old[f]
+                self.buckets[t % self.size][:] = [0, 0, 0, 0]
+        self.sec = sec
+
+    def add(self, sec, received, lost, size, bad):
+        if self.sec is None or sec > self.sec:
+            self.advance(sec)
+        # a late timestamp counts in the current second
+        b = self.buckets[self.sec % self.size]
+        b[RECEIVED] += received
+        b[LOST] += lost
+        b[BYTES] += size
+        b[BAD] += bad
+        for t in self.totals:
+            t[RECEIVED] += received
+            t[LOST] += lost
+            t[BYTES] += size
+            t[BAD] += bad
+
+    def get(self, i, now):
+        # counts of window i up to now, the current second counts whole
+        sec = int(now)
+        if self.sec is None or sec - self.sec >= self.windows[i]:
+            return [0, 0, 0, 0]
+        if sec > self.sec:
+            self.advance(sec)
+        return self.totals[i][:]
+
+
+def summary(counts, seconds, jitter=None):
+    received, lost, size, bad = counts
+    sent = received + lost
+    x = {'loss': round(100.0 * lost / sent, 1) if sent > 0 else 0.0,
+         'rate': round(received / seconds, 1),
+         'bytes': round(size / seconds, 1),
+         'bad': bad}
+    if jitter is not None:
+        x['jitter'] = round(jitter * 1000, 2)  # ms
+    return x
+
+
+# One sender on the link, a (sysid, compid) with its own sequence numbers.
+class Stream:
+    def __init__(self, windows=WINDOWS):
+        self.seq = None
+        self.last = None  # arrival time of the last message
+        self.gap = None   # time between the last two messages
+        self.jitter = 0   # smoothed change in the gap, as in RFC 3550
+        self.windows = Windows(windows)
+
+    def add(self, seq, size, now):
+        lost = 0
+        if self.seq is not None:
+            gap = (seq - self.seq - 1) & 0xFF
+            if gap <= MAX_GAP:
+                lost = gap
+        self.seq = seq
+
+        if self.last is not None:
+            gap = now - self.last
+            if self.gap is not None:
+                self.jitter += (abs(gap - self.gap) - self.jitter) / 16
+            self.gap = gap
+        self.last = now
+
+        self.windows.add(int(now), 1, lost, size, 0)
+        return lost
+
+
+# Radio statistics for one link, per sender and for the whole link. Bad
+# data has no trustworthy header so it only counts for the whole link.
+class LinkStats:
+    def __init__(self, windows=WINDOWS):
+        self.windows = windows
+        self.streams = {}  # (sysid, compid): Stream
+        self.total = Windows(windows)
+
+    def add(self, msg, now):
+        size = len(msg.get_msgbuf())
+        if msg.get_msgId() == mavutil.mavlink.MAVLINK_MSG_ID_BAD_DATA:
+            self.total.add(int(now), 0, 0, size, 1)
+            return
+        key = (msg.get_srcSystem(), msg.get_srcComponent())
+        stream = self.streams.get(key)
+        if stream is None:
+            stream = Stream(self.windows)
+            self.streams[key] = stream
+        lost = stream.add(msg.get_seq(), size, now)
+        self.total.add(int(now), 1, lost, size, 0)
+
+    def quality(self, now, i=1):
+        # [percent good, percent missing] over window i, for RADIO_QUALITY
+        received, lost, size, bad = self.total.get(i, now)
+        percent = int(100 * received / (received + bad)) if received + bad > 0 else 0
+        missing = round(100.0 * lost / (received + lost), 1) if received + lost > 0 else 0.0
+        return [percent, missing]
+
+    def getStats(self, now):
+        # {window: {'link': summary, 'sysid:compid': summary}}
+        stats = {}
+        for i, w in enumerate(self.windows):
+            x = {'link': summary(self.total.get(i, now), w)}
+            for key, stream in self.streams.items():
+                x['{}:{}'.format(*key)] = summary(stream.windows.get(i, now), w, stream.jitter)
+            stats[w] = x
+        return stats
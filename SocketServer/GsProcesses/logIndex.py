@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+
+#
+# Author: Andrew Peters
+#
+# Copyright 2019 United States Government as represented by the Administrator of the National Aeronautics
+# and Space Administration. All Rights Reserved.
+#  
+# Disclaimers
+# No Warranty: THE SUBJECT SOFTWARE IS PROVIDED "AS IS" WITHOUT ANY WARRANTY OF ANY
+# KIND, EITHER EXPRESSED, IMPLIED, OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, ANY
+# WARRANTY THAT THE SUBJECT SOFTWARE WILL CONFORM TO SPECIFICATIONS, ANY IMPLIED
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, OR FREEDOM FROM
+# INFRINGEMENT, ANY WARRANTY THAT THE SUBJECT SOFTWARE WILL BE ERROR FREE, OR ANY
+# WARRANTY THAT DOCUMENTATION, IF PROVIDED, WILL CONFORM TO THE SUBJECT SOFTWARE.
+# THIS AGREEMENT DOES NOT, IN ANY MANNER, CONSTITUTE AN ENDORSEMENT BY GOVERNMENT
+# AGENCY OR ANY PRIOR RECIPIENT OF ANY RESULTS, RESULTING DESIGNS, HARDWARE,
+# SOFTWARE PRODUCTS OR ANY OTHER APPLICATIONS RESULTING FROM USE OF THE SUBJECT
+# SOFTWARE.  FURTHER, GOVERNMENT AGENCY DISCLAIMS ALL WARRANTIES AND LIABILITIES
+# REGARDING THIRD-PARTY SOFTWARE, IF PRESENT IN THE ORIGINAL SOFTWARE, AND
+# DISTRIBUTES IT "AS IS."
+#  
+# Waiver and Indemnity:  RECIPIENT AGREES TO WAIVE ANY AND ALL CLAIMS AGAINST THE UNITED
+# STATES GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR
+# RECIPIENT.  IF RECIPIENT'S USE OF THE SUBJECT SOFTWARE RESULTS IN ANY LIABILITIES,
+# DEMANDS, DAMAGES, EXPENSES OR LOSSES ARISING FROM SUCH USE, INCLUDING ANY
+# DAMAGES FROM PRODUCTS BASED ON, OR RESULTING FROM, RECIPIENT'S USE OF THE SUBJECT
+# SOFTWARE, RECIPIENT SHALL INDEMNIFY AND HOLD HARMLESS THE UNITED STATES
+# GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR RECIPIENT,
+# TO THE EXTENT PERMITTED BY LAW.  RECIPIENT'S SOLE REMEDY FOR ANY SUCH MATTER SHALL
+# BE THE IMMEDIATE, UNILATERAL TERMINATION OF THIS AGREEMENT.
+#
+
+
+import os
+import mmap
+import struct
+import bisect
+import logging
+from array import array
+
+from pymavlink.dialects.v20 import ardupilotmega as mavlink
+
+
+# Random access reader for .tlog and .mlog files used by the LogPlayer.
+#   tlog record: [8 byte time usec][mavlink packet]
+#   mlog record: [8 byte aircraft][8 byte time usec][mavlink packet]
+# The file is memory mapped and indexed once, the index is a few arrays
+# (offset, length, time, aircraft, msg id) and is saved next to the log as
+# <log>.idx so the next load skips the scan. Messages are only decoded
+# when they are asked for, indexing returns the same [ac, msg, timestamp, delta]
+# rows readLogFile.readTlog/readMlog build for the whole file.
+
+IDX_MAGIC = b'WGSIDX01'
+IDX_HEADER = struct.Struct('<8sQQQ')  # magic, log size, log mtime ns, count
+V1 = 0xFE
+V2 = 0xFD
+
+
+def packetLength(buf, pos):
+    # length of the mavlink packet starting at pos, 0 if there is none
+    if pos + 2 > len(buf):
+        return 0
+    magic = buf[pos]
+    if magic == V1:
+        return buf[pos + 1] + 8
+    if magic == V2:
+        if pos + 3 > len(buf):
+            return 0
+        n = buf[pos + 1] + 12
+        if buf[pos + 2] & 0x01:  # signed
+            n += 13
+        return n
+    return 0
+
+
+def packetId(buf, pos):
+    if buf[pos] == V1:
+        return buf[pos + 5]
+    return buf[pos + 7] | (buf[pos + 8] << 8) | (buf[pos + 9] << 16)
+
+
+class LogIndex:
+    def __init__(self, path, filetype):
+        logger = logging.getLogger()
+        self.path = path
+        self.filetype = filetype  # tlog, mlog
+        self.head = 16 if filetype == 'mlog' else 8
+        self.f = open(path, 'rb')
+        size = os.fstat(self.f.fileno()).st_size
+        self.buf = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else b''
+        self.mav = mavlink.MAVLink(None)
+        self.mav.robust_parsing = True
+
+        self.offsets = array('Q')  # start of the mavlink packet
+        self.lengths = array('H')
+        self.times = array('d')    # seconds from the first record
+        self.acs = array('I')
+        self.ids = array('I')
+
+        if not self.loadIndex():
+            self.buildIndex()
+            self.saveIndex()
+        logger.info('Playback: Indexed {} messages in {}'.format(len(self), path))
+
+    def stamp(self):
+        st = os.stat(self.path)
+        return st.st_size, st.st_mtime_ns
+
+    def idxPath(self):
+        return self.path + '.idx'
+
+    def buildIndex(self):
+        buf = self.buf
+        end = len(buf)
+        pos = 0
+        start = None
+        head = self.head
+        while pos + head < end:
+            if self.filetype == 'mlog':
+                (ac,) = struct.unpack_from('>Q', buf, pos)
+                (t,) = struct.unpack_from('>Q', buf, pos + 8)
+            else:
+                ac = 1
+                (t,) = struct.unpack_from('>Q', buf, pos)
+            p = pos + head
+            n = packetLength(buf, p)
+            if n == 0 or p + n > end:
+                # not a record boundary, step forward until one lines up
+                pos += 1
+                continue
+            if start is None:
+                start = t * 1.0e-6
+            self.offsets.append(p)
+            self.lengths.append(n)
+            self.times.append(t * 1.0e-6 - start)
+            self.acs.append(ac & 0xFFFFFFFF)
+            self.ids.append(packetId(buf, p))
+            pos = p + n
+
+    def loadIndex(self):
+        try:
+            with open(self.idxPath(), 'rb') as f:
+                magic, size, mtime, count = IDX_HEADER.unpack(f.read(IDX_HEADER.size))
+                if magic != IDX_MAGIC or (size, mtime) != self.stamp():
+                    return False
+                for a in self.arrays():
+                    a.fromfile(f, count)
+            return True
+        except (OSError, EOFError, struct.error):
+            for a in self.arrays():
+                del a[:]
+            return False
+
+    def saveIndex(self):
+        # the sidecar is only a cache, a read only LogFiles is fine
+        try:
+            size, mtime = self.stamp()
+            with open(self.idxPath(), 'wb') as f:
+                f.write(IDX_HEADER.pack(IDX_MAGIC, size, mtime, len(self)))
+                for a in self.arrays():
+                    a.tofile(f)
+        except OSError:
+            pass
+
+    def arrays(self):
+        return [self.offsets, self.lengths, self.times, self.acs, self.ids]
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def getTime(self, i):
+        return self.times[i]
+
+    def getAc(self, i):
+        return self.acs[i]
+
+    def getMsgId(self, i):
+        return self.ids[i]
+
+    def getLink(self, i):
+        # (seq, sysid, compid) straight from the packet header, no decode
+        p = self.offsets[i]
+        if self.buf[p] == V1:
+            return self.buf[p + 2], self.buf[p + 3], self.buf[p + 4]
+        return self.buf[p + 4], self.buf[p + 5], self.buf[p + 6]
+
+    def find(self, t):
+        # first message at or after t seconds from the start of the log
+        return bisect.bisect_left(self.times, t)
+
+    def positions(self, ids):
+        # {(ac, msg id): array of message numbers} for the given msg ids,
+        # one pass over the index, used to find state at a seek point
+        ids = set(ids)
+        out = {}
+        for i in range(len(self.ids)):
+            msg_id = self.ids[i]
+            if msg_id in ids:
+                key = (self.acs[i], msg_id)
+                a = out.get(key)
+                if a is None:
+                    a = out[key] = array('Q')
+                a.append(i)
+        return out
+
+    def decode(self, i):
+        p = self.offsets[i]
+        try:
+            return self.mav.decode(bytearray(self.buf[p:p + self.lengths[i]]))
+        except mavlink.MAVError:
+            return None
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError('log index out of range')
+        delta = self.times[i] - self.times[i - 1] if i > 0 else 0
+        return [self.acs[i], self.decode(i), self.times[i], delta]
+
+    def close(self):
+        if isinstance(self.buf, mmap.mmap):
+            self.buf.close()
+        self.f.close()
@@ -40,20 +40,20 @@ import struct
 import logging
 import sys
 import math
-from random import random
+import select
+
+import GsProcesses.commandExecutor as CE
+import GsProcesses.linkStats as LS
+import GsProcesses.metrics as MX
 
 count = 0
 count1 = 0
 s = 0.00001
-msg_count_array = [0,0,0,0,0,0,0,0,0,0]
-start = time.time()
-msg_count = 1  # avoid divide by zero
-m_count = 1
-none_count = 0
-bad_count = 0
-pre_seq = 0
-missing = 0
 targetComponent = 5
+MAX_READS = 64
+held = []         # received but not yet returned by recvAndLog
+quality = [0, 0]  # last radio quality, [percent, percent missing]
+links = LS.LinkStats()  # loss, rate and jitter per sender, see linkStats
 
 # Util
 
@@ -66,6 +66,40 @@ def setTargetComponent(comp):
 
 # Mavlink Commands
 
+def readAvailable(master):
+    # read everything waiting on the link, up to MAX_READS datagrams or
+    # serial reads so commands are not starved by a busy link
+    data = []
+    for i in range(MAX_READS):
+        m = master.recv()
+        if len(m) == 0:
+            break
+        data.append(m)
+    return data
+
+
+def parseBatch(master, data):
+    # parse every complete message, a partial message stays in the parser
+    # buffer until the rest of it arrives
+    msgs = []
+    for m in data:
+        if master.first_byte:
+            master.auto_mavlink_version(m)
+        try:
+            x = master.mav.parse_buffer(m)
+        except UnicodeDecodeError as e:
+            print(e)
+            print(m)
+            continue
+        if x is not None:
+            msgs.extend(x)
+    return msgs
+
+
+def hasPending():
+    return len(held) > 0
+
+
 def requestDataStream(BAUD, master):
     global targetComponent
     if targetComponent is None:
@@ -83,169 +117,57 @@ def recvAndLog(master, mlog, forwarding):
     global s
     global count
     global count1
-    global msg_count
 
+    if len(held) > 0:
+        # messages received while a blocking command waited, already logged
+        msg = held[:]
+        del held[:]
+        return (msg, quality[0], quality[1])
 
     if master != 'NONE' and master is not None:
         master.pre_message()
-        m = master.recv()
-        msg = []
-        if len(m) > 0:
-
-            if master.first_byte:
-                master.auto_mavlink_version(m)
-            try:
-                msg.append(master.mav.parse_char(m))
-            except UnicodeDecodeError as e:
-                print(e)
-                print(m)
-                msg.append(None)
+        t = time.perf_counter()
+        data = readAvailable(master)
+        if len(data) > 0:
+            # receive time carried to the websockets for the latency trace
+            recv = time.monotonic()
+            t1 = time.perf_counter()
+            MX.registry.observe('stage_seconds', t1 - t, stage='receive')
+            MX.registry.inc('mavlink_bytes_total', sum(len(x) for x in data))
+            # raw bytes out to the forward targets before anything else
+            if forwarding is not None:
+                forwarding.send(data)
+            msg = parseBatch(master, data)
+            MX.registry.observe('stage_seconds', time.perf_counter() - t1, stage='parse')
+            MX.registry.inc('mavlink_messages_total', len(msg))
 
             # mlog.write(m)          use this to generate a tlog.raw\
 
-            if msg[0] is not None:
-                try:
-                    q = msg[0]._instance_field
-                    # print(q)
-                except:    
-                    msg[0]._instance_field = None
-                
-                master.post_message(msg[0])
-                usec = int(time.time() * 1.0e6)
+            if len(msg) > 0:
+                # one timestamp for the whole batch
+                now = time.time()
+                usec = int(now * 1.0e6)
                 usec = (usec & ~3 | 3)
-                x = bytearray(struct.pack('>Q', usec)) + m
+                stamp = struct.pack('>Q', usec)
+                x = bytearray()
+                for i in msg:
+                    try:
+                        q = i._instance_field
+                    except:
+                        i._instance_field = None
+                    master.post_message(i)
+                    i._timestamp = now
+                    i._monotonic = recv
+                    if i.get_type() != 'BAD_DATA':
+                        x += stamp + i.get_msgbuf()
+                t = time.perf_counter()
                 mlog.write(x)
+                MX.registry.observe('stage_seconds', time.perf_counter() - t, stage='tlog_write')
                 # print(x)
                 # print(msg[0])
-                if forwarding is not None:
-                    forwarding.mav.seq = msg[0].get_seq()
-                    forwarding.mav.srcSystem = msg[0].get_srcSystem()
-                    forwarding.mav.srcComponent = msg[0].get_srcComponent()
-                    # if msg[0].name == 'GLOBAL_POSITION_INT':
-                    #     # print(msg[0])
-                    #     new_m = forwarding.mav.global_position_int_encode(
-                    #         msg[0].time_boot_ms, 
-                    #         msg[0].lat, 
-                    #         msg[0].lon, 
-                    #         msg[0].relative_alt, 
-                    #         msg[0].relative_alt, 
-                    #         msg[0].vx, 
-                    #         msg[0].vy, 
-                    #         msg[0].vz, 
-                    #         msg[0].hdg)
-
-                    #     y = new_m.pack(forwarding.mav)
-                    #     forwarding.write(y)
-                        
-                    #     count += 1
-                    #     if count > 5:
-                    #         # if using rotorsim we will need to inject vfr_hud messages, and battery message
-                    #         s = math.sqrt((msg[0].vx / 100) ** 2 + (msg[0].vy/100)**2)
-                    #         new_m = forwarding.mav.vfr_hud_encode(s, 100.0, int(msg[0].hdg * .01), 0, msg[0].relative_alt, msg[0].vz)
-                    #         y = new_m.pack(forwarding.mav)
-                    #         forwarding.write(y)
-
-                    #         # need to use the sys_status message for battery remaining
-                    #         new_m = forwarding.mav.battery_status_encode(0, 0, 3, 2000, [
-                    #            1258, 65535, 65535, 65535, 65535, 65535, 65535, 65535, 65535, 65535], -1, -1, -1, 60)
-                    #         y = new_m.pack(forwarding.mav)
-                    #         forwarding.write(y)
-                    #         count = 0
-
-                    # elif msg[0].name == 'HEARTBEAT':
-                    #     # inject a heartbeat
-                    #     # new_m = forwarding.mav.heartbeat_encode(14, 3, 81, 0, 3, 3)
-                    #     # print(msg[0])
-                    #     new_m = forwarding.mav.heartbeat_encode(
-                    #         msg[0].type, 
-                    #         msg[0].autopilot, 
-                    #         msg[0].base_mode, 
-                    #         msg[0].custom_mode, 
-                    #         msg[0].system_status, 
-                    #         msg[0].mavlink_version)
-                    #     y = new_m.pack(forwarding.mav)
-                    #     forwarding.write(y)
-                        
-                    #     # inject a sys_status message
-                    #     new_m = forwarding.mav.sys_status_encode(56743199, 39918639, 57653199, 550, 24907, 0, 100, 0, 0, 0, 0, 0, 0)
-                    #     y = new_m.pack(forwarding.mav)
-                    #     forwarding.write(y)
-
-                    # elif msg[0].name == 'MISSION_COUNT':
-                    #     new_m = forwarding.mav.mission_count_encode(
-                    #         msg[0].target_system, 
-                    #         msg[0].target_component, 
-                    #         msg[0].count, 
-                    #         msg[0].mission_type)
-                    #     y = new_m.pack(forwarding.mav)
-                    #     forwarding.write(y)
-
-                    # elif msg[0].name == 'MISSION_ITEM':
-                    #     new_m = forwarding.mav.mission_item_encode(
-                    #         msg[0].target_system,
-                    #         msg[0].target_component,
-                    #         msg[0].seq,
-                    #         msg[0].frame,
-                    #         msg[0].command, 
-                    #         msg[0].current,
-                    #         msg[0].autocontinue,
-                    #         msg[0].param1,
-                    #         msg[0].param2,
-                    #         msg[0].param3,
-                    #         msg[0].param4, 
-                    #         msg[0].x, 
-                    #         msg[0].y, 
-                    #         msg[0].z, 
-                    #         msg[0].mission_type)
-                    #     y = new_m.pack(forwarding.mav)
-                    #     forwarding.write(y)
-
-                    # elif msg[0].name == 'PARAM_VALUE':
-                    #     try:
-                    #         new_m = forwarding.mav.param_value_encode(
-                    #             msg[0].param_id,
-                    #             msg[0].param_value,
-                    #             msg[0].param_type,
-                    #             msg[0].param_count, 
-                    #             msg[0].param_index)
-                    #         y = new_m.pack(forwarding.mav)
-                    #         forwarding.write(y)
-                    #     except:
-                    #         print(msg[0])
-                    
-                    # elif msg[0].name == 'STATUSTEXT':
-                    #     try:
-                    #         new_m = forwarding.mav.statustext_encode(
-                    #             msg[0].severity,
-                    #             str(msg[0].text))
-                    #         y = new_m.pack(forwarding.mav)
-                    #         forwarding.write(y)
-                            
-                    #         if msg[0].text == 'IC:Starting Mission':
-                    #             custom_mode = 1
-                    #         elif msg[0].text == 'IC: Landing':
-                    #             custom_mode = 5
-                    #         else: 
-                    #             return ([None], 0, 0)
-
-                    #         new_m = forwarding.mav.heartbeat_encode(
-                    #             msg[0].type, 
-                    #             msg[0].autopilot, 
-                    #             msg[0].base_mode, 
-                    #             custom_mode, 
-                    #             msg[0].system_status, 
-                    #             msg[0].mavlink_version)
-                    #         y = new_m.pack(forwarding.mav)
-                    #         forwarding.write(y)
-                            
-                    #     except: 
-                    #         print(msg[0])
-                    # else:
-                    #     print(msg[0])
-                    forwarding.write(m)
 
                 # Turn this on for message injection into master
-                # else:
+                # if forwarding is None:
                 #     if msg[0].name == 'GLOBAL_POSITION_INT':
                 #         if count1 > 5:                           #, type,min,max type,min,max type,min,max type,min,max type,min,max
                 #             # test band fragmentation
@@ -266,285 +188,70 @@ def recvAndLog(master, mlog, forwarding):
                 #         else:
                 #             count1 +=1
 
-                if forwarding != 'NONE' and forwarding is not None:
-                    forwarding.pre_message()
-                    m = forwarding.recv()
-                    fmsg = []
-                    if len(m) > 0:
-
-                        if forwarding.first_byte:
-                            forwarding.auto_mavlink_version(m)
-                        try:
-                            fmsg.append(forwarding.mav.parse_char(m))
-                        except UnicodeDecodeError as e:
-                            print(e)
-                            print(m)
-                            fmsg.append(None)
-
-                        # mlog.write(m)          use this to generate a tlog.raw\
-
-                        if fmsg[0] is not None:
-                            try:
-                                q = fmsg[0]._instance_field
-                                print(q)
-                            except:    
-                                fmsg[0]._instance_field = None
-                            forwarding.post_message(fmsg[0])
-                            usec = int(time.time() * 1.0e6)
-                            usec = (usec & ~3 | 3)
-                            x = bytearray(struct.pack('>Q', usec)) + m
-                            mlog.write(x)
-                            # print(x)
-                            # print(fmsg[0])
-                            if master is not None:
-                                master.mav.seq = fmsg[0].get_seq()
-                                master.mav.srcSystem = fmsg[0].get_srcSystem()
-                                master.mav.srcComponent = fmsg[0].get_srcComponent()
-                                
-                                # if fmsg[0].name == 'PARAM_REQUEST_LIST':
-                                #     # inject a heartbeat
-                                #     new_m = master.mav.param_request_list_encode(
-                                #         fmsg[0].target_system, 
-                                #         fmsg[0].target_component)
-                                #     y = new_m.pack(master.mav)
-                                #     master.write(y)
-
-                                # elif fmsg[0].name == 'MISSION_REQUEST':
-                                #     new_m = master.mav.mission_request_encode(
-                                #         fmsg[0].target_system, 
-                                #         fmsg[0].target_component, 
-                                #         fmsg[0].seq,
-                                #         fmsg[0].mission_type)
-                                #     y = new_m.pack(master.mav)
-                                #     master.write(y)
-
-                                # elif fmsg[0].name == 'MISSION_REQUEST_LIST':
-                                #     new_m = master.mav.mission_request_list_encode(
-                                #         fmsg[0].target_system, 
-                                #         fmsg[0].target_component, 
-                                #         fmsg[0].mission_type)
-                                #     y = new_m.pack(master.mav)
-                                #     master.write(y)
-                                # else:
-                                #     print('FORWARDING: {}'.format(fmsg[0]))
-                                master.write(m)
-                    
             else:
-                if forwarding is not None:
-                    forwarding.write(m)
+                msg = [None]
 
             # good for debuging
             # (tusec,) = struct.unpack('>Q', x[0:8])
             # print(usec, tusec, len(x), len(m), len(x)-len(m), m,  x)
 
-            percent, percent_missing = calcRadioQuality(msg[0])
-            return (msg, percent, percent_missing)
+            now = time.time()
+            for i in msg:
+                if i is not None:
+                    links.add(i, now)
+            quality[:] = links.quality(now)
+            return (msg, quality[0], quality[1])
         else:
             return ([None], 0, 0)
     else:
-        msg_count = 0
         return ([None], 0, 0)
 
-def calcRadioQuality(msg):
-    global msg_count
-    global m_count
-    global none_count
-    global bad_count
-    global missing
-    global pre_seq
-    global msg_count_array
-    global start
-    test = False
-
-    if (time.time() - start) > .25:
-        # Test degraded comms
-        if test:
-            rand = random()
-            if rand >= .8:
-                msg = 'BAD_DATA'
-
-        if 'BAD_DATA' in str(msg):
-            bad_count += 1
-        elif msg is not None:
-
-            if (time.time() - start) >.5:
-                percent_missing = int(missing / (msg_count + missing) * 100)
-                msg_count_array.append(percent_missing)
-                msg_count_array.pop(0)
-                missing = 0
-                m_count = 1
-                start = time.time()
-
-            msg_count += 1
-            m_count +=1
-
-            seq = msg.get_seq()
-            if seq != pre_seq+1 and seq != 0:
-                missing = abs(missing + (seq - pre_seq))
-            pre_seq = seq
-
-    percent = int(msg_count/(msg_count+bad_count) * 100)
-    percent_missing = sum(msg_count_array[:])/1000
-    return percent, percent_missing
-
-
-def recvMatchAndLog(master, mlog, forwarding, t):
-    logger = logging.getLogger()
-    t_now = time.time()
-    timeout = 2
-
-    while True:
-        msg = recvAndLog(master, mlog, forwarding)
-        msg = msg[0][0]
-
-        if msg is not None:
-            match = [x for x in t if x in str(msg)]
-            if len(match) > 0:
-                logger.info('recv, match, and log {}'.format(msg))
-                print('Recieved: ', msg)
-                # print('Msg Comp:', msg.get_srcComponent())
-                return msg
-
-        elif time.time() - t_now > timeout:
-            print('Request Timeout:', t)
-            return
-
-
-def sendHeartbeat(master):
-    global targetComponent
-    if targetComponent is None:
-        component = master.target_component
-    else:
-        component = targetComponent
-    master.mav.command_long_send(master.target_system,
-                                 component,
-                                 mavutil.mavlink.HEARTBEAT,
-                                 0,  # confirmation
-                                 6,  # type
-                                 8,  # autopilot
-                                 0,  # base mode
-                                 0,  # custom mode
-                                 0,  # status
-                                 3,  # version
-                                 0
-                                 )
-
-
-def requestCount(master, mlog, forwarding):
-    global targetComponent
-    if targetComponent is None:
-        component = master.target_component
-    else:
-        component = targetComponent
-    # print('comp',component)
-    master.mav.mission_request_list_send(master.target_system,
-                                         component,
-                                         mavutil.mavlink.MAV_MISSION_TYPE_MISSION)
-
-    msg_in = recvMatchAndLog(master, mlog, forwarding, ['MISSION_COUNT'])
-    return msg_in
-
-
-def requestCountF(master, mlog, forwarding):
-    global targetComponent
-    if targetComponent is None:
-        component = master.target_component
-    else:
-        component = targetComponent
-    # print('comp',component)
-    master.mav.mission_request_list_send(master.target_system,
-                                         component,
-                                         mavutil.mavlink.MAV_MISSION_TYPE_FENCE)
-
-    msg_in = recvMatchAndLog(master, mlog, forwarding, ['MISSION_COUNT'])
-    return msg_in
-
-
-def requestCountR(master, mlog, forwarding):
-    global targetComponent
-    if targetComponent is None:
-        component = master.target_component
-    else:
-        component = targetComponent
-    # print('comp',component)
-    master.mav.mission_request_list_send(master.target_system,
-                                         component,
-                                         mavutil.mavlink.MAV_MISSION_TYPE_RALLY)
-
-    msg_in = recvMatchAndLog(master, mlog, forwarding, ['MISSION_COUNT'])
-    return msg_in
-
-
-def requestWaypoints(i, master, mlog, forwarding):
-    global targetComponent
-    if targetComponent is None:
-        component = master.target_component
-    else:
-        component = targetComponent
-    master.mav.mission_request_send(master.target_system,
-                                    component,
-                                    i,
-                                    mavutil.mavlink.MAV_MISSION_TYPE_MISSION)
-    msg_in = recvMatchAndLog(master, mlog, forwarding, ['MISSION_ITEM'])
-    return msg_in
-
-
-def requestVert(i, master, mlog, forwarding):
-    global targetComponent
-    if targetComponent is None:
-        component = master.target_component
-    else:
-        component = targetComponent
-    # print('comp',component)
-    master.mav.mission_request_send(master.target_system,
-                                    component,
-                                    i,
-                                    mavutil.mavlink.MAV_MISSION_TYPE_FENCE)
-    msg_in = recvMatchAndLog(master, mlog, forwarding, ['MISSION_ITEM'])
-    return msg_in
-
-
-def requestReplan(i, master, mlog, forwarding):
-    global targetComponent
-    if targetComponent is None:
-        component = master.target_component
-    else:
-        component = targetComponent
-    master.mav.mission_request_send(master.target_system,
-                                    component,
-                                    i,
-                                    mavutil.mavlink.MAV_MISSION_TYPE_RALLY)
-    msg_in = recvMatchAndLog(master, mlog, forwarding, ['MISSION_ITEM'])
-    return msg_in
 
-
-def setFlightMode(mode, master, mlog, forwarding):
-    logger = logging.getLogger()
-    mode_id = master.mode_mapping()[mode]
-    logger.info('SERVER: Mode Id {}'.format(mode_id))
-    master.mav.set_mode_send(
-        master.target_system,
-        mavutil.mavlink.MAV_MODE_FLAG_CUSTOM_MODE_ENABLED,
-        mode_id)
-
-    msg_in = recvMatchAndLog(master, mlog, forwarding, ['COMMAND_ACK'])
-    logger.info('SERVER: Set Mode: {}'.format(msg_in))
-
-
-def sendClearMission(master, mlog, forwarding):
+def recvMatchAndLog(master, mlog, forwarding, t, timeout=2):
+    # the next message of one of the types in t, None after timeout.
+    # Everything else received meanwhile is held for the next recvAndLog.
     logger = logging.getLogger()
-    # Clear old WP's
-    global targetComponent
-    if targetComponent is None:
-        component = master.target_component
-    else:
-        component = targetComponent
-    master.mav.mission_clear_all_send(master.target_system,
-                                      component,
-                                      mavutil.mavlink.MAV_MISSION_TYPE_ALL)
-
-    msg_in = recvMatchAndLog(master, mlog, forwarding, ['MISSION_ACK'])
-    logger.info('SERVER: Clear Mission {}'.format(msg_in))
+    msg = runBlocking(waitOnce(t, timeout), master, mlog, forwarding)
+    if msg is None:
+        print('Request Timeout:', t)
+        return
+    logger.info('recv, match, and log {}'.format(msg))
+    print('Recieved: ', msg)
+    return msg
+
+
+def waitOnce(t, timeout):
+    # command generator
+    msg = yield CE.WaitFor(t, timeout)
+    return msg
+
+
+def runBlocking(task, master, mlog, forwarding):
+    # runs a command generator (see commandExecutor) to the end on this
+    # thread, for callers outside the aircraft loop. Messages the command
+    # does not take are held for the next recvAndLog.
+    executor = CE.CommandExecutor()
+    executor.start('BLOCKING', task)
+    others = []
+    while executor.busy():
+        batch = recvAndLog(master, mlog, forwarding)[0]
+        got = False
+        for msg in batch:
+            if msg is None:
+                continue
+            got = True
+            if not executor.offer(msg):
+                others.append(msg)
+        executor.poll()
+        if not got and executor.busy():
+            fd = getattr(master, 'fd', None)
+            timeout = min(executor.timeout(), .05)
+            if fd is None:
+                time.sleep(min(timeout, .01))
+            else:
+                select.select([fd], [], [], timeout)
+    held.extend(others)
+    return executor.result
 
 
 def setHome(point, master, mlog, forwarding):
@@ -568,92 +275,8 @@ def setHome(point, master, mlog, forwarding):
                                      float(10))  # param7 - alt
     logger.info('SERVER: Setting Home to {}, {}, {}'.format(point[0],point[1],10))
 
-def sendMissionCount(wp_list, master, mlog, forwarding):
-    # Let the system know how many wp's to expect
-    count = len(wp_list) + 1
-    print('Mission count: ', count)
-    global targetComponent
-    if targetComponent is None:
-        component = master.target_component
-    else:
-        component = targetComponent
-    master.mav.mission_count_send(master.target_system,
-                                  component,
-                                  count,
-                                  mavutil.mavlink.MAV_MISSION_TYPE_MISSION)
-    msg_in = recvMatchAndLog(master, mlog, forwarding, ['MISSION_REQUEST'])
-    return msg_in
-
-
-def sendTakeoff(point, radius, seq, master, mlog, forwarding):
-    global targetComponent
-    if targetComponent is None:
-        component = master.target_component
-    else:
-        component = targetComponent
-    master.mav.mission_item_send(master.target_system,
-                                 component,
-                                 seq,
-                                 0,
-                                 mavutil.mavlink.MAV_CMD_NAV_TAKEOFF,
-                                 0, 0, 0, radius, 0, 0,
-                                 float(point[0]),
-                                 float(point[1]),
-                                 float(point[2]),
-                                 mavutil.mavlink.MAV_MISSION_TYPE_MISSION)
-
-    msg_in = recvMatchAndLog(master, mlog, forwarding, [
-        'MISSION_REQUEST', 'MISSION_ACK'])
-    return msg_in
-
-
-def sendVelocity(vel, master, mlog, forwarding):
-    global targetComponent
-    if targetComponent is None:
-        component = master.target_component
-    else:
-        component = targetComponent
-    master.mav.mission_item_send(master.target_system,
-                                 component,
-                                 1,
-                                 0,
-                                 mavutil.mavlink.MAV_CMD_DO_CHANGE_SPEED,
-                                 0, 1, 0, vel, 0, 0,
-                                 0,
-                                 0,
-                                 0,
-                                 mavutil.mavlink.MAV_MISSION_TYPE_MISSION)
-
-    msg_in = recvMatchAndLog(master, mlog, forwarding, [
-        'MISSION_REQUEST', 'MISSION_ACK'])
-    return msg_in
-
-
-def sendWaypoint(point, radius, seq, master, mlog, forwarding):
-    global targetComponent
-    if targetComponent is None:
-        component = master.target_component
-    else:
-        component = targetComponent
-
-    print('sendWaypoint: component, targetComponent', component, targetComponent)
-    master.mav.mission_item_send(master.target_system,
-                                 component,
-                                 seq,
-                                 mavutil.mavlink.MAV_FRAME_GLOBAL_RELATIVE_ALT,
-                                 mavutil.mavlink.MAV_CMD_NAV_WAYPOINT,
-                                 0, 0, 0, radius, 0, 0,
-                                 float(point[0]),
-                                 float(point[1]),
-                                 float(point[2]),
-                                 mavutil.mavlink.MAV_MISSION_TYPE_MISSION)
-
-    msg_in = recvMatchAndLog(master, mlog, forwarding, [
-        'MISSION_REQUEST', 'MISSION_ACK'])
-    return msg_in
-
-
 def startFlight(icarous_flag, launch, master, mlog, forwarding):
+    # command generator, run by the CommandExecutor
     logger = logging.getLogger()
     print('Launch Code:', launch)
     if icarous_flag == '1':
@@ -684,7 +307,7 @@ def startFlight(icarous_flag, launch, master, mlog, forwarding):
             mavutil.mavlink.MAV_MODE_FLAG_CUSTOM_MODE_ENABLED,
             mode)
 
-        msg_in = recvMatchAndLog(master, mlog, forwarding, ['COMMAND_ACK'])
+        msg_in = yield CE.WaitFor(['COMMAND_ACK'])
         logger.info('SERVER: message in {}'.format(msg_in))
 
         # arm the quad
@@ -692,27 +315,27 @@ def startFlight(icarous_flag, launch, master, mlog, forwarding):
                                      mavutil.mavlink.MAV_CMD_COMPONENT_ARM_DISARM,
                                      0,
                                      1, 0, 0, 0, 0, 0, 0)
-        msg_in = recvMatchAndLog(master, mlog, forwarding, ['COMMAND_ACK'])
+        msg_in = yield CE.WaitFor(['COMMAND_ACK'])
         logger.info('SERVER: message in {}'.format(msg_in))
-        time.sleep(1)
+        yield CE.Sleep(1)
 
         # Throttle up
         master.mav.command_long_send(master.target_system, master.target_component,
                                      mavutil.mavlink.MAV_CMD_DO_CHANGE_SPEED,
                                      0,
                                      0, 10, 10, 1, 0, 0, 0)
-        msg_in = recvMatchAndLog(master, mlog, forwarding, ['COMMAND_ACK'])
+        msg_in = yield CE.WaitFor(['COMMAND_ACK'])
         logger.info('SERVER: message in {}'.format(msg_in))
-        time.sleep(1)
+        yield CE.Sleep(1)
 
         # Takeoff
         master.mav.command_long_send(master.target_system, master.target_component,
                                      mavutil.mavlink.MAV_CMD_NAV_TAKEOFF,
                                      0,
                                      0, 0, 0, 0, 37.0866015, -76.3788989, 15)
-        msg_in = recvMatchAndLog(master, mlog, forwarding, ['COMMAND_ACK'])
+        msg_in = yield CE.WaitFor(['COMMAND_ACK'])
         logger.info('SERVER: message in {}'.format(msg_in))
-        time.sleep(1)
+        yield CE.Sleep(1)
 
         # change mode to Auto
         mode = master.mode_mapping()['AUTO']
@@ -720,7 +343,7 @@ def startFlight(icarous_flag, launch, master, mlog, forwarding):
             master.target_system,
             mavutil.mavlink.MAV_MODE_FLAG_CUSTOM_MODE_ENABLED,
             mode)
-        msg_in = recvMatchAndLog(master, mlog, forwarding, ['COMMAND_ACK'])
+        msg_in = yield CE.WaitFor(['COMMAND_ACK'])
         return str(msg_in)
 
 
@@ -756,8 +379,7 @@ def sendGFEnable(index, f_type, total, floor, roof, master, mlog, forwarding):
                                  float(roof),      # roof
                                  0.0)         # unused
 
-    msg_in = recvMatchAndLog(
-        master, mlog, forwarding, ['FENCE_FETCH_POINT', 'COMMAND_ACK'])
+    msg_in = yield CE.WaitFor(['FENCE_FETCH_POINT', 'COMMAND_ACK'])
     return msg_in
 
 
@@ -774,8 +396,7 @@ def sendGFPoint(seq, total, item, master, mlog, forwarding):
                                 float(item[0]),
                                 float(item[1]))
 
-    msg_in = recvMatchAndLog(
-        master, mlog, forwarding, ['FENCE_FETCH_POINT', 'COMMAND_ACK'])
+    msg_in = yield CE.WaitFor(['FENCE_FETCH_POINT', 'COMMAND_ACK'])
     return msg_in
 
 
@@ -810,23 +431,6 @@ def fetchParams(master):
         master.target_system, component)
 
 
-def changeParamInt(consumer_message, master, mlog, forwarding):
-    logger = logging.getLogger()
-    global targetComponent
-    if targetComponent is None:
-        component = master.target_component
-    else:
-        component = targetComponent
-    master.mav.param_set_send(master.target_system, component,
-                              consumer_message[1].encode(
-                                  'utf8'),
-                              int(consumer_message[2]),
-                              int(consumer_message[3]))
-
-    msg_in = recvMatchAndLog(master, mlog, forwarding, ['PARAM_VALUE'])
-    logger.info('SERVER: message in {}'.format(msg_in))
-
-
 def changeParamFloat(consumer_message, master, mlog, forwarding):
     global targetComponent
     if targetComponent is None:
@@ -840,7 +444,7 @@ def changeParamFloat(consumer_message, master, mlog, forwarding):
                               float(consumer_message[2]),
                               int(consumer_message[3]))
 
-    msg_in = recvMatchAndLog(master, mlog, forwarding, ['PARAM_VALUE'])
+    msg_in = yield CE.WaitFor(['PARAM_VALUE'])
     logger.info('SERVER: message in {}'.format(msg_in))
 
 def sendTraffic(m, master):
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+
+#
+# Author: Andrew Peters
+#
+# Copyright 2019 United States Government as represented by the Administrator of the National Aeronautics
+# and Space Administration. All Rights Reserved.
+#  
+# Disclaimers
+# No Warranty: THE SUBJECT SOFTWARE IS PROVIDED "AS IS" WITHOUT ANY WARRANTY OF ANY
+# KIND, EITHER EXPRESSED, IMPLIED, OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, ANY
+# WARRANTY THAT THE SUBJECT SOFTWARE WILL CONFORM TO SPECIFICATIONS, ANY IMPLIED
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, OR FREEDOM FROM
+# INFRINGEMENT, ANY WARRANTY THAT THE SUBJECT SOFTWARE WILL BE ERROR FREE, OR ANY
+# WARRANTY THAT DOCUMENTATION, IF PROVIDED, WILL CONFORM TO THE SUBJECT SOFTWARE.
+# THIS AGREEMENT DOES NOT, IN ANY MANNER, CONSTITUTE AN ENDORSEMENT BY GOVERNMENT
+# AGENCY OR ANY PRIOR RECIPIENT OF ANY RESULTS, RESULTING DESIGNS, HARDWARE,
+# SOFTWARE PRODUCTS OR ANY OTHER APPLICATIONS RESULTING FROM USE OF THE SUBJECT
+# SOFTWARE.  FURTHER, GOVERNMENT AGENCY DISCLAIMS ALL WARRANTIES AND LIABILITIES
+# REGARDING THIRD-PARTY SOFTWARE, IF PRESENT IN THE ORIGINAL SOFTWARE, AND
+# DISTRIBUTES IT "AS IS."
+#  
+# Waiver and Indemnity:  RECIPIENT AGREES TO WAIVE ANY AND ALL CLAIMS AGAINST THE UNITED
+# STATES GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR
+# RECIPIENT.  IF RECIPIENT'S USE OF THE SUBJECT SOFTWARE RESULTS IN ANY LIABILITIES,
+# DEMANDS, DAMAGES, EXPENSES OR LOSSES ARISING FROM SUCH USE, INCLUDING ANY
+# DAMAGES FROM PRODUCTS BASED ON, OR RESULTING FROM, RECIPIENT'S USE OF THE SUBJECT
+# SOFTWARE, RECIPIENT SHALL INDEMNIFY AND HOLD HARMLESS THE UNITED STATES
+# GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR RECIPIENT,
+# TO THE EXTENT PERMITTED BY LAW.  RECIPIENT'S SOLE REMEDY FOR ANY SUCH MATTER SHALL
+# BE THE IMMEDIATE, UNILATERAL TERMINATION OF THIS AGREEMENT.
+#
+
+
+import os
+import json
+import time
+import asyncio
+import logging
+
+
+INTERVAL = 5  # seconds between worker snapshots
+PREFIX = '{"name":"METRICS"'  # worker snapshots on the server queue
+PROM_PREFIX = 'webgs_'
+
+# Latency histograms keep HDR style buckets, SUB buckets for every power of
+# two microseconds, so any value is known to within 25% and recording one is
+# a couple of integer operations. Exported buckets are the powers of two
+# from BOUNDS[0] to BOUNDS[-1] microseconds.
+SUB_BITS = 2
+SUB = 1 << SUB_BITS
+BOUNDS = [1 << x for x in range(3, 26)]  # 8us to 33s
+
+
+def bucketIndex(us):
+    if us < SUB:
+        return us
+    o = us.bit_length() - 1
+    return SUB + (o - SUB_BITS) * SUB + ((us >> (o - SUB_BITS)) & (SUB - 1))
+
+
+def bucketUpper(i):
+    # largest value in bucket i, microseconds
+    if i < SUB:
+        return i
+    o = (i - SUB) // SUB + SUB_BITS
+    sub = (i - SUB) % SUB
+    return ((SUB + sub + 1) << (o - SUB_BITS)) - 1
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = {}  # bucket index: count
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        us = int(seconds * 1e6)
+        i = bucketIndex(us if us > 0 else 0)
+        self.counts[i] = self.counts.get(i, 0) + 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        # upper bound of the bucket holding quantile q, in seconds, at most
+        # the largest value seen
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        n = 0
+        for i in sorted(self.counts):
+            n += self.counts[i]
+            if n >= rank:
+                return min(bucketUpper(i) / 1e6, self.max)
+        return self.max
+
+    def cumulative(self):
+        # counts at or below each of BOUNDS
+        out = [0] * len(BOUNDS)
+        for i, c in self.counts.items():
+            upper = bucketUpper(i)
+            for j in range(len(BOUNDS) - 1, -1, -1):
+                if upper >= BOUNDS[j]:
+                    break
+                out[j] += c
+        return out
+
+    def merge(self, other):
+        for i, c in other.counts.items():
+            self.counts[i] = self.counts.get(i, 0) + c
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def dump(self):
+        return [self.counts, self.count, self.sum, self.max]
+
+    @staticmethod
+    def load(x):
+        h = Histogram()
+        h.counts = {int(i): c for i, c in x[0].items()}
+        h.count = x[1]
+        h.sum = x[2]
+        h.max = x[3]
+        return h
+
+
+def seriesKey(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+# Counters, gauges and histograms for this process, by name and labels.
+#   registry.inc('mavlink_messages_total', len(msgs))
+#   registry.observe('stage_seconds', time.perf_counter() - t, stage='parse')
+class Registry:
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def inc(self, name, n=1, **labels):
+        key = seriesKey(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + n
+
+    def setTotal(self, name, value, **labels):
+        # a counter kept somewhere else
+        self.counters[seriesKey(name, labels)] = value
+
+    def gauge(self, name, value, **labels):
+        self.gauges[seriesKey(name, labels)] = value
+
+    def observe(self, name, seconds, **labels):
+        key = seriesKey(name, labels)
+        h = self.histograms.get(key)
+        if h is None:
+            h = Histogram()
+            self.histograms[key] = h
+        h.observe(seconds)
+
+    def remove(self, **labels):
+        # drops every series with these labels, for a client that left
+        items = set(labels.items())
+        for series in [self.counters, self.gauges, self.histograms]:
+            for key in [x for x in series if items <= set(x[1])]:
+                del series[key]
+
+    def clear(self):
+        self.counters.clear()
+        self.gauges.clear()
+        self.histograms.clear()
+
+    def dump(self):
+        return {'counters': [[k[0], dict(k[1]), v] for k, v in self.counters.items()],
+                'gauges': [[k[0], dict(k[1]), v] for k, v in self.gauges.items()],
+                'histograms': [[k[0], dict(k[1]), v.dump()] for k, v in self.histograms.items()]}
+
+    @staticmethod
+    def load(x, extra=None):
+        # a dumped registry, with extra labels added to every series
+        r = Registry()
+        extra = extra or {}
+        for name, labels, v in x['counters']:
+            r.counters[seriesKey(name, dict(labels, **extra))] = v
+        for name, labels, v in x['gauges']:
+            r.gauges[seriesKey(name, dict(labels, **extra))] = v
+        for name, labels, v in x['histograms']:
+            r.histograms[seriesKey(name, dict(labels, **extra))] = Histogram.load(v)
+        return r
+
+
+registry = Registry()  # this process's metrics
+
+QUANTILES = [.5, .99]  # exported for latency_seconds, with the max
+
+
+# Monotonic stamps of one message from the aircraft link to the websockets,
+# every hop is recorded as latency_seconds{aircraft, hop}:
+#   aircraft  received by recvAndLog to put on the server queue, encoding
+#             and any time held by the rate limit
+#   queue     the multiprocessing queue
+#   server    read from the queue to queued for each client
+#   send      queued for a client to websocket.send done
+#   total     received by recvAndLog to websocket.send done
+# and for clients in echo mode
+#   client    websocket.send done to the client's echo arriving
+#   echo      received by recvAndLog to the echo arriving
+# time.monotonic is the same clock in every process on the machine.
+class Trace:
+    __slots__ = ['ac', 'recv', 'put', 'read']
+
+    def __init__(self, recv, put, read):
+        self.ac = None
+        self.recv = recv
+        self.put = put
+        self.read = read
+
+    def routed(self, ac, now):
+        self.ac = ac
+        registry.observe('latency_seconds', self.put - self.recv, aircraft=ac, hop='aircraft')
+        registry.observe('latency_seconds', self.read - self.put, aircraft=ac, hop='queue')
+        registry.observe('latency_seconds', now - self.read, aircraft=ac, hop='server')
+
+    def sent(self, queued, now):
+        registry.observe('latency_seconds', now - queued, aircraft=self.ac, hop='send')
+        registry.observe('latency_seconds', now - self.recv, aircraft=self.ac, hop='total')
+
+    def echoed(self, sent, now):
+        registry.observe('latency_seconds', now - sent, aircraft=self.ac, hop='client')
+        registry.observe('latency_seconds', now - self.recv, aircraft=self.ac, hop='echo')
+
+
+def latencyTable(r=None):
+    # [[aircraft, hop, count, p50, p99, max]] in ms, from latency_seconds
+    if r is None:
+        r = registry
+    rows = []
+    for (name, labels), h in sorted(r.histograms.items()):
+        if name != 'latency_seconds':
+            continue
+        labels = dict(labels)
+        rows.append([labels.get('aircraft'), labels.get('hop'), h.count] +
+                    [h.quantile(q) * 1000 for q in QUANTILES] + [h.max * 1000])
+    return rows
+
+
+def snapshotMsg(ac):
+    # this worker's metrics, put on the server queue every INTERVAL
+    return PREFIX + ', "PID":' + str(os.getpid()) + ', "AIRCRAFT":"' + str(ac) + \
+        '", "DATA":' + json.dumps(registry.dump()) + '}'
+
+
+# Server side, keeps the latest snapshot from each worker. Snapshots are
+# totals so a lost one costs nothing, a worker that stops sending is
+# dropped after a few intervals.
+class Collector:
+    def __init__(self, max_age=INTERVAL * 3):
+        self.max_age = max_age
+        self.workers = {}  # pid: [time, registry]
+
+    def load(self, msg):
+        logger = logging.getLogger()
+        try:
+            x = json.loads(msg)
+            r = Registry.load(x['DATA'], {'aircraft': x['AIRCRAFT']})
+        except (ValueError, KeyError, TypeError):
+            logger.info('METRICS: Bad snapshot {}'.format(msg[:100]))
+            return
+        self.workers[x['PID']] = [time.time(), r]
+
+    def registries(self):
+        now = time.time()
+        for pid in [k for k, v in self.workers.items() if now - v[0] > self.max_age]:
+            del self.workers[pid]
+        return [registry] + [v[1] for v in self.workers.values()]
+
+    def export(self):
+        return export(self.registries())
+
+
+def formatLabels(labels, extra=''):
+    x = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                 for k, v in labels)
+    if extra:
+        x = x + ',' + extra if x else extra
+    return '{' + x + '}' if x else ''
+
+
+def export(registries):
+    # Prometheus text format
+    families = {}  # name: [type, [(labels, value)]]
+    for r in registries:
+        for kind, series in [('counter', r.counters), ('gauge', r.gauges), ('histogram', r.histograms)]:
+            for (name, labels), v in series.items():
+                families.setdefault(name, [kind, []])[1].append((labels, v))
+
+    # quantiles of the latency histograms, quantile 1 is the max
+    quantiles = []
+    for labels, h in families.get('latency_seconds', ['', []])[1]:
+        for q in QUANTILES:
+            quantiles.append((labels + (('quantile', str(q)),), h.quantile(q)))
+        quantiles.append((labels + (('quantile', '1'),), h.max))
+    if len(quantiles) > 0:
+        families['latency_quantile_seconds'] = ['gauge', quantiles]
+
+    lines = []
+    for name in sorted(families):
+        kind, series = families[name]
+        name = PROM_PREFIX + name
+        lines.append('# TYPE {} {}'.format(name, kind))
+        for labels, v in sorted(series, key=lambda x: x[0]):
+            if kind != 'histogram':
+                lines.append('{}{} {}'.format(name, formatLabels(labels), v))
+                continue
+            for bound, c in zip(BOUNDS, v.cumulative()):
+                lines.append('{}_bucket{} {}'.format(
+                    name, formatLabels(labels, 'le="{}"'.format(bound / 1e6)), c))
+            lines.append('{}_bucket{} {}'.format(name, formatLabels(labels, 'le="+Inf"'), v.count))
+            lines.append('{}_sum{} {}'.format(name, formatLabels(labels), v.sum))
+            lines.append('{}_count{} {}'.format(name, formatLabels(labels), v.count))
+    return '\n'.join(lines) + '\n'
+
+
+async def serve(host, port, collect):
+    # plain http on host:port, GET /metrics returns collect()
+    logger = logging.getLogger()
+
+    async def handle(reader, writer):
+        try:
+            request = await reader.readline()
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+            parts = request.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                body = collect().encode()
+                head = 'HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n'
+            else:
+                body = b'not found\n'
+                head = 'HTTP/1.0 404 Not Found\r\nContent-Type: text/plain\r\n'
+            writer.write((head + 'Content-Length: {}\r\n\r\n'.format(len(body))).encode() + body)
+            await writer.drain()
+        except Exception:
+            logger.exception('METRICS: Request failed')
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    logger.info('METRICS: Serving on http://{}:{}/metrics'.format(host, port))
+    return server
@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+
+#
+# Author: Andrew Peters
+#
+# Copyright 2019 United States Government as represented by the Administrator of the National Aeronautics
+# and Space Administration. All Rights Reserved.
+#  
+# Disclaimers
+# No Warranty: THE SUBJECT SOFTWARE IS PROVIDED "AS IS" WITHOUT ANY WARRANTY OF ANY
+# KIND, EITHER EXPRESSED, IMPLIED, OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, ANY
+# WARRANTY THAT THE SUBJECT SOFTWARE WILL CONFORM TO SPECIFICATIONS, ANY IMPLIED
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, OR FREEDOM FROM
+# INFRINGEMENT, ANY WARRANTY THAT THE SUBJECT SOFTWARE WILL BE ERROR FREE, OR ANY
+# WARRANTY THAT DOCUMENTATION, IF PROVIDED, WILL CONFORM TO THE SUBJECT SOFTWARE.
+# THIS AGREEMENT DOES NOT, IN ANY MANNER, CONSTITUTE AN ENDORSEMENT BY GOVERNMENT
+# AGENCY OR ANY PRIOR RECIPIENT OF ANY RESULTS, RESULTING DESIGNS, HARDWARE,
+# SOFTWARE PRODUCTS OR ANY OTHER APPLICATIONS RESULTING FROM USE OF THE SUBJECT
+# SOFTWARE.  FURTHER, GOVERNMENT AGENCY DISCLAIMS ALL WARRANTIES AND LIABILITIES
+# REGARDING THIRD-PARTY SOFTWARE, IF PRESENT IN THE ORIGINAL SOFTWARE, AND
+# DISTRIBUTES IT "AS IS."
+#  
+# Waiver and Indemnity:  RECIPIENT AGREES TO WAIVE ANY AND ALL CLAIMS AGAINST THE UNITED
+# STATES GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR
+# RECIPIENT.  IF RECIPIENT'S USE OF THE SUBJECT SOFTWARE RESULTS IN ANY LIABILITIES,
+# DEMANDS, DAMAGES, EXPENSES OR LOSSES ARISING FROM SUCH USE, INCLUDING ANY
+# DAMAGES FROM PRODUCTS BASED ON, OR RESULTING FROM, RECIPIENT'S USE OF THE SUBJECT
+# SOFTWARE, RECIPIENT SHALL INDEMNIFY AND HOLD HARMLESS THE UNITED STATES
+# GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR RECIPIENT,
+# TO THE EXTENT PERMITTED BY LAW.  RECIPIENT'S SOLE REMEDY FOR ANY SUCH MATTER SHALL
+# BE THE IMMEDIATE, UNILATERAL TERMINATION OF THIS AGREEMENT.
+#
+
+
+import os
+import time
+import logging
+
+from pymavlink import mavutil
+
+import GsProcesses.mavlinkCommands as MF
+import GsProcesses.commandExecutor as CE
+
+
+TIMEOUT = .5       # first wait for a reply, doubled on each retry
+MAX_TIMEOUT = 2    # longest wait for a reply
+RETRIES = 5        # retries of one request before the transfer fails
+WINDOW = 4         # item requests kept in flight during a download
+# send MISSION_ITEM_INT / MISSION_REQUEST_INT, WEBGS_MISSION_INT=1
+USE_INT = os.environ.get('WEBGS_MISSION_INT', '0') == '1'
+
+GLOBAL_FRAMES = [mavutil.mavlink.MAV_FRAME_GLOBAL,
+                 mavutil.mavlink.MAV_FRAME_GLOBAL_RELATIVE_ALT,
+                 mavutil.mavlink.MAV_FRAME_GLOBAL_TERRAIN_ALT,
+                 mavutil.mavlink.MAV_FRAME_GLOBAL_INT,
+                 mavutil.mavlink.MAV_FRAME_GLOBAL_RELATIVE_ALT_INT,
+                 mavutil.mavlink.MAV_FRAME_GLOBAL_TERRAIN_ALT_INT]
+
+# states
+COUNT = 'COUNT'    # waiting for the first reply to the count / request list
+ITEMS = 'ITEMS'    # items going back and forth
+DONE = 'DONE'
+FAILED = 'FAILED'
+
+
+def getComponent(master):
+    if MF.targetComponent is None:
+        return master.target_component
+    return MF.targetComponent
+
+
+def waypointItems(wp_list, radius, vel):
+    # the layout the aircraft expects, [wp0, change speed, wp1, wp2, ...]
+    # each item is (frame, command, current, autocontinue, p1, p2, p3, p4, x, y, z)
+    items = []
+    for i, point in enumerate(wp_list):
+        items.append((mavutil.mavlink.MAV_FRAME_GLOBAL_RELATIVE_ALT,
+                      mavutil.mavlink.MAV_CMD_NAV_WAYPOINT,
+                      0, 0, 0, radius, 0, 0,
+                      float(point[0]), float(point[1]), float(point[2])))
+        if i == 0:
+            items.append((0, mavutil.mavlink.MAV_CMD_DO_CHANGE_SPEED,
+                          0, 1, 0, vel, 0, 0, 0, 0, 0))
+    return items
+
+
+def toInt(frame, x, y):
+    if frame in GLOBAL_FRAMES:
+        return int(round(x * 1e7)), int(round(y * 1e7))
+    return int(x), int(y)
+
+
+class Retry:
+    # timer for one outstanding request, backs off on every resend
+    def __init__(self, timeout, max_timeout, retries):
+        self.timeout = timeout
+        self.max_timeout = max_timeout
+        self.retries = retries
+        self.reset()
+
+    def reset(self):
+        self.wait = self.timeout
+        self.count = 0
+        self.deadline = time.time() + self.wait
+
+    def expired(self, now):
+        return now >= self.deadline
+
+    def backoff(self, now):
+        # returns False once the retries are used up
+        self.count += 1
+        self.wait = min(self.wait * 2, self.max_timeout)
+        self.deadline = now + self.wait
+        return self.count <= self.retries
+
+
+# Shared part of the upload and download state machines.
+# task() waits for the messages wants() takes, hands them to handle() and
+# calls check() for the timers until the transfer is DONE or FAILED. Other
+# messages go on to the telemetry loop.
+class Transfer:
+    def __init__(self, master, mlog, forwarding, mission_type,
+                 timeout=TIMEOUT, max_timeout=MAX_TIMEOUT, retries=RETRIES,
+                 progress=None):
+        self.master = master
+        self.mlog = mlog
+        self.forwarding = forwarding
+        self.mission_type = mission_type
+        self.timeout = timeout
+        self.max_timeout = max_timeout
+        self.retries = retries
+        self.progress = progress
+        self.state = COUNT
+        self.error = None
+        self.count = 0
+        self.sent = 0
+        self.resent = 0
+        self.start = 0
+        self.elapsed = 0
+        self.component = getComponent(master)
+
+    def newRetry(self):
+        return Retry(self.timeout, self.max_timeout, self.retries)
+
+    def fail(self, error):
+        logger = logging.getLogger()
+        logger.info('MISSION: {} failed, {}'.format(type(self).__name__, error))
+        self.error = error
+        self.state = FAILED
+
+    def isDone(self):
+        return self.state == DONE or self.state == FAILED
+
+    def task(self):
+        # command generator, see commandExecutor. Returns True when DONE.
+        self.start = time.time()
+        self.begin()
+        while not self.isDone():
+            msg = yield CE.WaitFor(self.TYPES, max(0, self.deadline() - time.time()), self.wants)
+            if msg is not None:
+                self.handle(msg)
+            if not self.isDone():
+                self.check(time.time())
+        self.elapsed = time.time() - self.start
+        return self.state == DONE
+
+    def run(self):
+        # the whole transfer on this thread
+        return MF.runBlocking(self.task(), self.master, self.mlog, self.forwarding)
+
+    def matches(self, msg):
+        return getattr(msg, 'mission_type', 0) == self.mission_type
+
+    def report(self, done):
+        if self.progress is not None:
+            self.progress(done, self.count)
+
+
+# Upload. The aircraft asks for each item, every request is answered
+# straight away with the item in the form it asked for. When the aircraft
+# goes quiet the last message is sent again, with back off, until it
+# answers or the retries are used up.
+class MissionUpload(Transfer):
+    def __init__(self, master, mlog, forwarding, items,
+                 mission_type=mavutil.mavlink.MAV_MISSION_TYPE_MISSION,
+                 use_int=USE_INT, on_first=None, **kwargs):
+        Transfer.__init__(self, master, mlog, forwarding, mission_type, **kwargs)
+        self.items = items
+        self.count = len(items)
+        self.use_int = use_int
+        self.on_first = on_first
+        self.last = None     # seq of the last item sent, None for the count
+        self.last_int = use_int
+        self.highest = -1
+        self.result = None
+        self.retry = self.newRetry()
+
+    TYPES = ['MISSION_REQUEST', 'MISSION_REQUEST_INT', 'MISSION_ACK']
+
+    def begin(self):
+        self.sendCount()
+
+    def wants(self, msg):
+        if not self.matches(msg):
+            return False
+        return msg.get_type() == 'MISSION_ACK' or msg.seq < self.count
+
+    def deadline(self):
+        return self.retry.deadline
+
+    def sendCount(self):
+        self.master.mav.mission_count_send(self.master.target_system,
+                                           self.component,
+                                           self.count,
+                                           self.mission_type)
+        self.sent += 1
+
+    def sendItem(self, seq, use_int):
+        frame, command, current, autocontinue, p1, p2, p3, p4, x, y, z = self.items[seq]
+        if use_int:
+            x, y = toInt(frame, x, y)
+            self.master.mav.mission_item_int_send(self.master.target_system,
+                                                  self.component, seq, frame, command,
+                                                  current, autocontinue, p1, p2, p3, p4,
+                                                  x, y, z, self.mission_type)
+        else:
+            self.master.mav.mission_item_send(self.master.target_system,
+                                              self.component, seq, frame, command,
+                                              current, autocontinue, p1, p2, p3, p4,
+                                              x, y, z, self.mission_type)
+        self.sent += 1
+
+    def handle(self, msg):
+        name = msg.get_type()
+        if name == 'MISSION_REQUEST' or name == 'MISSION_REQUEST_INT':
+            if not self.matches(msg) or msg.seq >= self.count:
+                return False
+            if self.state == COUNT:
+                self.state = ITEMS
+                if self.on_first is not None:
+                    self.on_first()
+            if msg.seq <= self.highest:
+                self.resent += 1
+            use_int = self.use_int or name == 'MISSION_REQUEST_INT'
+            self.sendItem(msg.seq, use_int)
+            self.last = msg.seq
+            self.last_int = use_int
+            if msg.seq > self.highest:
+                self.highest = msg.seq
+                self.report(msg.seq + 1)
+            self.retry.reset()
+            return True
+        elif name == 'MISSION_ACK':
+            if not self.matches(msg):
+                return False
+            self.result = msg.type
+            if msg.type == mavutil.mavlink.MAV_MISSION_ACCEPTED:
+                if self.highest == self.count - 1 or self.count == 0:
+                    self.state = DONE
+                else:
+                    # an accepted ack before the last item is an early
+                    # ack for a previous transfer, keep going
+                    return True
+            else:
+                self.fail('MISSION_ACK {}'.format(msg.type))
+            return True
+        return False
+
+    def check(self, now):
+        if not self.retry.expired(now):
+            return
+        if not self.retry.backoff(now):
+            self.fail('timeout waiting for {}'.format(
+                'the first request' if self.last is None else 'request after {}'.format(self.last)))
+            return
+        self.resent += 1
+        if self.last is None:
+            self.sendCount()
+        else:
+            self.sendItem(self.last, self.last_int)
+
+
+# Download. Up to window item requests are in flight at once, each with
+# its own retry timer. Items can come back in any order, the transfer is
+# done when every seq is in and the aircraft has been sent an ack.
+class MissionDownload(Transfer):
+    def __init__(self, master, mlog, forwarding,
+                 mission_type=mavutil.mavlink.MAV_MISSION_TYPE_MISSION,
+                 count=None, use_int=USE_INT, window=WINDOW, count_only=False, **kwargs):
+        Transfer.__init__(self, master, mlog, forwarding, mission_type, **kwargs)
+        self.use_int = use_int
+        self.count_only = count_only
+        self.window = max(1, window)
+        self.items = {}     # {seq: item}
+        self.pending = {}   # {seq: Retry}
+        self.next = 0
+        self.count_msg = None
+        self.retry = self.newRetry()
+        if count is not None:
+            self.setCount(count)
+
+    TYPES = ['MISSION_COUNT', 'MISSION_ITEM', 'MISSION_ITEM_INT', 'MISSION_ACK']
+
+    def begin(self):
+        if self.state == COUNT:
+            self.sendRequestList()
+        else:
+            self.fill()
+
+    def wants(self, msg):
+        name = msg.get_type()
+        if name == 'MISSION_ITEM' or name == 'MISSION_ITEM_INT':
+            # mission_type is not checked, callers look at it to tell an
+            # aircraft that answers fence requests with mission items
+            return self.state == ITEMS and msg.seq < self.count
+        if not self.matches(msg):
+            return False
+        if name == 'MISSION_ACK':
+            return msg.type != mavutil.mavlink.MAV_MISSION_ACCEPTED
+        return True
+
+    def deadline(self):
+        if self.state == COUNT or len(self.pending) == 0:
+            return self.retry.deadline
+        return min(x.deadline for x in self.pending.values())
+
+    def setCount(self, count):
+        self.count = int(count)
+        if self.count_only:
+            self.state = DONE
+            return
+        self.state = ITEMS
+        if self.count == 0:
+            self.finish()
+
+    def sendRequestList(self):
+        self.master.mav.mission_request_list_send(self.master.target_system,
+                                                  self.component,
+                                                  self.mission_type)
+        self.sent += 1
+
+    def sendRequest(self, seq):
+        if self.use_int:
+            self.master.mav.mission_request_int_send(self.master.target_system,
+                                                     self.component, seq,
+                                                     self.mission_type)
+        else:
+            self.master.mav.mission_request_send(self.master.target_system,
+                                                 self.component, seq,
+                                                 self.mission_type)
+        self.sent += 1
+
+    def fill(self):
+        # keep the window full
+        while len(self.pending) < self.window and self.next < self.count:
+            if self.next not in self.items:
+                self.sendRequest(self.next)
+                self.pending[self.next] = self.newRetry()
+            self.next += 1
+
+    def finish(self):
+        self.master.mav.mission_ack_send(self.master.target_system,
+                                         self.component,
+                                         mavutil.mavlink.MAV_MISSION_ACCEPTED,
+                                         self.mission_type)
+        self.state = DONE
+
+    def handle(self, msg):
+        name = msg.get_type()
+        if name == 'MISSION_COUNT':
+            if not self.matches(msg):
+                return False
+            if self.state == COUNT:
+                self.count_msg = msg
+                self.setCount(msg.count)
+                if self.state == ITEMS:
+                    self.fill()
+            return True
+        elif name == 'MISSION_ITEM' or name == 'MISSION_ITEM_INT':
+            if self.state != ITEMS or msg.seq >= self.count:
+                return False
+            if msg.seq not in self.items:
+                self.items[msg.seq] = msg
+                self.report(len(self.items))
+            self.pending.pop(msg.seq, None)
+            if len(self.items) == self.count:
+                self.finish()
+            else:
+                self.fill()
+            return True
+        elif name == 'MISSION_ACK':
+            if not self.matches(msg) or msg.type == mavutil.mavlink.MAV_MISSION_ACCEPTED:
+                return False
+            self.fail('MISSION_ACK {}'.format(msg.type))
+            return True
+        return False
+
+    def check(self, now):
+        if self.state == COUNT:
+            if self.retry.expired(now):
+                if not self.retry.backoff(now):
+                    self.fail('timeout waiting for MISSION_COUNT')
+                    return
+                self.resent += 1
+                self.sendRequestList()
+            return
+        for seq, retry in list(self.pending.items()):
+            if retry.expired(now):
+                if not retry.backoff(now):
+                    self.fail('timeout waiting for item {}'.format(seq))
+                    return
+                self.resent += 1
+                self.sendRequest(seq)
+
+    def getItems(self):
+        # items in seq order, MISSION_ITEM_INT lat/lng converted to degrees
+        items = []
+        for seq in range(self.count):
+            msg = self.items[seq]
+            if msg.get_type() == 'MISSION_ITEM_INT' and msg.frame in GLOBAL_FRAMES:
+                msg.x = msg.x * 1e-7
+                msg.y = msg.y * 1e-7
+            items.append(msg)
+        return items
+
+
+def requestCount(master, mlog, forwarding, mission_type):
+    # command generator, MISSION_REQUEST_LIST with retries, returns the
+    # MISSION_COUNT or None
+    d = MissionDownload(master, mlog, forwarding, mission_type, count_only=True)
+    yield from d.task()
+    return d.count_msg
+
+
+def download(master, mlog, forwarding, mission_type, count=None, use_int=USE_INT, progress=None):
+    # command generator, returns the list of items, None if the transfer failed
+    logger = logging.getLogger()
+    d = MissionDownload(master, mlog, forwarding, mission_type, count=count,
+                        use_int=use_int, progress=progress)
+    ok = yield from d.task()
+    if not ok:
+        return None
+    logger.info('MISSION: downloaded {} items in {:.2f}s, {} requests resent'.format(
+        d.count, d.elapsed, d.resent))
+    return d.getItems()
+
+
+def upload(master, mlog, forwarding, items, mission_type=mavutil.mavlink.MAV_MISSION_TYPE_MISSION,
+           use_int=USE_INT, on_first=None, progress=None):
+    # command generator, returns the finished MissionUpload, check its
+    # state for DONE
+    logger = logging.getLogger()
+    u = MissionUpload(master, mlog, forwarding, items, mission_type=mission_type,
+                      use_int=use_int, on_first=on_first, progress=progress)
+    yield from u.task()
+    logger.info('MISSION: upload {} {} items in {:.2f}s, {} resent'.format(
+        u.state, u.count, u.elapsed, u.resent))
+    return u
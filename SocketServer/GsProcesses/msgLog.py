@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+#
+# Author: Andrew Peters
+#
+# Copyright 2019 United States Government as represented by the Administrator of the National Aeronautics
+# and Space Administration. All Rights Reserved.
+#  
+# Disclaimers
+# No Warranty: THE SUBJECT SOFTWARE IS PROVIDED "AS IS" WITHOUT ANY WARRANTY OF ANY
+# KIND, EITHER EXPRESSED, IMPLIED, OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, ANY
+# WARRANTY THAT THE SUBJECT SOFTWARE WILL CONFORM TO SPECIFICATIONS, ANY IMPLIED
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, OR FREEDOM FROM
+# INFRINGEMENT, ANY WARRANTY THAT THE SUBJECT SOFTWARE WILL BE ERROR FREE, OR ANY
+# WARRANTY THAT DOCUMENTATION, IF PROVIDED, WILL CONFORM TO THE SUBJECT SOFTWARE.
+# THIS AGREEMENT DOES NOT, IN ANY MANNER, CONSTITUTE AN ENDORSEMENT BY GOVERNMENT
+# AGENCY OR ANY PRIOR RECIPIENT OF ANY RESULTS, RESULTING DESIGNS, HARDWARE,
+# SOFTWARE PRODUCTS OR ANY OTHER APPLICATIONS RESULTING FROM USE OF THE SUBJECT
+# SOFTWARE.  FURTHER, GOVERNMENT AGENCY DISCLAIMS ALL WARRANTIES AND LIABILITIES
+# REGARDING THIRD-PARTY SOFTWARE, IF PRESENT IN THE ORIGINAL SOFTWARE, AND
+# DISTRIBUTES IT "AS IS."
+#  
+# Waiver and Indemnity:  RECIPIENT AGREES TO WAIVE ANY AND ALL CLAIMS AGAINST THE UNITED
+# STATES GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR
+# RECIPIENT.  IF RECIPIENT'S USE OF THE SUBJECT SOFTWARE RESULTS IN ANY LIABILITIES,
+# DEMANDS, DAMAGES, EXPENSES OR LOSSES ARISING FROM SUCH USE, INCLUDING ANY
+# DAMAGES FROM PRODUCTS BASED ON, OR RESULTING FROM, RECIPIENT'S USE OF THE SUBJECT
+# SOFTWARE, RECIPIENT SHALL INDEMNIFY AND HOLD HARMLESS THE UNITED STATES
+# GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR RECIPIENT,
+# TO THE EXTENT PERMITTED BY LAW.  RECIPIENT'S SOLE REMEDY FOR ANY SUCH MATTER SHALL
+# BE THE IMMEDIATE, UNILATERAL TERMINATION OF THIS AGREEMENT.
+#
+
+
+import os
+import time
+import logging
+
+
+# Debug log of every message received from an aircraft, LogFiles/msg_in_*.txt
+# Configured with environment variables so it reaches every aircraft process:
+#   WEBGS_MSG_LOG            DEBUG to write the log, OFF (or any higher level) to turn it off. default: DEBUG
+#   WEBGS_MSG_LOG_TYPES      comma separated message types to keep. default: all
+#   WEBGS_MSG_LOG_SAMPLE     percent of messages to keep. default: 100
+#   WEBGS_MSG_LOG_MAX_BYTES  rotate the file at this size, 0 never rotates. default: 10000000
+#   WEBGS_MSG_LOG_BACKUPS    rotated files to keep. default: 5
+#   WEBGS_MSG_LOG_BUFFER     lines held in memory between writes. default: 500
+FLUSH_INTERVAL = 1  # seconds, buffered lines are written at least this often
+
+sinks = {}  # {path: MsgLog}
+
+
+def getLevel(name):
+    name = name.upper()
+    if name == 'OFF':
+        return logging.CRITICAL + 1
+    level = logging.getLevelName(name)
+    if isinstance(level, int):
+        return level
+    return logging.DEBUG
+
+
+# One file per aircraft. The file stays open, lines are joined and written
+# in batches, and str(msg) is only built for messages that pass the level,
+# type and sample checks. Rotation works like logging's RotatingFileHandler,
+# file.txt -> file.txt.1 -> file.txt.2 ...
+class MsgLog:
+    def __init__(self, path):
+        env = os.environ
+        self.path = path
+        self.enabled = getLevel(env.get('WEBGS_MSG_LOG', 'DEBUG')) <= logging.DEBUG
+
+        types = env.get('WEBGS_MSG_LOG_TYPES', '')
+        self.types = set(x.strip().upper() for x in types.split(',') if x.strip() != '')
+        self.sample = min(100, max(0, float(env.get('WEBGS_MSG_LOG_SAMPLE', 100))))
+        self.max_bytes = int(env.get('WEBGS_MSG_LOG_MAX_BYTES', 10000000))
+        self.backups = int(env.get('WEBGS_MSG_LOG_BACKUPS', 5))
+        self.size = int(env.get('WEBGS_MSG_LOG_BUFFER', 500))
+
+        self.acc = 0
+        self.lines = []
+        self.f = None
+        self.bytes = 0
+        self.last_flush = time.time()
+
+    def keep(self, msg):
+        if len(self.types) > 0 and msg.get_type() not in self.types:
+            return False
+        if self.sample >= 100:
+            return True
+        # spread the kept messages evenly instead of random sampling
+        self.acc += self.sample
+        if self.acc >= 100:
+            self.acc -= 100
+            return True
+        return False
+
+    def log(self, ac, msg_list):
+        if not self.enabled:
+            return
+        head = 'Aircraft: ' + str(ac) + '; '
+        for msg in msg_list:
+            if msg is not None and self.keep(msg):
+                self.lines.append(head + str(msg) + '\n')
+        now = time.time()
+        if len(self.lines) >= self.size or now - self.last_flush >= FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.time()
+        if len(self.lines) == 0:
+            return
+        data = ''.join(self.lines)
+        self.lines = []
+        if self.f is None:
+            self.f = open(self.path, 'a')
+            self.bytes = self.f.tell()
+        if self.max_bytes > 0 and self.bytes > 0 and self.bytes + len(data) > self.max_bytes:
+            self.rotate()
+        self.f.write(data)
+        self.f.flush()
+        self.bytes += len(data)
+
+    def rotate(self):
+        self.f.close()
+        if self.backups > 0:
+            for i in range(self.backups - 1, 0, -1):
+                src = '{}.{}'.format(self.path, i)
+                if os.path.exists(src):
+                    os.replace(src, '{}.{}'.format(self.path, i + 1))
+            os.replace(self.path, self.path + '.1')
+            self.f = open(self.path, 'a')
+        else:
+            self.f = open(self.path, 'w')
+        self.bytes = 0
+
+    def close(self):
+        if self.enabled:
+            self.flush()
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+        self.enabled = False
+
+
+def getMsgLog(path):
+    sink = sinks.get(path)
+    if sink is None:
+        sink = MsgLog(path)
+        sinks[path] = sink
+    return sink
+
+
+def closeAll():
+    for path in list(sinks):
+        sinks.pop(path).close()
@@ -32,10 +32,30 @@
 #
 
 import time
+import bisect
 import logging
 from pymavlink import mavutil, mavwp, mavparm
+from pymavlink.dialects.v20 import ardupilotmega as mavlink
 
-import GsProcesses.readLogFile as RT
+import GsProcesses.logIndex as LI
+
+
+# last message of each of these per aircraft is replayed after a seek
+STATE_IDS = [mavlink.MAVLINK_MSG_ID_HEARTBEAT,
+             mavlink.MAVLINK_MSG_ID_SYS_STATUS,
+             mavlink.MAVLINK_MSG_ID_GPS_RAW_INT,
+             mavlink.MAVLINK_MSG_ID_ATTITUDE,
+             mavlink.MAVLINK_MSG_ID_GLOBAL_POSITION_INT,
+             mavlink.MAVLINK_MSG_ID_MISSION_CURRENT,
+             mavlink.MAVLINK_MSG_ID_VFR_HUD,
+             mavlink.MAVLINK_MSG_ID_BATTERY_STATUS,
+             mavlink.MAVLINK_MSG_ID_HOME_POSITION]
+# every one of these before the seek point is replayed, in order, so
+# update_position rebuilds the flight plan, fences and replans
+MISSION_IDS = [mavlink.MAVLINK_MSG_ID_MISSION_COUNT,
+               mavlink.MAVLINK_MSG_ID_MISSION_ITEM,
+               mavlink.MAVLINK_MSG_ID_MISSION_ITEM_INT]
+PARAM_ID = mavlink.MAVLINK_MSG_ID_PARAM_VALUE
 
 
 class LogPlayer():
@@ -48,61 +68,120 @@ class LogPlayer():
         self.position = -99
         self.filename = 'LogFiles/' + filename
         self.filetype = filetype  # tlog, mlog
-        self.messages = []      # [[ac, m, timestamp, delta],...]
+        self.messages = []      # LogIndex, [ac, m, timestamp, delta] per message
         self.now = time.time()
         self.max_speed = 16
-        self.jump = 1  # number of messages to jump in ff or rev will overload the queue if trying to send to fast
+        self.jump = 1  # direction, 1 forward, -1 backwards
         self.skip_time = 30
         self.total_messages = 0
+        self.snapshot = []  # state rows sent before playing on from a seek
+        self.state_index = None
+        # pacing, log time anchor_log is due at wall clock anchor_wall and
+        # everything else at anchor_wall + (log time - anchor_log) / rate
+        self.anchor_wall = time.monotonic()
+        self.anchor_log = 0
+        self.max_batch = 1000
+        self.drift = 0       # seconds the last batch was behind schedule
+        self.max_drift = 0
+        self.mean_drift = 0  # moving average
         # get ac count from readTLog
 
     def Play(self, value=0):
         if value == 0:
-            if self.paused:
-                self.paused = False
-                self.jump = 1
-            else:
-                self.paused = True
-                self.jump = 0
+            self.paused = not self.paused
         else:
             self.paused = value
-            if self.paused:
-                self.jump = 1
-            else:
-                self.jump = 0
+        self.jump = 1
 
         # make sure everything gets set back to 1
         self.set_speed(1)
         self.r_counter = 0
         self.f_counter = 1
+        self.anchor()
 
     def Rew(self):
-        self.paused = False
         self.f_counter = 1
-        if self.jump >= 0:
+        if self.jump >= 0 or self.paused:
             self.set_speed(1)
             self.jump = -1
             self.r_counter = 1
         else:
             self.r_counter = self.r_counter + 1
             self.set_speed(self.speed * self.r_counter)
-            self.jump = -self.speed
+        self.paused = False
+        self.anchor()
 
     def FF(self):
-        self.paused = False
         self.r_counter = 0
-        if self.jump <= 0:
+        if self.jump <= 0 or self.paused:
             self.f_counter = 1
             self.set_speed(1)
             self.jump = 1
-
         else:
             self.f_counter = self.f_counter + 1
             self.set_speed(self.speed * self.f_counter)
-            self.jump = self.speed
+        self.paused = False
+        self.anchor()
 
-    def SkipForward(self):
-        self.position = self.position + 50
+    def SkipForward(self, seconds=None):
+        if seconds is None:
+            seconds = self.skip_time
+        self.SeekTime(self.messages.getTime(max(self.position, 0)) + seconds)
+
+    def SeekPercent(self, percent):
+        self.SeekTime(self.playtime * percent / 100.0)
+
+    def SeekTime(self, t):
+        # jump to the first message at or after t seconds, the state the
+        # aircraft had at that point is sent first
+        if self.total_messages == 0:
+            return
+        t = min(max(t, 0), self.playtime)
+        i = min(self.messages.find(t), self.total_messages - 1)
+        # getBatch continues from position + jump, message i is played next
+        if i == 0:
+            self.snapshot = []
+            self.position = -99
+        else:
+            self.snapshot = self.getState(i - 1)
+            self.position = i - 1
+        self.anchor()
+        logger = logging.getLogger()
+        logger.info('Playback: Seek to {:.2f}s, message {}, {} state messages'.format(
+            t, i, len(self.snapshot)))
+
+    def getState(self, i):
+        # rows for messages 0..i that rebuild the aircraft state at i:
+        # the last of each STATE_IDS type, every mission message and the
+        # last value of each parameter, per aircraft
+        if self.state_index is None:
+            self.state_index = self.messages.positions(STATE_IDS + MISSION_IDS + [PARAM_ID])
+        rows = []
+        for (ac, msg_id), positions in self.state_index.items():
+            n = bisect.bisect_right(positions, i)
+            if n == 0:
+                continue
+            if msg_id in STATE_IDS:
+                rows.append(positions[n - 1])
+            elif msg_id in MISSION_IDS:
+                rows.extend(positions[:n])
+            else:
+                params = {}
+                for j in positions[:n]:
+                    msg = self.messages.decode(j)
+                    if msg is not None:
+                        params[msg.param_id] = j
+                rows.extend(params.values())
+        rows.sort()
+        state = []
+        for j in rows:
+            x = self.messages[j]
+            x[3] = 0
+            state.append(x)
+        return state
+
+    def hasSnapshot(self):
+        return len(self.snapshot) > 0
 
     def getT(self):
         return time.time()
@@ -113,37 +192,89 @@ class LogPlayer():
 
     def getMessages(self):
         logger = logging.getLogger()
-        if self.filetype == 'mlog':
-            self.messages = RT.readMlog(self.filename)
-        elif self.filetype == 'tlog':
-            self.messages = RT.readTlog(self.filename)
+        if self.filetype == 'mlog' or self.filetype == 'tlog':
+            # indexed and decoded on demand instead of read into a list
+            self.messages = LI.LogIndex(self.filename, self.filetype)
         else:
             logger.info(
                 'Playback: Invalid file type. {}'.format(self.filetype))
 
-        self.playtime = self.messages[-1][2]
         self.total_messages = len(self.messages)
+        if self.total_messages > 0:
+            self.playtime = self.messages.getTime(-1)
+        self.anchor()
 
-    def getNext(self):
-        if len(self.messages) <= 0:
-            return []
+    def anchor(self):
+        # restart the schedule from the current position, called whenever
+        # the speed, direction or position changes
+        self.anchor_wall = time.monotonic()
+        if self.total_messages > 0:
+            self.anchor_log = self.messages.getTime(max(self.position, 0))
+        self.max_drift = 0
+
+    def rate(self):
+        return self.speed * self.jump
+
+    def dueTime(self, i):
+        # wall clock time message i should be sent
+        return self.anchor_wall + (self.messages.getTime(i) - self.anchor_log) / self.rate()
+
+    def nextIndex(self):
+        if self.position == -99:
+            return 0
+        return self.position + self.jump
+
+    def nextDue(self):
+        # seconds until the next message is due, None when nothing is coming
+        if len(self.snapshot) > 0:
+            return 0
+        if self.paused or self.total_messages == 0:
+            return None
+        i = self.nextIndex()
+        if i < 0 or i >= self.total_messages:
+            return 0
+        return max(0, self.dueTime(i) - time.monotonic())
 
-        elif self.position == -99:
-            x = self.messages[0]
-            self.position = 0
-            return x
+    def getBatch(self):
+        # every message that is due, in order, as [ac, m, timestamp, delta] rows
+        if len(self.snapshot) > 0:
+            rows = self.snapshot
+            self.snapshot = []
+            return rows
 
-        elif self.position + self.jump <= self.total_messages - 1 and self.position + self.jump >= 0 and self.speed != 0:
-            x = self.messages[self.position + self.jump]
-            self.position = self.position + self.jump
-            time.sleep(x[3]/self.speed)
-            return x
+        if self.paused or self.total_messages == 0:
+            return []
+
+        now = time.monotonic()
+        due = self.anchor_log + (now - self.anchor_wall) * self.rate()
+        i = self.nextIndex()
+        if self.jump > 0:
+            end = min(self.messages.find(due + 1e-9), i + self.max_batch, self.total_messages)
+            indexes = range(i, end)
         else:
+            end = max(self.messages.find(due) - 1, i - self.max_batch, -1)
+            indexes = range(i, end, -1)
+
+        if i < 0 or i >= self.total_messages:
+            # reached the end, or the start going backwards
             self.Play(value=True)
             return []
+        if len(indexes) == 0:
+            return []
+
+        self.drift = now - self.dueTime(indexes[0])
+        self.max_drift = max(self.max_drift, self.drift)
+        self.mean_drift = self.mean_drift * .95 + self.drift * .05
+        self.position = indexes[-1]
+        return [self.messages[x] for x in indexes]
+
+    def getDrift(self):
+        return [self.drift, self.mean_drift, self.max_drift]
 
     def getStats(self):
-        current_time = self.messages[self.position][2]
+        current_time = self.messages.getTime(max(self.position, 0))
         total_time = self.playtime
-        percent_complete = (self.position / self.total_messages)*100
+        percent_complete = 0
+        if total_time > 0:
+            percent_complete = current_time / total_time * 100
         return [current_time, total_time, percent_complete]
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+#
+# Author: Andrew Peters
+#
+# Copyright 2019 United States Government as represented by the Administrator of the National Aeronautics
+# and Space Administration. All Rights Reserved.
+#  
+# Disclaimers
+# No Warranty: THE SUBJECT SOFTWARE IS PROVIDED "AS IS" WITHOUT ANY WARRANTY OF ANY
+# KIND, EITHER EXPRESSED, IMPLIED, OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, ANY
+# WARRANTY THAT THE SUBJECT SOFTWARE WILL CONFORM TO SPECIFICATIONS, ANY IMPLIED
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, OR FREEDOM FROM
+# INFRINGEMENT, ANY WARRANTY THAT THE SUBJECT SOFTWARE WILL BE ERROR FREE, OR ANY
+# WARRANTY THAT DOCUMENTATION, IF PROVIDED, WILL CONFORM TO THE SUBJECT SOFTWARE.
+# THIS AGREEMENT DOES NOT, IN ANY MANNER, CONSTITUTE AN ENDORSEMENT BY GOVERNMENT
+# AGENCY OR ANY PRIOR RECIPIENT OF ANY RESULTS, RESULTING DESIGNS, HARDWARE,
+# SOFTWARE PRODUCTS OR ANY OTHER APPLICATIONS RESULTING FROM USE OF THE SUBJECT
+# SOFTWARE.  FURTHER, GOVERNMENT AGENCY DISCLAIMS ALL WARRANTIES AND LIABILITIES
+# REGARDING THIRD-PARTY SOFTWARE, IF PRESENT IN THE ORIGINAL SOFTWARE, AND
+# DISTRIBUTES IT "AS IS."
+#  
+# Waiver and Indemnity:  RECIPIENT AGREES TO WAIVE ANY AND ALL CLAIMS AGAINST THE UNITED
+# STATES GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR
+# RECIPIENT.  IF RECIPIENT'S USE OF THE SUBJECT SOFTWARE RESULTS IN ANY LIABILITIES,
+# DEMANDS, DAMAGES, EXPENSES OR LOSSES ARISING FROM SUCH USE, INCLUDING ANY
+# DAMAGES FROM PRODUCTS BASED ON, OR RESULTING FROM, RECIPIENT'S USE OF THE SUBJECT
+# SOFTWARE, RECIPIENT SHALL INDEMNIFY AND HOLD HARMLESS THE UNITED STATES
+# GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR RECIPIENT,
+# TO THE EXTENT PERMITTED BY LAW.  RECIPIENT'S SOLE REMEDY FOR ANY SUCH MATTER SHALL
+# BE THE IMMEDIATE, UNILATERAL TERMINATION OF THIS AGREEMENT.
+#
+
+
+import os
+import sys
+import time
+import logging
+import cProfile
+import threading
+
+
+MODES = ['SAMPLE', 'CPROFILE']
+INTERVAL = .005  # seconds between stack samples
+MAX_SECONDS = 600  # longest capture, a forgotten profile stops itself
+LOG_DIR = 'LogFiles'
+
+
+# Profiles the thread that starts it, the aircraft loop in a worker or the
+# event loop in the server, while the system keeps running.
+#   SAMPLE    a daemon thread reads the thread's stack every INTERVAL and
+#             writes folded stacks, one "a;b;c count" line per stack, for
+#             flamegraph.pl or speedscope. Costs little, the profiled
+#             thread is never traced.
+#   CPROFILE  cProfile on the thread, exact call counts at a higher cost,
+#             written as pstats for python -m pstats or snakeviz.
+# A capture stops after seconds, or MAX_SECONDS, at the next poll(), or on
+# stop(). cProfile can only be turned off from the profiled thread so the
+# owner calls poll() from that thread.
+class Profiler:
+    def __init__(self):
+        self.mode = None
+        self.name = None
+        self.deadline = None
+        self.started = None
+        self.profile = None
+        self.thread = None
+        self.target = None
+        self.stacks = {}
+        self.samples = 0
+        self.labels = {}  # code object: label
+
+    def running(self):
+        return self.mode is not None
+
+    def start(self, name, mode='SAMPLE', seconds=None):
+        if self.running():
+            raise ValueError('{} profile already running'.format(self.mode))
+        if mode not in MODES:
+            raise ValueError('Unknown profile mode: {}'.format(mode))
+        if seconds is None or seconds <= 0 or seconds > MAX_SECONDS:
+            seconds = MAX_SECONDS
+        self.mode = mode
+        self.name = name
+        self.started = time.time()
+        self.deadline = self.started + seconds
+        if mode == 'CPROFILE':
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        else:
+            self.target = threading.get_ident()
+            self.stacks = {}
+            self.samples = 0
+            self.thread = threading.Thread(target=self.sample, daemon=True)
+            self.thread.start()
+
+    def sample(self):
+        while self.mode == 'SAMPLE':
+            frame = sys._current_frames().get(self.target)
+            if frame is None:
+                return
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                label = self.labels.get(code)
+                if label is None:
+                    label = '{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename),
+                                                code.co_firstlineno)
+                    self.labels[code] = label
+                stack.append(label)
+                frame = frame.f_back
+            del frame
+            key = ';'.join(reversed(stack))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+            self.samples += 1
+            time.sleep(INTERVAL)
+
+    def stop(self):
+        # returns the file written
+        if not self.running():
+            raise ValueError('No profile running')
+        mode = self.mode
+        self.mode = None
+        self.deadline = None
+        path = os.path.join(LOG_DIR, 'profile_{}_{}.{}'.format(
+            self.name, time.strftime('%Y-%m-%d_%H-%M-%S', time.localtime(self.started)),
+            'pstats' if mode == 'CPROFILE' else 'folded'))
+        if mode == 'CPROFILE':
+            self.profile.disable()
+            self.profile.dump_stats(path)
+            self.profile = None
+        else:
+            self.thread.join()
+            self.thread = None
+            with open(path, 'w') as f:
+                for key, count in sorted(self.stacks.items()):
+                    f.write('{} {}\n'.format(key, count))
+        return path
+
+    def poll(self, now=None):
+        # the reply for a capture that ran out, None otherwise
+        if self.deadline is None:
+            return None
+        if now is None:
+            now = time.time()
+        if now < self.deadline:
+            return None
+        return reply(self.name, 'SUCCESS', 'Stopped, wrote ' + self.stop())
+
+
+def reply(name, info, msg):
+    return '{"name":"PROFILE", "TARGET":"' + str(name) + '", "INFO":"' + info + \
+        '", "MSG":"' + msg.replace('\\', '/').replace('"', "'") + '"}'
+
+
+def command(profiler, name, words):
+    # PROFILE START [SAMPLE|CPROFILE] [seconds] or PROFILE STOP, returns the
+    # reply for the websocket
+    logger = logging.getLogger()
+    try:
+        if len(words) > 0 and words[0] == 'START':
+            mode = words[1].upper() if len(words) > 1 else 'SAMPLE'
+            seconds = float(words[2]) if len(words) > 2 else None
+            profiler.start(name, mode, seconds)
+            msg = 'Started {} for {:g}s'.format(mode, round(profiler.deadline - profiler.started, 1))
+        elif len(words) > 0 and words[0] == 'STOP':
+            msg = 'Stopped, wrote ' + profiler.stop()
+        else:
+            raise ValueError('Expected PROFILE START [SAMPLE|CPROFILE] [seconds] or PROFILE STOP')
+    except (ValueError, OSError) as e:
+        logger.info('PROFILE {}: {}'.format(name, e))
+        return reply(name, 'FAIL', str(e))
+    logger.info('PROFILE {}: {}'.format(name, msg))
+    return reply(name, 'SUCCESS', msg)
@@ -102,8 +102,6 @@ def readTlog(tlog, out=False):
             #     elif bad:
             #         print(tlog.timestamp)
             #         print(m)
-
-            m_list.append([ac, m, timestamp, delta])
         except Exception as e:
             print(e)
 
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+#
+# Author: Andrew Peters
+#
+# Copyright 2019 United States Government as represented by the Administrator of the National Aeronautics
+# and Space Administration. All Rights Reserved.
+#  
+# Disclaimers
+# No Warranty: THE SUBJECT SOFTWARE IS PROVIDED "AS IS" WITHOUT ANY WARRANTY OF ANY
+# KIND, EITHER EXPRESSED, IMPLIED, OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, ANY
+# WARRANTY THAT THE SUBJECT SOFTWARE WILL CONFORM TO SPECIFICATIONS, ANY IMPLIED
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, OR FREEDOM FROM
+# INFRINGEMENT, ANY WARRANTY THAT THE SUBJECT SOFTWARE WILL BE ERROR FREE, OR ANY
+# WARRANTY THAT DOCUMENTATION, IF PROVIDED, WILL CONFORM TO THE SUBJECT SOFTWARE.
+# THIS AGREEMENT DOES NOT, IN ANY MANNER, CONSTITUTE AN ENDORSEMENT BY GOVERNMENT
+# AGENCY OR ANY PRIOR RECIPIENT OF ANY RESULTS, RESULTING DESIGNS, HARDWARE,
+# SOFTWARE PRODUCTS OR ANY OTHER APPLICATIONS RESULTING FROM USE OF THE SUBJECT
+# SOFTWARE.  FURTHER, GOVERNMENT AGENCY DISCLAIMS ALL WARRANTIES AND LIABILITIES
+# REGARDING THIRD-PARTY SOFTWARE, IF PRESENT IN THE ORIGINAL SOFTWARE, AND
+# DISTRIBUTES IT "AS IS."
+#  
+# Waiver and Indemnity:  RECIPIENT AGREES TO WAIVE ANY AND ALL CLAIMS AGAINST THE UNITED
+# STATES GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR
+# RECIPIENT.  IF RECIPIENT'S USE OF THE SUBJECT SOFTWARE RESULTS IN ANY LIABILITIES,
+# DEMANDS, DAMAGES, EXPENSES OR LOSSES ARISING FROM SUCH USE, INCLUDING ANY
+# DAMAGES FROM PRODUCTS BASED ON, OR RESULTING FROM, RECIPIENT'S USE OF THE SUBJECT
+# SOFTWARE, RECIPIENT SHALL INDEMNIFY AND HOLD HARMLESS THE UNITED STATES
+# GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR RECIPIENT,
+# TO THE EXTENT PERMITTED BY LAW.  RECIPIENT'S SOLE REMEDY FOR ANY SUCH MATTER SHALL
+# BE THE IMMEDIATE, UNILATERAL TERMINATION OF THIS AGREEMENT.
+#
+
+import json
+import logging
+from operator import attrgetter
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+ENCODINGS = ['JSON', 'MSGPACK']
+not_json = set()  # heads of messages already warned about in transcode
+
+
+def encodeDefault(x):
+    # uint8_t arrays can come through as bytes
+    if isinstance(x, (bytes, bytearray)):
+        return list(x)
+    return str(x)
+
+
+# Builds the outbound json string for a mavlink message.
+# The field list and getter for each message id are built once and cached,
+# strings are quoted and escaped by json instead of by hand.
+class JsonEncoder:
+    def __init__(self):
+        self.fields = {}  # {msg id: (fieldnames, getter)}
+        self.heads = {}   # {(ac, name): '{"AIRCRAFT" : ac, "TYPE" : "name"'}
+        self.json = json.JSONEncoder(default=encodeDefault)
+        # orjson is optional, about 10x faster on float heavy messages
+        if orjson is not None:
+            self.dumps = lambda d: orjson.dumps(d, default=encodeDefault).decode()
+        else:
+            self.dumps = self.json.encode
+
+    def getFields(self, msg):
+        msg_id = msg.get_msgId()
+        f = self.fields.get(msg_id)
+        if f is None:
+            names = tuple(msg._fieldnames)
+            if len(names) == 0:
+                getter = None
+            elif len(names) == 1:
+                getter = lambda m, n=names[0]: (getattr(m, n),)
+            else:
+                getter = attrgetter(*names)
+            f = (names, getter)
+            self.fields[msg_id] = f
+        return f
+
+    def encode(self, ac, msg, name=None):
+        if name is None:
+            name = msg.get_type()
+        names, getter = self.getFields(msg)
+        head = self.heads.get((ac, name))
+        if head is None:
+            head = '{"AIRCRAFT" : ' + str(ac) + ', "TYPE" : "' + name + '", '
+            self.heads[(ac, name)] = head
+        if getter is None:
+            return head[:-2] + '}'
+        return head + self.dumps(dict(zip(names, getter(msg))))[1:]
+
+
+# Server side, converts a json message for clients that asked for msgpack.
+# Done once per message no matter how many clients use it. Some messages
+# are built by hand and are not valid json, those go out as the original
+# text, a text frame instead of a binary one.
+def transcode(msg, encoding):
+    if encoding == 'MSGPACK' and msgpack is not None:
+        loads = orjson.loads if orjson is not None else json.loads
+        try:
+            return msgpack.packb(loads(msg), use_bin_type=True)
+        except (ValueError, TypeError):
+            head = msg[:msg.find(',')] if ',' in msg else msg[:40]
+            if head not in not_json:
+                # once per kind of message, some are sent every second
+                not_json.add(head)
+                logger = logging.getLogger()
+                logger.warning('SERVER: Not json, sent as text to MSGPACK clients: {}'.format(msg[:200]))
+    return msg
+
+
+def hasEncoding(encoding):
+    if encoding == 'MSGPACK':
+        return msgpack is not None
+    return encoding in ENCODINGS
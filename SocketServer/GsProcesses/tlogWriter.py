@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+#
+# Author: Andrew Peters
+#
+# Copyright 2019 United States Government as represented by the Administrator of the National Aeronautics
+# and Space Administration. All Rights Reserved.
+#  
+# Disclaimers
+# No Warranty: THE SUBJECT SOFTWARE IS PROVIDED "AS IS" WITHOUT ANY WARRANTY OF ANY
+# KIND, EITHER EXPRESSED, IMPLIED, OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, ANY
+# WARRANTY THAT THE SUBJECT SOFTWARE WILL CONFORM TO SPECIFICATIONS, ANY IMPLIED
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, OR FREEDOM FROM
+# INFRINGEMENT, ANY WARRANTY THAT THE SUBJECT SOFTWARE WILL BE ERROR FREE, OR ANY
+# WARRANTY THAT DOCUMENTATION, IF PROVIDED, WILL CONFORM TO THE SUBJECT SOFTWARE.
+# THIS AGREEMENT DOES NOT, IN ANY MANNER, CONSTITUTE AN ENDORSEMENT BY GOVERNMENT
+# AGENCY OR ANY PRIOR RECIPIENT OF ANY RESULTS, RESULTING DESIGNS, HARDWARE,
+# SOFTWARE PRODUCTS OR ANY OTHER APPLICATIONS RESULTING FROM USE OF THE SUBJECT
+# SOFTWARE.  FURTHER, GOVERNMENT AGENCY DISCLAIMS ALL WARRANTIES AND LIABILITIES
+# REGARDING THIRD-PARTY SOFTWARE, IF PRESENT IN THE ORIGINAL SOFTWARE, AND
+# DISTRIBUTES IT "AS IS."
+#  
+# Waiver and Indemnity:  RECIPIENT AGREES TO WAIVE ANY AND ALL CLAIMS AGAINST THE UNITED
+# STATES GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR
+# RECIPIENT.  IF RECIPIENT'S USE OF THE SUBJECT SOFTWARE RESULTS IN ANY LIABILITIES,
+# DEMANDS, DAMAGES, EXPENSES OR LOSSES ARISING FROM SUCH USE, INCLUDING ANY
+# DAMAGES FROM PRODUCTS BASED ON, OR RESULTING FROM, RECIPIENT'S USE OF THE SUBJECT
+# SOFTWARE, RECIPIENT SHALL INDEMNIFY AND HOLD HARMLESS THE UNITED STATES
+# GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR RECIPIENT,
+# TO THE EXTENT PERMITTED BY LAW.  RECIPIENT'S SOLE REMEDY FOR ANY SUCH MATTER SHALL
+# BE THE IMMEDIATE, UNILATERAL TERMINATION OF THIS AGREEMENT.
+#
+
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+
+
+writers = []  # open writers in this process, closed by closeAll
+
+
+# Background writer for the flight .tlog files.
+# write() only appends to a bounded buffer, a daemon thread joins whatever
+# has built up into one file write, flushes it, and fsyncs every
+# fsync_interval seconds and on close. When the buffer is full the oldest
+# record is dropped so the receive path never waits on the disk.
+# Records are written exactly as given, the file is the same as the one
+# mavutil.mavlink_connection(log, write=True) would produce.
+class TlogWriter:
+    def __init__(self, path, size=10000, flush_interval=.2, fsync_interval=5):
+        self.path = path
+        self.size = size
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.f = open(path, 'ab')
+        self.ring = deque()
+        self.cond = threading.Condition()
+        self.running = True
+        self.written = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.bytes = 0
+        self.last_fsync = time.time()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        writers.append(self)
+
+    def write(self, buf):
+        with self.cond:
+            if len(self.ring) >= self.size:
+                self.ring.popleft()
+                self.dropped += 1
+            self.ring.append(bytes(buf))
+            if len(self.ring) > self.max_depth:
+                self.max_depth = len(self.ring)
+            # wake the writer early if the buffer is filling up
+            if len(self.ring) >= self.size // 2:
+                self.cond.notify()
+
+    def run(self):
+        logger = logging.getLogger()
+        dropped = 0
+        while True:
+            with self.cond:
+                if self.running and len(self.ring) < self.size // 2:
+                    self.cond.wait(self.flush_interval)
+                batch = list(self.ring)
+                self.ring.clear()
+                running = self.running
+
+            if len(batch) > 0:
+                data = b''.join(batch)
+                try:
+                    self.f.write(data)
+                    self.f.flush()
+                except (OSError, ValueError):
+                    logger.exception('TLOG: Error writing {}'.format(self.path))
+                self.written += len(batch)
+                self.bytes += len(data)
+
+            if time.time() - self.last_fsync >= self.fsync_interval:
+                self.fsync()
+                if self.dropped != dropped:
+                    logger.warning('TLOG: {} dropped {} records, buffer full'.format(
+                        self.path, self.dropped - dropped))
+                    dropped = self.dropped
+
+            if not running:
+                return
+
+    def fsync(self):
+        self.last_fsync = time.time()
+        try:
+            os.fsync(self.f.fileno())
+        except (OSError, ValueError):
+            pass
+
+    def close(self):
+        # write out everything still buffered, fsync and close the file
+        logger = logging.getLogger()
+        with self.cond:
+            if not self.running:
+                return
+            self.running = False
+            self.cond.notify()
+        self.thread.join()
+        self.fsync()
+        self.f.close()
+        if self in writers:
+            writers.remove(self)
+        logger.info('TLOG: Closed {} {}'.format(self.path, self.getStats()))
+
+    def getStats(self):
+        return {'depth': len(self.ring),
+                'max_depth': self.max_depth,
+                'written': self.written,
+                'dropped': self.dropped,
+                'bytes': self.bytes}
+
+
+def closeAll():
+    for w in writers[:]:
+        w.close()
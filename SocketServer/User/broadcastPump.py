@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+#
+# Author: Andrew Peters
+#
+# Copyright 2019 United States Government as represented by the Administrator of the National Aeronautics
+# and Space Administration. All Rights Reserved.
+#  
+# Disclaimers
+# No Warranty: THE SUBJECT SOFTWARE IS PROVIDED "AS IS" WITHOUT ANY WARRANTY OF ANY
+# KIND, EITHER EXPRESSED, IMPLIED, OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, ANY
+# WARRANTY THAT THE SUBJECT SOFTWARE WILL CONFORM TO SPECIFICATIONS, ANY IMPLIED
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, OR FREEDOM FROM
+# INFRINGEMENT, ANY WARRANTY THAT THE SUBJECT SOFTWARE WILL BE ERROR FREE, OR ANY
+# WARRANTY THAT DOCUMENTATION, IF PROVIDED, WILL CONFORM TO THE SUBJECT SOFTWARE.
+# THIS AGREEMENT DOES NOT, IN ANY MANNER, CONSTITUTE AN ENDORSEMENT BY GOVERNMENT
+# AGENCY OR ANY PRIOR RECIPIENT OF ANY RESULTS, RESULTING DESIGNS, HARDWARE,
+# SOFTWARE PRODUCTS OR ANY OTHER APPLICATIONS RESULTING FROM USE OF THE SUBJECT
+# SOFTWARE.  FURTHER, GOVERNMENT AGENCY DISCLAIMS ALL WARRANTIES AND LIABILITIES
+# REGARDING THIRD-PARTY SOFTWARE, IF PRESENT IN THE ORIGINAL SOFTWARE, AND
+# DISTRIBUTES IT "AS IS."
+#  
+# Waiver and Indemnity:  RECIPIENT AGREES TO WAIVE ANY AND ALL CLAIMS AGAINST THE UNITED
+# STATES GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR
+# RECIPIENT.  IF RECIPIENT'S USE OF THE SUBJECT SOFTWARE RESULTS IN ANY LIABILITIES,
+# DEMANDS, DAMAGES, EXPENSES OR LOSSES ARISING FROM SUCH USE, INCLUDING ANY
+# DAMAGES FROM PRODUCTS BASED ON, OR RESULTING FROM, RECIPIENT'S USE OF THE SUBJECT
+# SOFTWARE, RECIPIENT SHALL INDEMNIFY AND HOLD HARMLESS THE UNITED STATES
+# GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR RECIPIENT,
+# TO THE EXTENT PERMITTED BY LAW.  RECIPIENT'S SOLE REMEDY FOR ANY SUCH MATTER SHALL
+# BE THE IMMEDIATE, UNILATERAL TERMINATION OF THIS AGREEMENT.
+#
+
+
+import time
+import queue
+import asyncio
+import logging
+import threading
+
+import GsProcesses.metrics as MX
+
+
+# Single reader for the aircraft process queue.
+# A daemon thread blocks on the multiprocessing queue and hands batches of
+# messages to the event loop, so the loop only wakes up when there is data.
+# Every message is passed to notify exactly once, notify gets it to each user.
+# Telemetry from the aircraft link comes with a metrics.Trace for notify.
+class BroadcastPump:
+    def __init__(self, get_queue, timeout=.5, max_batch=256):
+        # get_queue returns the current queue, the server replaces it
+        # after terminating a process that would not shut down
+        self.get_queue = get_queue
+        self.timeout = timeout
+        self.max_batch = max_batch
+        self.running = False
+        self.loop = None
+        self.pending = None
+        self.thread = None
+        self.count = 0
+
+    def read_queue(self):
+        logger = logging.getLogger()
+        while self.running:
+            q = self.get_queue()
+            try:
+                batch = [q.get(timeout=self.timeout)]
+            except queue.Empty:
+                continue
+            except (OSError, ValueError, EOFError):
+                # queue was closed, wait for the server to replace it
+                logger.info('SERVER: Broadcast queue closed, waiting for new queue.')
+                time.sleep(self.timeout)
+                continue
+
+            # drain whatever else is already waiting
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(q.get_nowait())
+                except (queue.Empty, OSError, ValueError, EOFError):
+                    break
+
+            self.loop.call_soon_threadsafe(self.pending.put_nowait, (time.monotonic(), batch))
+
+    def start(self):
+        self.loop = asyncio.get_event_loop()
+        self.pending = asyncio.Queue()
+        self.running = True
+        self.thread = threading.Thread(target=self.read_queue, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    async def run(self, notify):
+        logger = logging.getLogger()
+        if not self.running:
+            self.start()
+        while self.running:
+            read, batch = await self.pending.get()
+            # time from the queue read to the event loop
+            hop = time.monotonic() - read
+            for x in batch:
+                self.count += 1
+                MX.registry.observe('stage_seconds', hop, stage='queue_hop')
+                t = time.perf_counter()
+                try:
+                    if isinstance(x, tuple):
+                        # (msg, receive time, put time) from the aircraft process
+                        await notify(x[0], MX.Trace(x[1], x[2], read))
+                    else:
+                        await notify(str(x))
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    # one bad message must not end the only broadcast task
+                    logger.exception('SERVER: Broadcast failed for {}'.format(str(x)[:200]))
+                    continue
+                MX.registry.observe('stage_seconds', time.perf_counter() - t, stage='notify')
@@ -0,0 +1,167 @@
+#
+# Author: Andrew Peters
+#
+# Copyright 2019 United States Government as represented by the Administrator of the National Aeronautics
+# and Space Administration. All Rights Reserved.
+#  
+# Disclaimers
+# No Warranty: THE SUBJECT SOFTWARE IS PROVIDED "AS IS" WITHOUT ANY WARRANTY OF ANY
+# KIND, EITHER EXPRESSED, IMPLIED, OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, ANY
+# WARRANTY THAT THE SUBJECT SOFTWARE WILL CONFORM TO SPECIFICATIONS, ANY IMPLIED
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, OR FREEDOM FROM
+# INFRINGEMENT, ANY WARRANTY THAT THE SUBJECT SOFTWARE WILL BE ERROR FREE, OR ANY
+# WARRANTY THAT DOCUMENTATION, IF PROVIDED, WILL CONFORM TO THE SUBJECT SOFTWARE.
+# THIS AGREEMENT DOES NOT, IN ANY MANNER, CONSTITUTE AN ENDORSEMENT BY GOVERNMENT
+# AGENCY OR ANY PRIOR RECIPIENT OF ANY RESULTS, RESULTING DESIGNS, HARDWARE,
+# SOFTWARE PRODUCTS OR ANY OTHER APPLICATIONS RESULTING FROM USE OF THE SUBJECT
+# SOFTWARE.  FURTHER, GOVERNMENT AGENCY DISCLAIMS ALL WARRANTIES AND LIABILITIES
+# REGARDING THIRD-PARTY SOFTWARE, IF PRESENT IN THE ORIGINAL SOFTWARE, AND
+# DISTRIBUTES IT "AS IS."
+#  
+# Waiver and Indemnity:  RECIPIENT AGREES TO WAIVE ANY AND ALL CLAIMS AGAINST THE UNITED
+# STATES GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR
+# RECIPIENT.  IF RECIPIENT'S USE OF THE SUBJECT SOFTWARE RESULTS IN ANY LIABILITIES,
+# DEMANDS, DAMAGES, EXPENSES OR LOSSES ARISING FROM SUCH USE, INCLUDING ANY
+# DAMAGES FROM PRODUCTS BASED ON, OR RESULTING FROM, RECIPIENT'S USE OF THE SUBJECT
+# SOFTWARE, RECIPIENT SHALL INDEMNIFY AND HOLD HARMLESS THE UNITED STATES
+# GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR RECIPIENT,
+# TO THE EXTENT PERMITTED BY LAW.  RECIPIENT'S SOLE REMEDY FOR ANY SUCH MATTER SHALL
+# BE THE IMMEDIATE, UNILATERAL TERMINATION OF THIS AGREEMENT.
+#
+
+import time
+import asyncio
+import logging
+from collections import deque
+
+import GsProcesses.metrics as MX
+
+
+POLICIES = ['coalesce', 'drop_oldest', 'disconnect']
+
+# state messages where only the latest value per aircraft matters,
+# a newer one replaces the one still waiting in the buffer
+COALESCE_TYPES = {'GLOBAL_POSITION_INT', 'ATTITUDE', 'HEARTBEAT', 'VFR_HUD',
+                  'GPS_RAW_INT', 'SYS_STATUS', 'BATTERY_STATUS', 'RADIO_QUALITY',
+                  'MISSION_CURRENT', 'CONNECTING'}
+
+ECHO_INTERVAL = 1  # seconds between ECHO messages to a client in echo mode
+ECHO_PENDING = 100  # unanswered ECHO messages kept
+
+
+def clientName(websocket):
+    if hasattr(websocket, 'remote_address'):
+        return str(websocket.remote_address)
+    return str(websocket)
+
+
+# Bounded outgoing buffer for one websocket, drained by its own task so a
+# slow client only ever delays itself.
+#   coalesce    - replace a waiting state message with the newer one,
+#                 drop the oldest message when full
+#   drop_oldest - drop the oldest message when full
+#   disconnect  - close the client when full
+class SendBuffer:
+    def __init__(self, websocket, size=1000, policy='coalesce'):
+        if policy not in POLICIES:
+            raise ValueError('Unknown drop policy: {}'.format(policy))
+        self.websocket = websocket
+        self.size = size
+        self.policy = policy
+        self.client = clientName(websocket)  # metrics label
+        self.queue = deque()   # [[key, msg, time queued, trace], ...]
+        self.latest = {}       # {key: entry} waiting messages that can be replaced
+        self.ready = asyncio.Event()
+        self.task = None
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.echo = None       # encodes ECHO messages when in echo mode
+        self.echo_id = 0
+        self.echo_time = 0
+        self.echo_pending = {}  # {id: [time sent, trace]}
+
+    def put(self, msg, key=None, trace=None):
+        # returns False if the client is too slow and should be disconnected
+        if self.policy != 'coalesce':
+            key = None
+        elif key is not None:
+            entry = self.latest.get(key)
+            if entry is not None:
+                entry[1] = msg
+                entry[3] = trace
+                self.coalesced += 1
+                return True
+
+        if len(self.queue) >= self.size:
+            if self.policy == 'disconnect':
+                return False
+            old = self.queue.popleft()
+            if old[0] is not None and self.latest.get(old[0]) is old:
+                del self.latest[old[0]]
+            self.dropped += 1
+
+        entry = [key, msg, time.monotonic(), trace]
+        self.queue.append(entry)
+        if key is not None:
+            self.latest[key] = entry
+        self.ready.set()
+        return True
+
+    async def drain(self):
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            while self.queue:
+                entry = self.queue.popleft()
+                if entry[0] is not None and self.latest.get(entry[0]) is entry:
+                    del self.latest[entry[0]]
+                t = time.monotonic()
+                MX.registry.observe('stage_seconds', t - entry[2], stage='send_wait', client=self.client)
+                await self.websocket.send(entry[1])
+                now = time.monotonic()
+                MX.registry.observe('stage_seconds', now - t, stage='websocket_send', client=self.client)
+                self.sent += 1
+                trace = entry[3]
+                if trace is not None:
+                    trace.sent(entry[2], now)
+                    if self.echo is not None and now - self.echo_time >= ECHO_INTERVAL:
+                        await self.sendEcho(trace, now)
+
+    async def sendEcho(self, trace, now):
+        # the client answers ECHO <id> once it has read the message before
+        self.echo_time = now
+        self.echo_id += 1
+        self.echo_pending[self.echo_id] = [now, trace]
+        if len(self.echo_pending) > ECHO_PENDING:
+            del self.echo_pending[min(self.echo_pending)]
+        await self.websocket.send(self.echo('{"name":"ECHO", "ID":' + str(self.echo_id) + '}'))
+
+    def echoed(self, echo_id):
+        try:
+            sent, trace = self.echo_pending.pop(int(echo_id))
+        except (KeyError, ValueError):
+            return
+        trace.echoed(sent, time.monotonic())
+
+    def start(self, on_error):
+        async def run():
+            try:
+                await self.drain()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.getLogger().info('SERVER: Send failed {}'.format(self.websocket))
+                await on_error(self.websocket)
+        self.task = asyncio.ensure_future(run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def getStats(self):
+        return {'queued': len(self.queue),
+                'sent': self.sent,
+                'dropped': self.dropped,
+                'coalesced': self.coalesced}
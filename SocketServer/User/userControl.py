@@ -31,13 +31,21 @@
 
 import time
 
+import User.sendBuffer as SB
+import GsProcesses.decimator as DM
+
 
 class User:
-    def __init__(self, websocket):
+    def __init__(self, websocket, buffer_size=1000, policy='coalesce'):
         self.websocket = websocket
+        self.buffer = SB.SendBuffer(websocket, buffer_size, policy)
         self.ac_list = []
         self.visible = True
         self.watchOnly = False
+        self.subscriptions = {}  # {ac: set of TYPEs, None for every TYPE}
+        self.exclusions = {}     # {ac: set of TYPEs} left out of an every TYPE subscription
+        self.encoding = 'JSON'
+        self.rates = DM.Decimator()  # per client max rates, set with RATE
 
     def addUserAircraft(self, id):
         self.ac_list.append(id)
@@ -56,3 +64,44 @@ class User:
             self.watchOnly = True
         else:
             self.watchOnly = False
+
+    def subscribe(self, ac, types=None):
+        # no types means every message from this aircraft
+        ac = str(ac)
+        if not types:
+            self.subscriptions[ac] = None
+            self.exclusions.pop(ac, None)
+        elif ac in self.subscriptions and self.subscriptions[ac] is None:
+            # already getting every type, take these back off the exclusions
+            self.exclusions.get(ac, set()).difference_update(types)
+        else:
+            self.subscriptions.setdefault(ac, set()).update(types)
+
+    def unsubscribe(self, ac, types=None):
+        # returns an error message, None on success
+        ac = str(ac)
+        if ac == 'ALL':
+            self.subscriptions = {}
+            self.exclusions = {}
+        elif ac not in self.subscriptions:
+            return 'Not subscribed to ' + ac + ', SUBSCRIBE ' + ac + ' first'
+        elif not types:
+            del self.subscriptions[ac]
+            self.exclusions.pop(ac, None)
+        elif self.subscriptions[ac] is None:
+            # every type of this aircraft but these
+            self.exclusions.setdefault(ac, set()).update(types)
+        else:
+            self.subscriptions[ac].difference_update(types)
+            if len(self.subscriptions[ac]) == 0:
+                del self.subscriptions[ac]
+        return None
+
+    def wants(self, ac, msg_type):
+        types = self.subscriptions.get(ac, ())
+        if types is None:
+            return msg_type not in self.exclusions.get(ac, ())
+        return msg_type in types
+
+    def hasSubscriptions(self):
+        return len(self.subscriptions) > 0
@@ -32,40 +32,213 @@
 #
 
 
+import re
+import json
 import time
 import asyncio
 import os
 import logging
 
 import GsProcesses.icProcesses as ICP
+import GsProcesses.telemetryEncoder as TE
+import GsProcesses.metrics as MX
 import User.userControl as UC
+import User.sendBuffer as SB
+
+
+# aircraft telemetry starts with {"AIRCRAFT" : <ac>, "TYPE" : "<type>"
+# anything else (server info, playback, "name" messages) goes to everyone
+HEADER = re.compile(r'\s*\{\s*"AIRCRAFT"\s*:\s*"?([^",\s]+)"?\s*,\s*"TYPE"\s*:\s*"([^"]*)"')
+
+
+def parseHeader(msg):
+    m = HEADER.match(msg)
+    if m is None:
+        return None, None
+    return m.group(1), m.group(2)
 
 
 class UserManager:
-    def __init__(self):
+    def __init__(self, buffer_size=1000, policy='coalesce'):
         self.USERS = []
+        self.buffer_size = buffer_size
+        self.policy = policy
+        self.firehose = []   # users without subscriptions get everything
+        self.index = {}      # {ac: [user subscribed to ac, ...]}
+        self.routes = {}     # {(ac, TYPE): [user, ...]} built from the index
+        self.held_timer = None  # sends held messages when the first one is due
 
     async def register(self, websocket):
-        user = UC.User(websocket)
+        user = UC.User(websocket, self.buffer_size, self.policy)
+        user.buffer.start(self.unregister)
         self.USERS.append(user)
+        self.updateIndex()
         self.showAllUsers()
 
     async def unregister(self, websocket):
+        for user in [x for x in self.USERS if x.websocket == websocket]:
+            user.buffer.stop()
+            MX.registry.remove(client=user.buffer.client)
         self.USERS = [x for x in self.USERS if x.websocket != websocket]
+        self.updateIndex()
         self.showAllUsers()
 
     def getUser(self, websocket):
         user = [x for x in self.USERS if x.websocket == websocket]
         return user[0]
 
-    async def notifyUsers(self, msg):
+    def subscribe(self, websocket, ac, types=None):
+        self.getUser(websocket).subscribe(ac, types)
+        self.updateIndex()
+
+    def unsubscribe(self, websocket, ac, types=None):
+        error = self.getUser(websocket).unsubscribe(ac, types)
+        self.updateIndex()
+        if error is not None:
+            self.reply(websocket, 'UNSUBSCRIBE', False, error)
+        return error is None
+
+    def reply(self, websocket, name, ok, msg):
+        # answer to one client's request, only that client gets it
+        user = self.getUser(websocket)
+        out = '{"name":"' + name + '", "INFO":"' + ('SUCCESS' if ok else 'FAIL') + \
+            '", "MSG":' + json.dumps(msg) + '}'
+        user.buffer.put(TE.transcode(out, user.encoding))
+
+    def sendTo(self, websocket, msg):
+        # a message only this client gets, dropped if it has left
+        user = [x for x in self.USERS if x.websocket == websocket]
+        if user:
+            user[0].buffer.put(TE.transcode(msg, user[0].encoding))
+
+    def setEncoding(self, websocket, encoding):
+        user = self.getUser(websocket)
+        if TE.hasEncoding(encoding):
+            user.encoding = encoding
+            msg = '{"name":"ENCODING", "INFO":"SUCCESS", "MSG":"' + encoding + '"}'
+        else:
+            msg = '{"name":"ENCODING", "INFO":"FAIL", "MSG":"' + encoding + ' not available"}'
+        user.buffer.put(TE.transcode(msg, user.encoding))
+        return user.encoding == encoding
+
+    def setRate(self, websocket, msg_type, hz):
+        # RATE <TYPE> <hz>, hz 0 removes the limit, RATE ALL 0 removes every limit
+        user = self.getUser(websocket)
+        msg_type = msg_type.upper()
+        try:
+            hz = float(hz)
+        except ValueError:
+            hz = None
+        if hz is None:
+            ok = False
+        elif msg_type == 'ALL':
+            # only clearing is supported, anything else changes nothing
+            ok = hz <= 0
+            if ok:
+                user.rates.clear()
+        else:
+            ok = user.rates.setRate(msg_type, hz)
+        info = 'SUCCESS' if ok else 'FAIL'
+        msg = '{"name":"RATE", "INFO":"' + info + '", "RATES":' + json.dumps(user.rates.getRates()) + '}'
+        user.buffer.put(TE.transcode(msg, user.encoding))
+        return ok
+
+    def updateIndex(self):
+        # rebuild the per aircraft index, only happens when users or
+        # subscriptions change, not per message
+        self.firehose = [x for x in self.USERS if not x.hasSubscriptions()]
+        self.index = {}
+        for user in self.USERS:
+            for ac in user.subscriptions:
+                self.index.setdefault(ac, []).append(user)
+        self.routes = {}
+
+    def getRecipients(self, ac, msg_type):
+        if ac is None:
+            return self.USERS
+        key = (ac, msg_type)
+        users = self.routes.get(key)
+        if users is None:
+            users = self.firehose + [x for x in self.index.get(ac, []) if x.wants(ac, msg_type)]
+            self.routes[key] = users
+        return users
+
+    async def notifyUsers(self, msg, trace=None):
+        # only queues the message, each user's buffer sends it on its own task
         if self.USERS:
-            for user in self.USERS:
-                try:
-                    await user.websocket.send(msg)
-                    # print(user, user)
-                except:
-                    await self.unregister(user.websocket)
+            ac, msg_type = parseHeader(msg)
+            if trace is not None:
+                trace.routed(ac, time.monotonic())
+            key = None
+            if msg_type in SB.COALESCE_TYPES:
+                key = (ac, msg_type)
+            encoded = {'JSON': msg}
+            slow = []
+            held = False
+            now = time.time()
+            for user in self.getRecipients(ac, msg_type):
+                if user.rates.hasRates() and \
+                        not user.rates.offer((ac, msg_type), msg_type, (key, msg), now):
+                    held = True
+                    continue
+                out = encoded.get(user.encoding)
+                if out is None:
+                    out = encoded[user.encoding] = TE.transcode(msg, user.encoding)
+                if not user.buffer.put(out, key, trace):
+                    slow.append(user)
+            if held:
+                self.scheduleHeld(now)
+            for user in slow:
+                logger = logging.getLogger()
+                logger.info('SERVER: Disconnecting slow client {}'.format(user.websocket))
+                await self.unregister(user.websocket)
+                asyncio.ensure_future(user.websocket.close())
+
+    def scheduleHeld(self, now):
+        # wakes sendHeld when the earliest held message is due, nothing runs
+        # while no client has a message held back by its RATE limits
+        due = [x for x in (user.rates.timeout(now) for user in self.USERS) if x is not None]
+        if not due:
+            return
+        loop = asyncio.get_event_loop()
+        when = loop.time() + min(due)
+        if self.held_timer is not None:
+            if self.held_timer.when() <= when:
+                return
+            self.held_timer.cancel()
+        self.held_timer = loop.call_at(when, self.sendHeld)
+
+    def sendHeld(self):
+        # sends the latest message held back by each client's RATE limits
+        self.held_timer = None
+        now = time.time()
+        for user in self.USERS:
+            for key, msg in user.rates.due(now):
+                user.buffer.put(TE.transcode(msg, user.encoding), key)
+        self.scheduleHeld(now)
+
+    def setEcho(self, websocket, on):
+        # ECHO ON|OFF, the client answers ECHO messages for the latency trace
+        user = self.getUser(websocket)
+        if on:
+            user.buffer.echo = lambda msg: TE.transcode(msg, user.encoding)
+        else:
+            user.buffer.echo = None
+
+    def echoed(self, websocket, echo_id):
+        self.getUser(websocket).buffer.echoed(echo_id)
+
+    def getStats(self):
+        return [[x.buffer.client, x.buffer.getStats()] for x in self.USERS]
+
+    def updateMetrics(self):
+        # send buffer counts for the metrics endpoint
+        MX.registry.gauge('clients', len(self.USERS))
+        for user in self.USERS:
+            stats = user.buffer.getStats()
+            MX.registry.gauge('send_queued', stats['queued'], client=user.buffer.client)
+            for x in ['sent', 'dropped', 'coalesced']:
+                MX.registry.setTotal('send_{}_total'.format(x), stats[x], client=user.buffer.client)
 
     def showAllUsers(self):
         logger = logging.getLogger()
@@ -75,6 +248,8 @@ class UserManager:
             logger.info('AC List: {}'.format(str(user.ac_list)))
             logger.info('Visible: {}'.format(str(user.visible)))
             logger.info('Watch Only: {}'.format(str(user.watchOnly)))
+            logger.info('Subscriptions: {}'.format(str(user.subscriptions)))
+            logger.info('Send Buffer: {}'.format(str(user.buffer.getStats())))
             logger.info('************')
 
 
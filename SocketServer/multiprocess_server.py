@@ -31,7 +31,7 @@
 # BE THE IMMEDIATE, UNILATERAL TERMINATION OF THIS AGREEMENT.
 
 
-from multiprocessing import Process, Queue, Manager
+from multiprocessing import Process, Queue
 import multiprocessing
 import asyncio
 import websockets
@@ -47,12 +47,19 @@ import ssl
 from argparse import ArgumentParser
 
 import GsProcesses.icProcesses as ICP
+import GsProcesses.commandChannel as CC
+import GsProcesses.metrics as MX
+import GsProcesses.profiler as PR
 import User.userControl as UC
 import User.userManager as UM
+import User.broadcastPump as BP
 
 
 
 q = Queue()
+pump = None
+collector = MX.Collector()  # metrics snapshots from the aircraft processes
+profiler = PR.Profiler()  # profiles the event loop, PROFILE ...
 playback = False
 path_icarous = ''
 
@@ -84,11 +91,16 @@ async def consumer_handler(websocket, path):
             ac = int(message[3])
             user = um.getUser(websocket)
             user.addUserAircraft(ac)
-            m = manager.list([message])
+            m = CC.CommandChannel(message)
             p = addProcess(to_ic, (q, m))
+            try:
+                p.start()
+            except Exception:
+                logger.exception('SERVER: Unable to start aircraft {}'.format(ac))
+                m.close()
+                continue
             m_lists.append([ac, m])
             processes.append([ac, p])
-            p.start()
             logger.info('SERVER: Starting New Aircraft {}'.format(processes))
 
         elif 'SHUTDOWN' in message:
@@ -105,7 +117,7 @@ async def consumer_handler(websocket, path):
             if (len(m) > 0):
                 m_lists.remove([x for x in m_lists if x[0] == ac][0])
                 m1 = m[0]
-                m1.append(message)
+                m1.send(message)
                 # find the process
                 p = [x for x in processes if x[0] == ac]
                 processes.remove(p[0])
@@ -117,6 +129,8 @@ async def consumer_handler(websocket, path):
                     q.close()
                     q.join_thread()
                     q = Queue()
+                # ends its writer thread and closes the pipe
+                m1.close()
 
                 # remove the list
                 del m
@@ -158,6 +172,45 @@ async def consumer_handler(websocket, path):
             else: 
                 q.put('{"name":"PATH_ICAROUS", "type":"FAIL", "I":"INVALID OS"}')
 
+        elif message[0] in ['ENCODING', 'RATE', 'SUBSCRIBE', 'UNSUBSCRIBE'] and len(message) < 2:
+            um.reply(websocket, message[0], False, 'Missing argument')
+
+        elif message[0] == 'ENCODING':
+            # ENCODING <JSON or MSGPACK>
+            um.setEncoding(websocket, message[1])
+            logger.info('SERVER: Encoding {}'.format(message[1:]))
+
+        elif message[0] == 'RATE':
+            # RATE <TYPE> <hz>, per client max rate for a message type
+            um.setRate(websocket, message[1], message[2] if len(message) > 2 else '')
+            logger.info('SERVER: Rate {}'.format(message[1:]))
+
+        elif message[0] == 'PROFILE':
+            # PROFILE START [SAMPLE|CPROFILE] [seconds], PROFILE STOP
+            # AIRCRAFT <ac> PROFILE ... goes to the aircraft process
+            um.sendTo(websocket, PR.command(profiler, 'server', message[1:]))
+            if profiler.deadline is not None:
+                asyncio.get_event_loop().call_later(
+                    profiler.deadline - time.time(), stopProfile, websocket)
+
+        elif message[0] == 'ECHO' and len(message) > 1:
+            # ECHO ON|OFF, or ECHO <id> answering an ECHO message
+            if message[1] in ['ON', 'OFF']:
+                um.setEcho(websocket, message[1] == 'ON')
+                logger.info('SERVER: Echo {}'.format(message[1]))
+            else:
+                um.echoed(websocket, message[1])
+
+        elif message[0] == 'UNSUBSCRIBE':
+            # UNSUBSCRIBE <ac or ALL> [TYPE ...]
+            um.unsubscribe(websocket, message[1], message[2:])
+            logger.info('SERVER: Unsubscribe {}'.format(message[1:]))
+
+        elif message[0] == 'SUBSCRIBE':
+            # SUBSCRIBE <ac> [TYPE ...], no TYPE means every message from <ac>
+            um.subscribe(websocket, message[1], message[2:])
+            logger.info('SERVER: Subscribe {}'.format(message[1:]))
+
         elif 'AIRCRAFT' in message:
             if message[1] != 'None' and not playback:
 
@@ -175,7 +228,7 @@ async def consumer_handler(websocket, path):
                             'SERVER: AC not found in list. Unable to shut down.', exc_info=True)
                         pass
                     m1 = m[0]
-                    m1.append(message)
+                    m1.send(message)
                     # find the process and remove it
                     p = [x for x in processes if x[0] == ac]
                     processes.remove(p[0])
@@ -191,6 +244,7 @@ async def consumer_handler(websocket, path):
                         q.close()
                         q.join_thread()
                         q = Queue()
+                    m1.close()
                     del m
                     logger.info('SERVER: Active children: {}'.format(
                                 multiprocessing.active_children()))
@@ -201,9 +255,9 @@ async def consumer_handler(websocket, path):
                     m = [x[1] for x in m_lists if x[0] == ac]
                     try:
                         m = m[0]
-                        m.append(message)
+                        m.send(message)
                     except Exception as e:
-                        print('could not append message', e)
+                        print('could not send message', e)
                         print('playback', playback)
 
             elif 'HITL' in message:
@@ -212,7 +266,7 @@ async def consumer_handler(websocket, path):
                 # setup the new process
                 user = um.getUser(websocket)
                 user.addUserAircraft(ac)
-                m = manager.list([message])
+                m = CC.CommandChannel(message)
                 p = addProcess(to_ic, (q, m))
                 m_lists.append([ac, m])
                 print('m lists', m_lists)
@@ -243,7 +297,7 @@ async def consumer_handler(websocket, path):
                     # setup the new process
                     user = um.getUser(websocket)
                     user.addUserAircraft(-1)
-                    m = manager.list([message])
+                    m = CC.CommandChannel(message)
                     p = addProcess(to_ic, (q, m))
                     m_lists.append([-1, m])
                     processes.append([-1, p])
@@ -252,7 +306,9 @@ async def consumer_handler(websocket, path):
 
                 else:
                     #  pass the message
-                    m.append(message)
+                    m = [x[1] for x in m_lists if x[0] == -1]
+                    if len(m) > 0:
+                        m[0].send(message)
 
             else:
                 logger.info('SERVER: Ignoring unassigned aircraft messages for now. {}'.format(message))
@@ -260,12 +316,12 @@ async def consumer_handler(websocket, path):
         elif 'ADD_TRAFFIC' in message:
             for m in m_lists:
                 x = ['AIRCRAFT '] + [m[0]] + message
-                m[1].append(x)
+                m[1].send(x)
 
         elif 'REMOVE_TRAFFIC' in message:
             for m in m_lists:
                 x = ['AIRCRAFT '] + [m[0]] + message
-                m[1].append(x)
+                m[1].send(x)
 
         else:
             logger.info('SERVER: Undefined Input Message: {}'.format(message))
@@ -280,33 +336,45 @@ def execute(cmd):
         raise subprocess.CalledProcessError(p.returncode, p.args)
 
 
-async def producer_handler(websocket, path):
-    while True:
-        if not q.empty():
-            # get the next message
-            x = q.get(block=False)
-            # send message over web socket
-            # print(x)
-            await um.notifyUsers(str(x))
-        await asyncio.sleep(.001)
+async def producer_handler():
+    # one pump for all of the websockets, each message is read from q once
+    # and sent once to each user
+    global pump
+    pump = BP.BroadcastPump(lambda: q)
+    await pump.run(routeMessage)
+
+
+async def routeMessage(msg, trace=None):
+    # metrics snapshots stay on the server, everything else goes to the users
+    # with the metrics.Trace the pump made for aircraft telemetry
+    if msg.startswith(MX.PREFIX):
+        collector.load(msg)
+    else:
+        await um.notifyUsers(msg, trace)
+
+
+def stopProfile(websocket):
+    # end of a timed server profile, runs on the event loop like the profile,
+    # the report goes to the client that started it
+    msg = profiler.poll()
+    if msg is not None:
+        um.sendTo(websocket, msg)
+
+
+def collectMetrics():
+    um.updateMetrics()
+    return collector.export()
 
 
 # allows duplex communication
 async def handler(websocket, path):
     await um.register(websocket)
-
-    consumer_task = asyncio.ensure_future(
-        consumer_handler(websocket, path))
-    producer_task = asyncio.ensure_future(
-        producer_handler(websocket, path))
-    done, pending = await asyncio.wait(
-        [consumer_task, producer_task],
-        return_when=asyncio.FIRST_COMPLETED,
-    )
-    for task in pending:
-        task.cancel()
-
-    await um.unregister(websocket)
+    try:
+        await consumer_handler(websocket, path)
+    except websockets.exceptions.ConnectionClosed:
+        pass
+    finally:
+        await um.unregister(websocket)
 
 
 def ask_exit(signame):
@@ -323,6 +391,12 @@ if __name__ == "__main__":
     parser.add_argument("--DEV", default=False, help="Dev Mode. Use http instead https")
     parser.add_argument("--CERT", default='localhost.crt', help="Cert file name. default: localhost.crt")
     parser.add_argument("--KEY", default='localhost.key', help="Key file name. default: localhost.key")
+    parser.add_argument("--SEND_BUFFER", default=1000, type=int, help="max messages waiting per websocket. default: 1000")
+    parser.add_argument("--DROP_POLICY", default='coalesce', choices=['coalesce', 'drop_oldest', 'disconnect'],
+                        help="what to do when a websocket buffer is full. default: coalesce")
+    parser.add_argument("--METRICS_IP", default='127.0.0.1', help="metrics http address. default: 127.0.0.1")
+    parser.add_argument("--METRICS_PORT", default=9101, type=int,
+                        help="Prometheus metrics port, 0 turns it off. default: 9101")
     args = parser.parse_args()
 
     IP = args.IP
@@ -331,7 +405,7 @@ if __name__ == "__main__":
     CERT = args.CERT
     KEY = args.KEY
 
-    um = UM.UserManager()
+    um = UM.UserManager(args.SEND_BUFFER, args.DROP_POLICY)
 
     logging.basicConfig(
         filename=os.path.join('LogFiles','server_log_{}.log'.format(time.strftime("%Y-%m-%d_%H-%M-%S", 
@@ -345,30 +419,32 @@ if __name__ == "__main__":
     q = Queue()
     processes = []
 
-    with Manager() as manager:
-        if DEV:
-            # start ws server
-            start_server = websockets.serve(handler, IP, PORT)
-        else:
-            # start wss server
-            ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER) # this allows only server side, and auto negotiates highest tls level
-            certfile = os.path.join(os.getcwd(), 'certs', CERT)
-            keyfile =  os.path.join(os.getcwd(), 'certs', KEY)
-            ssl_context.load_cert_chain(certfile=certfile, keyfile=keyfile)
-            start_server = websockets.serve(handler, IP, PORT, ssl=ssl_context)
-
-        loop = asyncio.get_event_loop()
-        loop.run_until_complete(start_server)
-        
-        if platform.system() is not 'Windows':
-            for signame in ('SIGINT', 'SIGTERM'):
-                loop.add_signal_handler(getattr(signal, signame),functools.partial(ask_exit, signame))
-
-        print("Event loop running forever, press Ctrl+C to interrupt.")
-        print("pid %s: send SIGINT or SIGTERM to exit." % os.getpid())
-
-        # keeps the socket open forever
-        try:
-            loop.run_forever()
-        finally:
-            loop.close()
+    if DEV:
+        # start ws server
+        start_server = websockets.serve(handler, IP, PORT)
+    else:
+        # start wss server
+        ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER) # this allows only server side, and auto negotiates highest tls level
+        certfile = os.path.join(os.getcwd(), 'certs', CERT)
+        keyfile =  os.path.join(os.getcwd(), 'certs', KEY)
+        ssl_context.load_cert_chain(certfile=certfile, keyfile=keyfile)
+        start_server = websockets.serve(handler, IP, PORT, ssl=ssl_context)
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(start_server)
+    if args.METRICS_PORT != 0:
+        loop.run_until_complete(MX.serve(args.METRICS_IP, args.METRICS_PORT, collectMetrics))
+    asyncio.ensure_future(producer_handler())
+    
+    if platform.system() is not 'Windows':
+        for signame in ('SIGINT', 'SIGTERM'):
+            loop.add_signal_handler(getattr(signal, signame),functools.partial(ask_exit, signame))
+
+    print("Event loop running forever, press Ctrl+C to interrupt.")
+    print("pid %s: send SIGINT or SIGTERM to exit." % os.getpid())
+
+    # keeps the socket open forever
+    try:
+        loop.run_forever()
+    finally:
+        loop.close()
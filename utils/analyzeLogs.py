@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+
+#
+# Author: Andrew Peters
+#
+# Copyright 2019 United States Government as represented by the Administrator of the National Aeronautics
+# and Space Administration. All Rights Reserved.
+#  
+# Disclaimers
+# No Warranty: THE SUBJECT SOFTWARE IS PROVIDED "AS IS" WITHOUT ANY WARRANTY OF ANY
+# KIND, EITHER EXPRESSED, IMPLIED, OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, ANY
+# WARRANTY THAT THE SUBJECT SOFTWARE WILL CONFORM TO SPECIFICATIONS, ANY IMPLIED
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, OR FREEDOM FROM
+# INFRINGEMENT, ANY WARRANTY THAT THE SUBJECT SOFTWARE WILL BE ERROR FREE, OR ANY
+# WARRANTY THAT DOCUMENTATION, IF PROVIDED, WILL CONFORM TO THE SUBJECT SOFTWARE.
+# THIS AGREEMENT DOES NOT, IN ANY MANNER, CONSTITUTE AN ENDORSEMENT BY GOVERNMENT
+# AGENCY OR ANY PRIOR RECIPIENT OF ANY RESULTS, RESULTING DESIGNS, HARDWARE,
+# SOFTWARE PRODUCTS OR ANY OTHER APPLICATIONS RESULTING FROM USE OF THE SUBJECT
+# SOFTWARE.  FURTHER, GOVERNMENT AGENCY DISCLAIMS ALL WARRANTIES AND LIABILITIES
+# REGARDING THIRD-PARTY SOFTWARE, IF PRESENT IN THE ORIGINAL SOFTWARE, AND
+# DISTRIBUTES IT "AS IS."
+#  
+# Waiver and Indemnity:  RECIPIENT AGREES TO WAIVE ANY AND ALL CLAIMS AGAINST THE UNITED
+# STATES GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR
+# RECIPIENT.  IF RECIPIENT'S USE OF THE SUBJECT SOFTWARE RESULTS IN ANY LIABILITIES,
+# DEMANDS, DAMAGES, EXPENSES OR LOSSES ARISING FROM SUCH USE, INCLUDING ANY
+# DAMAGES FROM PRODUCTS BASED ON, OR RESULTING FROM, RECIPIENT'S USE OF THE SUBJECT
+# SOFTWARE, RECIPIENT SHALL INDEMNIFY AND HOLD HARMLESS THE UNITED STATES
+# GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR RECIPIENT,
+# TO THE EXTENT PERMITTED BY LAW.  RECIPIENT'S SOLE REMEDY FOR ANY SUCH MATTER SHALL
+# BE THE IMMEDIATE, UNILATERAL TERMINATION OF THIS AGREEMENT.
+#
+
+# Headless analysis of .tlog and .mlog files.
+# Reads each log once and writes a NumPy .npz with one array per field, per
+# aircraft and message type, plus a per second RADIO table built from the
+# packet sequence numbers and an EVENTS table (mission progress, mode
+# changes, status text, command acks). Logs are indexed with the same
+# LogIndex the LogPlayer uses, only the selected types are decoded.
+#
+# Array names in the .npz are ac{ac}/{TYPE}/{field}, every table has a t
+# column with seconds from the start of the log.
+#
+# python3 analyzeLogs.py ../SocketServer/LogFiles --outdir analysis --jobs 4
+#
+#   import numpy as np
+#   d = np.load('analysis/flight_log_ac_1.npz')
+#   lat = d['ac1/GLOBAL_POSITION_INT/lat'] * 1e-7
+
+import os
+import sys
+import time
+from operator import attrgetter
+from argparse import ArgumentParser
+from multiprocessing import Pool
+
+import numpy as np
+from pymavlink.dialects.v20 import ardupilotmega as mavlink
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'SocketServer'))
+
+import GsProcesses.logIndex as LI
+
+
+DEFAULT_TYPES = ['HEARTBEAT', 'SYS_STATUS', 'GPS_RAW_INT', 'ATTITUDE',
+                 'GLOBAL_POSITION_INT', 'VFR_HUD', 'BATTERY_STATUS',
+                 'MISSION_CURRENT', 'MISSION_ITEM_REACHED', 'STATUSTEXT',
+                 'COMMAND_ACK', 'ADSB_VEHICLE']
+EVENT_TYPES = ['HEARTBEAT', 'MISSION_CURRENT', 'MISSION_ITEM_REACHED',
+               'STATUSTEXT', 'COMMAND_ACK']
+
+NAME_TO_ID = {cls.msgname: msg_id for msg_id, cls in mavlink.mavlink_map.items()}
+
+
+def findLogs(paths):
+    logs = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith('.tlog') or name.endswith('.mlog'):
+                    logs.append(os.path.join(path, name))
+        else:
+            logs.append(path)
+    return logs
+
+
+class Table:
+    # columns for one (aircraft, type), lists while reading, arrays at the end
+    def __init__(self, fields):
+        self.fields = fields
+        self.getter = attrgetter(*fields) if len(fields) > 1 else \
+            (lambda m, n=fields[0]: (getattr(m, n),))
+        self.t = []
+        self.rows = []
+
+    def add(self, t, msg):
+        self.t.append(t)
+        self.rows.append(self.getter(msg))
+
+    def arrays(self):
+        out = {'t': np.array(self.t)}
+        columns = list(zip(*self.rows))
+        for name, column in zip(self.fields, columns):
+            try:
+                out[name] = np.array(column)
+            except ValueError:
+                # ragged values, keep them as objects
+                out[name] = np.array(column, dtype=object)
+        return out
+
+
+def radioTable(index, acs):
+    # per aircraft and second: packets received, packets lost by sequence
+    # number gaps per (sysid, compid), and the percent received
+    last = {}
+    bins = {}
+    for i in range(len(index)):
+        seq, sysid, compid = index.getLink(i)
+        ac = index.getAc(i)
+        if ac not in acs:
+            continue
+        second = int(index.getTime(i))
+        b = bins.setdefault(ac, {}).setdefault(second, [0, 0])
+        b[0] += 1
+        key = (ac, sysid, compid)
+        if key in last:
+            b[1] += (seq - last[key] - 1) % 256
+        last[key] = seq
+
+    tables = {}
+    for ac, seconds in bins.items():
+        t = np.array(sorted(seconds), dtype=float)
+        received = np.array([seconds[int(x)][0] for x in t])
+        lost = np.array([seconds[int(x)][1] for x in t])
+        percent = 100.0 * received / np.maximum(received + lost, 1)
+        tables[ac] = {'t': t, 'received': received, 'lost': lost, 'percent': percent}
+    return tables
+
+
+def eventTable(events):
+    return {'t': np.array([x[0] for x in events], dtype=float),
+            'type': np.array([x[1] for x in events]),
+            'value': np.array([x[2] for x in events], dtype=np.int64),
+            'text': np.array([x[3] for x in events])}
+
+
+def analyzeLog(path, outdir, types, compress=False):
+    start = time.time()
+    filetype = 'mlog' if path.endswith('.mlog') else 'tlog'
+    index = LI.LogIndex(path, filetype)
+    if types is None:
+        ids = None
+    else:
+        ids = set(NAME_TO_ID[x] for x in types if x in NAME_TO_ID)
+
+    tables = {}   # {(ac, TYPE): Table}
+    events = {}   # {ac: [[t, TYPE, value, text], ...]}
+    last = {}     # {(ac, TYPE): last value}, events are only changes
+    decoded = 0
+    for i in range(len(index)):
+        if ids is not None and index.getMsgId(i) not in ids:
+            continue
+        msg = index.decode(i)
+        if msg is None:
+            continue
+        decoded += 1
+        ac = index.getAc(i)
+        t = index.getTime(i)
+        name = msg.get_type()
+        table = tables.get((ac, name))
+        if table is None:
+            table = tables[(ac, name)] = Table(list(msg._fieldnames))
+        table.add(t, msg)
+
+        if name in EVENT_TYPES:
+            if name == 'HEARTBEAT':
+                value, text = msg.custom_mode, 'MODE'
+            elif name == 'MISSION_CURRENT' or name == 'MISSION_ITEM_REACHED':
+                value, text = msg.seq, ''
+            elif name == 'COMMAND_ACK':
+                value, text = msg.result, str(msg.command)
+            else:
+                value, text = msg.severity, msg.text
+            if name == 'STATUSTEXT' or last.get((ac, name)) != value:
+                events.setdefault(ac, []).append([t, name, value, text])
+            last[(ac, name)] = value
+
+    acs = set(index.acs)
+    out = {}
+    for (ac, name), table in tables.items():
+        for field, array in table.arrays().items():
+            out['ac{}/{}/{}'.format(ac, name, field)] = array
+    for ac, table in radioTable(index, acs).items():
+        for field, array in table.items():
+            out['ac{}/RADIO/{}'.format(ac, field)] = array
+    for ac, x in events.items():
+        for field, array in eventTable(x).items():
+            out['ac{}/EVENTS/{}'.format(ac, field)] = array
+
+    name = os.path.splitext(os.path.basename(path))[0] + '.npz'
+    outfile = os.path.join(outdir, name)
+    if compress:
+        np.savez_compressed(outfile, **out)
+    else:
+        np.savez(outfile, **out)
+
+    duration = index.getTime(len(index) - 1) if len(index) > 0 else 0
+    summary = [path, len(index), decoded, len(acs), duration, time.time() - start, outfile]
+    index.close()
+    return summary
+
+
+def analyzeJob(job):
+    return analyzeLog(*job)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Extract columnar arrays from .tlog and .mlog files")
+    parser.add_argument("logs", nargs='+', help="log files or directories of logs")
+    parser.add_argument("--outdir", default='analysis', help="directory for the .npz files")
+    parser.add_argument("--types", nargs='*', default=DEFAULT_TYPES,
+                        help="message types to extract, ALL for every type")
+    parser.add_argument("--jobs", default=1, type=int, help="number of processes")
+    parser.add_argument("--compress", action='store_true', help="write compressed .npz files")
+    args = parser.parse_args()
+
+    types = None if 'ALL' in args.types else args.types
+    os.makedirs(args.outdir, exist_ok=True)
+    jobs = [(x, args.outdir, types, args.compress) for x in findLogs(args.logs)]
+
+    start = time.time()
+    if args.jobs > 1:
+        with Pool(args.jobs) as pool:
+            results = pool.map(analyzeJob, jobs)
+    else:
+        results = [analyzeJob(x) for x in jobs]
+
+    print('{:>10} {:>10} {:>4} {:>10} {:>8}  {}'.format(
+        'messages', 'decoded', 'ac', 'log s', 'took s', 'output'))
+    for path, count, decoded, acs, duration, took, outfile in results:
+        print('{:>10} {:>10} {:>4} {:>10.1f} {:>8.2f}  {}'.format(
+            count, decoded, acs, duration, took, outfile))
+    print('{} logs in {:.2f}s'.format(len(results), time.time() - start))
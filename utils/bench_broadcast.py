@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+#
+# Author: Andrew Peters
+#
+# Copyright 2019 United States Government as represented by the Administrator of the National Aeronautics
+# and Space Administration. All Rights Reserved.
+#  
+# Disclaimers
+# No Warranty: THE SUBJECT SOFTWARE IS PROVIDED "AS IS" WITHOUT ANY WARRANTY OF ANY
+# KIND, EITHER EXPRESSED, IMPLIED, OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, ANY
+# WARRANTY THAT THE SUBJECT SOFTWARE WILL CONFORM TO SPECIFICATIONS, ANY IMPLIED
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, OR FREEDOM FROM
+# INFRINGEMENT, ANY WARRANTY THAT THE SUBJECT SOFTWARE WILL BE ERROR FREE, OR ANY
+# WARRANTY THAT DOCUMENTATION, IF PROVIDED, WILL CONFORM TO THE SUBJECT SOFTWARE.
+# THIS AGREEMENT DOES NOT, IN ANY MANNER, CONSTITUTE AN ENDORSEMENT BY GOVERNMENT
+# AGENCY OR ANY PRIOR RECIPIENT OF ANY RESULTS, RESULTING DESIGNS, HARDWARE,
+# SOFTWARE PRODUCTS OR ANY OTHER APPLICATIONS RESULTING FROM USE OF THE SUBJECT
+# SOFTWARE.  FURTHER, GOVERNMENT AGENCY DISCLAIMS ALL WARRANTIES AND LIABILITIES
+# REGARDING THIRD-PARTY SOFTWARE, IF PRESENT IN THE ORIGINAL SOFTWARE, AND
+# DISTRIBUTES IT "AS IS."
+#  
+# Waiver and Indemnity:  RECIPIENT AGREES TO WAIVE ANY AND ALL CLAIMS AGAINST THE UNITED
+# STATES GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR
+# RECIPIENT.  IF RECIPIENT'S USE OF THE SUBJECT SOFTWARE RESULTS IN ANY LIABILITIES,
+# DEMANDS, DAMAGES, EXPENSES OR LOSSES ARISING FROM SUCH USE, INCLUDING ANY
+# DAMAGES FROM PRODUCTS BASED ON, OR RESULTING FROM, RECIPIENT'S USE OF THE SUBJECT
+# SOFTWARE, RECIPIENT SHALL INDEMNIFY AND HOLD HARMLESS THE UNITED STATES
+# GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR RECIPIENT,
+# TO THE EXTENT PERMITTED BY LAW.  RECIPIENT'S SOLE REMEDY FOR ANY SUCH MATTER SHALL
+# BE THE IMMEDIATE, UNILATERAL TERMINATION OF THIS AGREEMENT.
+#
+
+# Benchmark for the websocket fan-out in multiprocess_server.
+# A producer process fills the multiprocessing queue the same way the aircraft
+# processes do, and fake websockets count what they receive. Compares the old
+# per-websocket polling loop with the single broadcast pump.
+#
+# python3 bench_broadcast.py --clients 1 5 20 --messages 20000
+
+import os
+import sys
+import time
+import asyncio
+from multiprocessing import Process, Queue
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'SocketServer'))
+
+import User.userManager as UM
+import User.broadcastPump as BP
+
+MSG = '{"AIRCRAFT" : 1, "TYPE" : "GLOBAL_POSITION_INT", "time_boot_ms":123456, "lat":371020000, ' \
+      '"lon":-763870000, "alt":10000, "relative_alt":5000, "vx":10, "vy":-5, "vz":0, "hdg":9000}'
+
+
+class FakeSocket:
+    def __init__(self):
+        self.count = 0
+
+    async def send(self, msg):
+        self.count += 1
+
+
+def produce(q, n, rate):
+    for i in range(n):
+        q.put(MSG)
+        if rate > 0:
+            time.sleep(1/rate)
+
+
+async def polling(q, um):
+    # the old producer_handler, one of these ran for every websocket
+    while True:
+        if not q.empty():
+            x = q.get(block=False)
+            await um.notifyUsers(str(x))
+        await asyncio.sleep(.001)
+
+
+async def wait_for(sockets, n, timeout):
+    t = time.time()
+    while min(s.count for s in sockets) < n:
+        if time.time() - t > timeout:
+            break
+        await asyncio.sleep(.005)
+
+
+async def run_case(mode, clients, n, rate, idle):
+    q = Queue()
+    # buffers large enough that nothing is dropped, every message is counted
+    um = UM.UserManager(n + 1, 'drop_oldest')
+    sockets = [FakeSocket() for i in range(clients)]
+    for s in sockets:
+        await um.register(s)
+
+    if mode == 'polling':
+        tasks = [asyncio.ensure_future(polling(q, um)) for s in sockets]
+        pump = None
+    else:
+        pump = BP.BroadcastPump(lambda: q)
+        tasks = [asyncio.ensure_future(pump.run(um.notifyUsers))]
+
+    # idle cost, nothing in the queue
+    await asyncio.sleep(.2)
+    c0 = time.process_time()
+    await asyncio.sleep(idle)
+    idle_cpu = (time.process_time() - c0) / idle * 100
+
+    p = Process(target=produce, args=(q, n, rate))
+    t0 = time.time()
+    c0 = time.process_time()
+    p.start()
+    await wait_for(sockets, n, 60 + (n / rate if rate > 0 else 0))
+    wall = time.time() - t0
+    cpu = time.process_time() - c0
+    p.join()
+
+    for t in tasks:
+        t.cancel()
+    if pump is not None:
+        pump.stop()
+    for s in sockets:
+        await um.unregister(s)
+    delivered = sum(s.count for s in sockets)
+    return [mode, clients, n / wall, delivered / wall, cpu / wall * 100, idle_cpu]
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", nargs='*', default=[1, 5, 20], type=int, help="number of websockets")
+    parser.add_argument("--messages", default=20000, type=int, help="messages per case")
+    parser.add_argument("--rate", default=0, type=float, help="producer rate msg/s, 0 for as fast as possible")
+    parser.add_argument("--idle", default=2, type=float, help="seconds to measure idle cpu")
+    parser.add_argument("--mode", nargs='*', default=['polling', 'pump'], help="polling, pump")
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    print('{:>8} {:>7} {:>12} {:>14} {:>8} {:>9}'.format(
+        'mode', 'clients', 'msg/s', 'deliveries/s', 'cpu %', 'idle cpu %'))
+    for c in args.clients:
+        for mode in args.mode:
+            r = loop.run_until_complete(run_case(mode, c, args.messages, args.rate, args.idle))
+            print('{:>8} {:>7} {:>12.0f} {:>14.0f} {:>8.1f} {:>9.1f}'.format(*r))
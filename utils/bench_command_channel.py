@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+#
+# Author: Andrew Peters
+#
+# Copyright 2019 United States Government as represented by the Administrator of the National Aeronautics
+# and Space Administration. All Rights Reserved.
+#  
+# Disclaimers
+# No Warranty: THE SUBJECT SOFTWARE IS PROVIDED "AS IS" WITHOUT ANY WARRANTY OF ANY
+# KIND, EITHER EXPRESSED, IMPLIED, OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, ANY
+# WARRANTY THAT THE SUBJECT SOFTWARE WILL CONFORM TO SPECIFICATIONS, ANY IMPLIED
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, OR FREEDOM FROM
+# INFRINGEMENT, ANY WARRANTY THAT THE SUBJECT SOFTWARE WILL BE ERROR FREE, OR ANY
+# WARRANTY THAT DOCUMENTATION, IF PROVIDED, WILL CONFORM TO THE SUBJECT SOFTWARE.
+# THIS AGREEMENT DOES NOT, IN ANY MANNER, CONSTITUTE AN ENDORSEMENT BY GOVERNMENT
+# AGENCY OR ANY PRIOR RECIPIENT OF ANY RESULTS, RESULTING DESIGNS, HARDWARE,
+# SOFTWARE PRODUCTS OR ANY OTHER APPLICATIONS RESULTING FROM USE OF THE SUBJECT
+# SOFTWARE.  FURTHER, GOVERNMENT AGENCY DISCLAIMS ALL WARRANTIES AND LIABILITIES
+# REGARDING THIRD-PARTY SOFTWARE, IF PRESENT IN THE ORIGINAL SOFTWARE, AND
+# DISTRIBUTES IT "AS IS."
+#  
+# Waiver and Indemnity:  RECIPIENT AGREES TO WAIVE ANY AND ALL CLAIMS AGAINST THE UNITED
+# STATES GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR
+# RECIPIENT.  IF RECIPIENT'S USE OF THE SUBJECT SOFTWARE RESULTS IN ANY LIABILITIES,
+# DEMANDS, DAMAGES, EXPENSES OR LOSSES ARISING FROM SUCH USE, INCLUDING ANY
+# DAMAGES FROM PRODUCTS BASED ON, OR RESULTING FROM, RECIPIENT'S USE OF THE SUBJECT
+# SOFTWARE, RECIPIENT SHALL INDEMNIFY AND HOLD HARMLESS THE UNITED STATES
+# GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR RECIPIENT,
+# TO THE EXTENT PERMITTED BY LAW.  RECIPIENT'S SOLE REMEDY FOR ANY SUCH MATTER SHALL
+# BE THE IMMEDIATE, UNILATERAL TERMINATION OF THIS AGREEMENT.
+#
+
+# Microbenchmark for the command path from the socket server to an aircraft
+# process. Compares the old Manager().list proxy with the CommandChannel pipe.
+# The child loop checks for a command on every iteration the same way
+# icProcesses.data does and echoes each command back.
+#
+# python3 bench_command_channel.py --count 2000
+
+import os
+import sys
+import time
+from multiprocessing import Process, Manager, Pipe
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'SocketServer'))
+
+import GsProcesses.commandChannel as CC
+
+COMMAND = ['AIRCRAFT', '1', 'CHANGE_PARAM', 'DET_1_WCV_DTHR', '1000.0', '9']
+
+
+def manager_child(m, r, count):
+    done = 0
+    while done < count:
+        if len(m) > 0:
+            x = m[0]
+            m.pop(0)
+            r.append(x)
+            done += 1
+
+
+def channel_child(m, reply, count):
+    done = 0
+    while done < count:
+        if m.poll():
+            reply.send(m.recv())
+            done += 1
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def run_manager(count):
+    with Manager() as manager:
+        m = manager.list()
+        r = manager.list()
+        p = Process(target=manager_child, args=(m, r, count))
+        p.start()
+        times = []
+        for i in range(count):
+            t = time.perf_counter()
+            m.append(COMMAND)
+            while len(r) == 0:
+                pass
+            r.pop(0)
+            times.append(time.perf_counter() - t)
+        p.join()
+
+        # cost of the check the aircraft loop makes on every iteration
+        t = time.perf_counter()
+        for i in range(count):
+            len(m)
+        check = (time.perf_counter() - t) / count
+    return times, check
+
+
+def run_channel(count):
+    m = CC.CommandChannel()
+    reply_in, reply_out = Pipe(duplex=False)
+    p = Process(target=channel_child, args=(m, reply_out, count))
+    p.start()
+    times = []
+    for i in range(count):
+        t = time.perf_counter()
+        m.send(COMMAND)
+        reply_in.recv()
+        times.append(time.perf_counter() - t)
+    p.join()
+
+    t = time.perf_counter()
+    for i in range(count):
+        m.poll()
+    check = (time.perf_counter() - t) / count
+    return times, check
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--count", default=2000, type=int, help="number of commands")
+    args = parser.parse_args()
+
+    print('{:>14} {:>10} {:>10} {:>10} {:>12}'.format(
+        'transport', 'p50 us', 'p99 us', 'max us', 'check us'))
+    for name, run in [['Manager.list', run_manager], ['CommandChannel', run_channel]]:
+        times, check = run(args.count)
+        print('{:>14} {:>10.1f} {:>10.1f} {:>10.1f} {:>12.2f}'.format(
+            name, percentile(times, 50) * 1e6, percentile(times, 99) * 1e6,
+            max(times) * 1e6, check * 1e6))
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+#
+# Author: Andrew Peters
+#
+# Copyright 2019 United States Government as represented by the Administrator of the National Aeronautics
+# and Space Administration. All Rights Reserved.
+#  
+# Disclaimers
+# No Warranty: THE SUBJECT SOFTWARE IS PROVIDED "AS IS" WITHOUT ANY WARRANTY OF ANY
+# KIND, EITHER EXPRESSED, IMPLIED, OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, ANY
+# WARRANTY THAT THE SUBJECT SOFTWARE WILL CONFORM TO SPECIFICATIONS, ANY IMPLIED
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, OR FREEDOM FROM
+# INFRINGEMENT, ANY WARRANTY THAT THE SUBJECT SOFTWARE WILL BE ERROR FREE, OR ANY
+# WARRANTY THAT DOCUMENTATION, IF PROVIDED, WILL CONFORM TO THE SUBJECT SOFTWARE.
+# THIS AGREEMENT DOES NOT, IN ANY MANNER, CONSTITUTE AN ENDORSEMENT BY GOVERNMENT
+# AGENCY OR ANY PRIOR RECIPIENT OF ANY RESULTS, RESULTING DESIGNS, HARDWARE,
+# SOFTWARE PRODUCTS OR ANY OTHER APPLICATIONS RESULTING FROM USE OF THE SUBJECT
+# SOFTWARE.  FURTHER, GOVERNMENT AGENCY DISCLAIMS ALL WARRANTIES AND LIABILITIES
+# REGARDING THIRD-PARTY SOFTWARE, IF PRESENT IN THE ORIGINAL SOFTWARE, AND
+# DISTRIBUTES IT "AS IS."
+#  
+# Waiver and Indemnity:  RECIPIENT AGREES TO WAIVE ANY AND ALL CLAIMS AGAINST THE UNITED
+# STATES GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR
+# RECIPIENT.  IF RECIPIENT'S USE OF THE SUBJECT SOFTWARE RESULTS IN ANY LIABILITIES,
+# DEMANDS, DAMAGES, EXPENSES OR LOSSES ARISING FROM SUCH USE, INCLUDING ANY
+# DAMAGES FROM PRODUCTS BASED ON, OR RESULTING FROM, RECIPIENT'S USE OF THE SUBJECT
+# SOFTWARE, RECIPIENT SHALL INDEMNIFY AND HOLD HARMLESS THE UNITED STATES
+# GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR RECIPIENT,
+# TO THE EXTENT PERMITTED BY LAW.  RECIPIENT'S SOLE REMEDY FOR ANY SUCH MATTER SHALL
+# BE THE IMMEDIATE, UNILATERAL TERMINATION OF THIS AGREEMENT.
+#
+
+# Benchmark for the outbound telemetry encoding done in each aircraft process.
+# Compares the old string building in update_position with the JsonEncoder,
+# and the server side msgpack transcoding when msgpack is installed.
+#
+# python3 bench_encoder.py --count 200000
+
+import os
+import sys
+import time
+from argparse import ArgumentParser
+from pymavlink import mavutil
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'SocketServer'))
+
+import GsProcesses.telemetryEncoder as TE
+
+
+def sample_messages():
+    mavutil.set_dialect('ardupilotmega')
+    mav = mavutil.mavlink.MAVLink(None)
+    msgs = [
+        mav.global_position_int_encode(123456, 371020000, -763870000, 10000, 5000, 10, -5, 0, 9000),
+        mav.attitude_encode(123456, 0.01, -0.02, 1.57, 0.001, 0.002, 0.003),
+        mav.heartbeat_encode(2, 3, 89, 4, 4, 3),
+        mav.vfr_hud_encode(5.0, 5.0, 90, 50, 10.0, 0.0),
+        mav.param_value_encode(b'DET_1_WCV_DTHR', 1000.0, 9, 600, 12),
+        mav.statustext_encode(6, b'IC:Starting Mission'),
+        mav.battery_status_encode(0, 0, 3, 2000, [12580] + [65535] * 9, -1, -1, -1, 60),
+        mav.adsb_vehicle_encode(1234, 371020000, -763870000, 0, 10000, 9000, 500, 0, b'N123', 255, 1, 0, 0),
+    ]
+    # decode them so they look like what recvAndLog returns
+    return [mav.decode(bytearray(m.pack(mav))) for m in msgs]
+
+
+def legacy(ac, msg):
+    # update_position before the encoder, without the in place quoting
+    m = ''
+    for item in msg._fieldnames:
+        x = msg.format_attr(item)
+        if isinstance(x, str):
+            x = '"' + x + '"'
+        m = m + ', "{}":{}'.format(item, x)
+    return '{"AIRCRAFT" : ' + str(ac) + ', "TYPE" : "' + msg.get_type() + '"' + m + '}'
+
+
+def run(name, f, msgs, count):
+    n = len(msgs)
+    t = time.perf_counter()
+    for i in range(count):
+        f(msgs[i % n])
+    dt = time.perf_counter() - t
+    print('{:>16} {:>12.0f}'.format(name, count / dt))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--count", default=200000, type=int, help="messages per case")
+    args = parser.parse_args()
+
+    msgs = sample_messages()
+    encoder = TE.JsonEncoder()
+
+    print('{:>16} {:>12}'.format('encoder', 'msg/s'))
+    run('legacy string', lambda m: legacy(1, m), msgs, args.count)
+    run('JsonEncoder', lambda m: encoder.encode(1, m), msgs, args.count)
+    if TE.hasEncoding('MSGPACK'):
+        encoded = [encoder.encode(1, m) for m in msgs]
+        run('msgpack (server)', lambda m: TE.transcode(m, 'MSGPACK'), encoded, args.count)
+    else:
+        print('msgpack not installed, skipping transcoding')
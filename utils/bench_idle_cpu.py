@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+#
+# Author: Andrew Peters
+#
+# Copyright 2019 United States Government as represented by the Administrator of the National Aeronautics
+# and Space Administration. All Rights Reserved.
+#  
+# Disclaimers
+# No Warranty: THE SUBJECT SOFTWARE IS PROVIDED "AS IS" WITHOUT ANY WARRANTY OF ANY
+# KIND, EITHER EXPRESSED, IMPLIED, OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, ANY
+# WARRANTY THAT THE SUBJECT SOFTWARE WILL CONFORM TO SPECIFICATIONS, ANY IMPLIED
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, OR FREEDOM FROM
+# INFRINGEMENT, ANY WARRANTY THAT THE SUBJECT SOFTWARE WILL BE ERROR FREE, OR ANY
+# WARRANTY THAT DOCUMENTATION, IF PROVIDED, WILL CONFORM TO THE SUBJECT SOFTWARE.
+# THIS AGREEMENT DOES NOT, IN ANY MANNER, CONSTITUTE AN ENDORSEMENT BY GOVERNMENT
+# AGENCY OR ANY PRIOR RECIPIENT OF ANY RESULTS, RESULTING DESIGNS, HARDWARE,
+# SOFTWARE PRODUCTS OR ANY OTHER APPLICATIONS RESULTING FROM USE OF THE SUBJECT
+# SOFTWARE.  FURTHER, GOVERNMENT AGENCY DISCLAIMS ALL WARRANTIES AND LIABILITIES
+# REGARDING THIRD-PARTY SOFTWARE, IF PRESENT IN THE ORIGINAL SOFTWARE, AND
+# DISTRIBUTES IT "AS IS."
+#  
+# Waiver and Indemnity:  RECIPIENT AGREES TO WAIVE ANY AND ALL CLAIMS AGAINST THE UNITED
+# STATES GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR
+# RECIPIENT.  IF RECIPIENT'S USE OF THE SUBJECT SOFTWARE RESULTS IN ANY LIABILITIES,
+# DEMANDS, DAMAGES, EXPENSES OR LOSSES ARISING FROM SUCH USE, INCLUDING ANY
+# DAMAGES FROM PRODUCTS BASED ON, OR RESULTING FROM, RECIPIENT'S USE OF THE SUBJECT
+# SOFTWARE, RECIPIENT SHALL INDEMNIFY AND HOLD HARMLESS THE UNITED STATES
+# GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR RECIPIENT,
+# TO THE EXTENT PERMITTED BY LAW.  RECIPIENT'S SOLE REMEDY FOR ANY SUCH MATTER SHALL
+# BE THE IMMEDIATE, UNILATERAL TERMINATION OF THIS AGREEMENT.
+#
+
+# Idle cpu use of the aircraft processes.
+# Starts --aircraft processes running icProcesses.data connected over HITL to
+# local udp ports, sends each one a heartbeat so it is past CONNECTING, then
+# leaves the links idle and measures the cpu time used per process.
+# Log files are written to a temporary directory.
+#
+# python3 bench_idle_cpu.py --aircraft 4 --idle 10
+
+import os
+import sys
+import time
+import queue
+import socket
+import tempfile
+import psutil
+from multiprocessing import Process, Queue
+from argparse import ArgumentParser
+from pymavlink import mavutil
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'SocketServer'))
+
+import GsProcesses.icProcesses as IC
+import GsProcesses.commandChannel as CC
+
+
+def drain(q, seconds):
+    end = time.time() + seconds
+    count = 0
+    while time.time() < end:
+        try:
+            q.get(timeout=.1)
+            count += 1
+        except queue.Empty:
+            pass
+    return count
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--aircraft", default=4, type=int, help="number of aircraft processes")
+    parser.add_argument("--idle", default=10, type=float, help="seconds to measure")
+    parser.add_argument("--port", default=14700, type=int, help="first udp port")
+    args = parser.parse_args()
+
+    mavutil.set_dialect('ardupilotmega')
+    mav = mavutil.mavlink.MAVLink(None, srcSystem=1, srcComponent=1)
+    heartbeat = mav.heartbeat_encode(2, 3, 89, 4, 4, 3).pack(mav)
+
+    workdir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(workdir, 'LogFiles'))
+    os.chdir(workdir)
+
+    q = Queue()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    procs = []
+    for i in range(args.aircraft):
+        port = args.port + i
+        command = ['AIRCRAFT', 'None', 'HITL', str(i), 'BAUD', '57600',
+                   'IP', '127.0.0.1', 'PORT', str(port), 'COMP', 'Default']
+        m = CC.CommandChannel(command)
+        p = Process(target=IC.data, args=(q, m), daemon=True)
+        p.start()
+        procs.append([p, m, port])
+
+    # let them connect and see a heartbeat
+    drain(q, 1)
+    for p, m, port in procs:
+        sock.sendto(heartbeat, ('127.0.0.1', port))
+    drain(q, 1)
+
+    ps = [psutil.Process(p.pid) for p, m, port in procs]
+    before = [x.cpu_times() for x in ps]
+    t = time.time()
+    messages = drain(q, args.idle)
+    dt = time.time() - t
+    after = [x.cpu_times() for x in ps]
+
+    print('{:>8} {:>10}'.format('aircraft', 'cpu %'))
+    for i in range(len(ps)):
+        used = (after[i].user + after[i].system) - (before[i].user + before[i].system)
+        print('{:>8} {:>10.1f}'.format(i, used / dt * 100))
+    print('queue messages/sec while idle: {:.1f}'.format(messages / dt))
+
+    for p, m, port in procs:
+        p.terminate()
+        p.join()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+#
+# Author: Andrew Peters
+#
+# Copyright 2019 United States Government as represented by the Administrator of the National Aeronautics
+# and Space Administration. All Rights Reserved.
+#  
+# Disclaimers
+# No Warranty: THE SUBJECT SOFTWARE IS PROVIDED "AS IS" WITHOUT ANY WARRANTY OF ANY
+# KIND, EITHER EXPRESSED, IMPLIED, OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, ANY
+# WARRANTY THAT THE SUBJECT SOFTWARE WILL CONFORM TO SPECIFICATIONS, ANY IMPLIED
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, OR FREEDOM FROM
+# INFRINGEMENT, ANY WARRANTY THAT THE SUBJECT SOFTWARE WILL BE ERROR FREE, OR ANY
+# WARRANTY THAT DOCUMENTATION, IF PROVIDED, WILL CONFORM TO THE SUBJECT SOFTWARE.
+# THIS AGREEMENT DOES NOT, IN ANY MANNER, CONSTITUTE AN ENDORSEMENT BY GOVERNMENT
+# AGENCY OR ANY PRIOR RECIPIENT OF ANY RESULTS, RESULTING DESIGNS, HARDWARE,
+# SOFTWARE PRODUCTS OR ANY OTHER APPLICATIONS RESULTING FROM USE OF THE SUBJECT
+# SOFTWARE.  FURTHER, GOVERNMENT AGENCY DISCLAIMS ALL WARRANTIES AND LIABILITIES
+# REGARDING THIRD-PARTY SOFTWARE, IF PRESENT IN THE ORIGINAL SOFTWARE, AND
+# DISTRIBUTES IT "AS IS."
+#  
+# Waiver and Indemnity:  RECIPIENT AGREES TO WAIVE ANY AND ALL CLAIMS AGAINST THE UNITED
+# STATES GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR
+# RECIPIENT.  IF RECIPIENT'S USE OF THE SUBJECT SOFTWARE RESULTS IN ANY LIABILITIES,
+# DEMANDS, DAMAGES, EXPENSES OR LOSSES ARISING FROM SUCH USE, INCLUDING ANY
+# DAMAGES FROM PRODUCTS BASED ON, OR RESULTING FROM, RECIPIENT'S USE OF THE SUBJECT
+# SOFTWARE, RECIPIENT SHALL INDEMNIFY AND HOLD HARMLESS THE UNITED STATES
+# GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR RECIPIENT,
+# TO THE EXTENT PERMITTED BY LAW.  RECIPIENT'S SOLE REMEDY FOR ANY SUCH MATTER SHALL
+# BE THE IMMEDIATE, UNILATERAL TERMINATION OF THIS AGREEMENT.
+#
+
+# Telemetry latency from the aircraft link to the websockets under load.
+# Each of --aircraft processes sends itself mavlink over udp at --rate and
+# runs it through recvAndLog, the aircraft process dispatcher and the rate
+# limits into the server queue. The server side is the broadcast pump, the
+# server's routeMessage and UserManager with --clients fake websockets,
+# --echo makes them answer ECHO messages like the browser does. Prints p50,
+# p99 and max per hop, see metrics.Trace, and the total for each aircraft.
+#
+# python3 bench_latency.py --aircraft 1 4 --clients 1 10 --rate 50
+
+import os
+import sys
+import time
+import select
+import socket
+import asyncio
+from multiprocessing import Process, Queue
+from argparse import ArgumentParser
+from pymavlink import mavutil
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'SocketServer'))
+
+import GsProcesses.icProcesses as ICP
+import GsProcesses.mavlinkCommands as MF
+import GsProcesses.decimator as DM
+import GsProcesses.metrics as MX
+import User.userManager as UM
+import User.broadcastPump as BP
+import multiprocess_server as MS
+
+
+class FakeSocket:
+    def __init__(self, i, um, echo):
+        self.remote_address = ('client', i)
+        self.um = um
+        self.echo = echo
+        self.count = 0
+
+    async def send(self, msg):
+        self.count += 1
+        if self.echo and msg.startswith('{"name":"ECHO"'):
+            # answered as soon as it is read, like comms.js
+            echo_id = msg.split(':')[-1].strip(' }')
+            asyncio.get_event_loop().call_soon(self.um.echoed, self, echo_id)
+
+
+def aircraft(q, ac, port, rate, seconds, rates):
+    ICP.ac = ac
+    ICP.decimator = DM.Decimator(DM.parseRates(rates))
+    master = mavutil.mavlink_connection('udpin:127.0.0.1:{}'.format(port))
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    mav = mavutil.mavlink.MAVLink(None, srcSystem=ac, srcComponent=1)
+    mlog = open(os.devnull, 'wb')
+    start = time.time()
+    end = start + seconds
+    next_send = start
+    n = 0
+    while time.time() < end:
+        now = time.time()
+        if now >= next_send:
+            t = int((now - start) * 1000)
+            if n % 2 == 0:
+                m = mav.global_position_int_encode(t, 371020000 + n, -763870000, 10000, 5000, 10, -5, 0, 9000)
+            else:
+                m = mav.attitude_encode(t, 0.01, -0.02, 1.57, 0.001, 0.002, 0.003)
+            sock.sendto(m.pack(mav), ('127.0.0.1', port))
+            n += 1
+            next_send += 1 / rate
+        for x in ICP.decimator.due():
+            ICP.putMsg(q, *x)
+        for msg in MF.recvAndLog(master, mlog, None)[0]:
+            if msg is not None:
+                ICP.dispatcher.dispatch(msg, q, master, mlog, None)
+        timeout = next_send - time.time()
+        wake = ICP.decimator.timeout()
+        if wake is not None:
+            timeout = min(timeout, wake)
+        select.select([master.fd], [], [], max(0, timeout))
+    master.close()
+
+
+async def run_case(n_aircraft, n_clients, args):
+    MX.registry.clear()
+    q = Queue()
+    um = UM.UserManager(10000, 'drop_oldest')
+    sockets = [FakeSocket(i, um, args.echo) for i in range(n_clients)]
+    for s in sockets:
+        await um.register(s)
+        if args.echo:
+            um.setEcho(s, True)
+    # the server's own callback, so the bench runs what production runs
+    MS.um = um
+    pump = BP.BroadcastPump(lambda: q)
+    task = asyncio.ensure_future(pump.run(MS.routeMessage))
+
+    procs = [Process(target=aircraft, args=(q, ac, args.port + ac, args.rate, args.seconds, args.rates))
+             for ac in range(1, n_aircraft + 1)]
+    for p in procs:
+        p.start()
+    while any(p.is_alive() for p in procs):
+        await asyncio.sleep(.1)
+    await asyncio.sleep(.5)
+
+    task.cancel()
+    pump.stop()
+    for s in sockets:
+        await um.unregister(s)
+
+    hops = {}
+    totals = []
+    for (name, labels), h in MX.registry.histograms.items():
+        if name != 'latency_seconds':
+            continue
+        labels = dict(labels)
+        hops.setdefault(labels['hop'], MX.Histogram()).merge(h)
+        if labels['hop'] == 'total':
+            totals.append((labels['aircraft'], h))
+
+    rows = []
+    for hop in ['aircraft', 'queue', 'server', 'send', 'total', 'client', 'echo']:
+        if hop in hops:
+            rows.append(['all', hop, hops[hop]])
+    for ac, h in sorted(totals):
+        rows.append([ac, 'total', h])
+    for ac, hop, h in rows:
+        print('{:>8} {:>7} {:>8} {:>8} {:>8} {:>9.3f} {:>9.3f} {:>9.3f}'.format(
+            n_aircraft, n_clients, ac, hop, h.count,
+            h.quantile(.5) * 1000, h.quantile(.99) * 1000, h.max * 1000))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Telemetry latency, aircraft link to websockets")
+    parser.add_argument("--aircraft", nargs='+', default=[1, 4], type=int, help="aircraft processes")
+    parser.add_argument("--clients", nargs='+', default=[1, 10], type=int, help="fake websockets")
+    parser.add_argument("--rate", default=50, type=float, help="messages/s sent by each aircraft")
+    parser.add_argument("--seconds", default=5, type=float, help="length of each case")
+    parser.add_argument("--rates", default='', help="WEBGS_RATES for the aircraft processes, none by default")
+    parser.add_argument("--echo", action='store_true', help="clients answer ECHO messages")
+    parser.add_argument("--port", default=14900, type=int, help="first udp port")
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    print('{:>8} {:>7} {:>8} {:>8} {:>8} {:>9} {:>9} {:>9}'.format(
+        'aircraft', 'clients', 'ac', 'hop', 'count', 'p50 ms', 'p99 ms', 'max ms'))
+    for a in args.aircraft:
+        for c in args.clients:
+            loop.run_until_complete(run_case(a, c, args))
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+
+#
+# Author: Andrew Peters
+#
+# Copyright 2019 United States Government as represented by the Administrator of the National Aeronautics
+# and Space Administration. All Rights Reserved.
+#  
+# Disclaimers
+# No Warranty: THE SUBJECT SOFTWARE IS PROVIDED "AS IS" WITHOUT ANY WARRANTY OF ANY
+# KIND, EITHER EXPRESSED, IMPLIED, OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, ANY
+# WARRANTY THAT THE SUBJECT SOFTWARE WILL CONFORM TO SPECIFICATIONS, ANY IMPLIED
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, OR FREEDOM FROM
+# INFRINGEMENT, ANY WARRANTY THAT THE SUBJECT SOFTWARE WILL BE ERROR FREE, OR ANY
+# WARRANTY THAT DOCUMENTATION, IF PROVIDED, WILL CONFORM TO THE SUBJECT SOFTWARE.
+# THIS AGREEMENT DOES NOT, IN ANY MANNER, CONSTITUTE AN ENDORSEMENT BY GOVERNMENT
+# AGENCY OR ANY PRIOR RECIPIENT OF ANY RESULTS, RESULTING DESIGNS, HARDWARE,
+# SOFTWARE PRODUCTS OR ANY OTHER APPLICATIONS RESULTING FROM USE OF THE SUBJECT
+# SOFTWARE.  FURTHER, GOVERNMENT AGENCY DISCLAIMS ALL WARRANTIES AND LIABILITIES
+# REGARDING THIRD-PARTY SOFTWARE, IF PRESENT IN THE ORIGINAL SOFTWARE, AND
+# DISTRIBUTES IT "AS IS."
+#  
+# Waiver and Indemnity:  RECIPIENT AGREES TO WAIVE ANY AND ALL CLAIMS AGAINST THE UNITED
+# STATES GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR
+# RECIPIENT.  IF RECIPIENT'S USE OF THE SUBJECT SOFTWARE RESULTS IN ANY LIABILITIES,
+# DEMANDS, DAMAGES, EXPENSES OR LOSSES ARISING FROM SUCH USE, INCLUDING ANY
+# DAMAGES FROM PRODUCTS BASED ON, OR RESULTING FROM, RECIPIENT'S USE OF THE SUBJECT
+# SOFTWARE, RECIPIENT SHALL INDEMNIFY AND HOLD HARMLESS THE UNITED STATES
+# GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR RECIPIENT,
+# TO THE EXTENT PERMITTED BY LAW.  RECIPIENT'S SOLE REMEDY FOR ANY SUCH MATTER SHALL
+# BE THE IMMEDIATE, UNILATERAL TERMINATION OF THIS AGREEMENT.
+#
+
+# Mission upload and download time over a simulated lossy radio link.
+# A simulated aircraft answers the mission protocol over udp. Both
+# directions drop --loss of the packets, and are limited to --baud with
+# --latency ms of delay. The old one request at a time transfer with a 2 s
+# wait is compared with missionProtocol, with one and with WINDOW item
+# requests in flight on download.
+#
+# python3 bench_mission.py --items 50 --loss 0 .01 .05 .1 --trials 3
+
+import os
+import sys
+import time
+import heapq
+import random
+import socket
+import threading
+from argparse import ArgumentParser
+
+# the mission messages carry mission_type, a mavlink 2 field
+os.environ['MAVLINK20'] = '1'
+from pymavlink import mavutil
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'SocketServer'))
+
+import GsProcesses.mavlinkCommands as MF
+import GsProcesses.missionProtocol as MP
+
+VEHICLE_TIMEOUT = 1  # the aircraft asks again for an item after this long
+
+
+class LossyLink:
+    # delivers packets after latency plus the time to send them at baud,
+    # one direction per instance, drops loss of them
+    def __init__(self, sock, baud, latency, loss):
+        self.sock = sock
+        self.baud = baud
+        self.latency = latency
+        self.loss = loss
+        self.busy = 0
+        self.heap = []
+        self.n = 0
+        self.cond = threading.Condition()
+        self.running = True
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def send(self, data, addr):
+        if random.random() < self.loss:
+            return
+        with self.cond:
+            now = time.time()
+            self.busy = max(self.busy, now) + len(data) * 10.0 / self.baud
+            self.n += 1
+            heapq.heappush(self.heap, (self.busy + self.latency, self.n, data, addr))
+            self.cond.notify()
+
+    def run(self):
+        while self.running:
+            with self.cond:
+                if len(self.heap) == 0:
+                    self.cond.wait(.1)
+                    continue
+                due, n, data, addr = self.heap[0]
+                wait = due - time.time()
+                if wait > 0:
+                    self.cond.wait(wait)
+                    continue
+                heapq.heappop(self.heap)
+            try:
+                self.sock.sendto(data, addr)
+            except OSError:
+                pass
+
+
+class Vehicle:
+    # the aircraft side of the mission protocol as the mavlink docs
+    # describe it: it drives uploads, asks again when an item does not
+    # arrive or when the last item is repeated, and acks a repeated final item
+    def __init__(self, gcs_addr, baud, latency, loss):
+        mavutil.set_dialect('ardupilotmega')
+        self.mav = mavutil.mavlink.MAVLink(None, srcSystem=1, srcComponent=1)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.settimeout(.05)
+        self.gcs_addr = gcs_addr
+        self.uplink = LossyLink(self.sock, baud, latency, loss)  # gcs -> aircraft
+        self.downlink = LossyLink(self.sock, baud, latency, loss)
+        self.mission = []
+        self.upload = None   # [count, next seq, items, last request time]
+        self.running = True
+        self.pending = []
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def send(self, msg):
+        self.downlink.send(msg.pack(self.mav), self.gcs_addr)
+
+    def run(self):
+        parser = mavutil.mavlink.MAVLink(None)
+        parser.robust_parsing = True
+        last_hb = 0
+        while self.running:
+            now = time.time()
+            if now - last_hb > 1:
+                # heartbeat straight out, the gcs needs it to know where to send
+                self.sock.sendto(self.mav.heartbeat_encode(2, 3, 89, 4, 4, 3).pack(self.mav), self.gcs_addr)
+                last_hb = now
+            if self.upload is not None and now - self.upload[3] > VEHICLE_TIMEOUT:
+                self.requestNext()
+            try:
+                data, addr = self.sock.recvfrom(65535)
+            except socket.timeout:
+                continue
+            if random.random() < self.uplink.loss:
+                continue
+            # receive side delay, same model as the other direction
+            time.sleep(len(data) * 10.0 / self.uplink.baud)
+            for msg in parser.parse_buffer(data) or []:
+                self.handle(msg)
+
+    def requestNext(self):
+        self.upload[3] = time.time()
+        self.send(self.mav.mission_request_encode(255, 0, self.upload[1], 0))
+
+    def handle(self, msg):
+        name = msg.get_type()
+        if name == 'MISSION_COUNT':
+            self.upload = [msg.count, 0, [None] * msg.count, 0]
+            self.requestNext()
+        elif name in ('MISSION_ITEM', 'MISSION_ITEM_INT'):
+            if self.upload is None:
+                # the gcs missed the ack and sent the last item again
+                if len(self.mission) > 0 and msg.seq == len(self.mission) - 1:
+                    self.send(self.mav.mission_ack_encode(255, 0, 0, 0))
+            elif msg.seq == self.upload[1] - 1:
+                # the gcs missed the request and sent the last item again
+                self.requestNext()
+            elif msg.seq == self.upload[1]:
+                self.upload[2][msg.seq] = msg
+                self.upload[1] += 1
+                if self.upload[1] == self.upload[0]:
+                    self.mission = self.upload[2]
+                    self.upload = None
+                    self.send(self.mav.mission_ack_encode(255, 0, 0, 0))
+                else:
+                    self.requestNext()
+        elif name == 'MISSION_REQUEST_LIST':
+            self.send(self.mav.mission_count_encode(255, 0, len(self.mission), 0))
+        elif name in ('MISSION_REQUEST', 'MISSION_REQUEST_INT'):
+            if msg.seq < len(self.mission):
+                m = self.mission[msg.seq]
+                self.send(self.mav.mission_item_encode(
+                    255, 0, m.seq, m.frame, m.command, m.current, m.autocontinue,
+                    m.param1, m.param2, m.param3, m.param4, m.x, m.y, m.z, 0))
+
+    def close(self):
+        self.running = False
+        self.uplink.running = False
+        self.downlink.running = False
+
+
+def connect(baud, latency, loss):
+    master = mavutil.mavlink_connection('udpin:127.0.0.1:0', dialect='ardupilotmega')
+    vehicle = Vehicle(master.port.getsockname(), baud, latency, loss)
+    master.wait_heartbeat(timeout=5)
+    master.target_system = 1
+    master.target_component = 1
+    MF.targetComponent = None
+    return master, vehicle
+
+
+def waypoints(n):
+    return [(37.1 + i * 1e-3, -76.3 - i * 1e-3, 50) for i in range(n)]
+
+
+def legacyItem(master, mlog, seq, frame, command, autocontinue, p2, point):
+    # the old sendWaypoint and sendVelocity, one item then a 2 s wait
+    master.mav.mission_item_send(master.target_system, MP.getComponent(master), seq, frame, command,
+                                 0, autocontinue, 0, p2, 0, 0,
+                                 float(point[0]), float(point[1]), float(point[2]),
+                                 mavutil.mavlink.MAV_MISSION_TYPE_MISSION)
+    return MF.recvMatchAndLog(master, mlog, None, ['MISSION_REQUEST', 'MISSION_ACK'])
+
+
+def legacyWaypoint(master, mlog, point, seq):
+    return legacyItem(master, mlog, seq, mavutil.mavlink.MAV_FRAME_GLOBAL_RELATIVE_ALT,
+                      mavutil.mavlink.MAV_CMD_NAV_WAYPOINT, 0, 10, point)
+
+
+def legacyUpload(master, mlog, wp_list, vel):
+    # the old loadFlightPlan loop
+    master.mav.mission_count_send(master.target_system, MP.getComponent(master), len(wp_list) + 1,
+                                  mavutil.mavlink.MAV_MISSION_TYPE_MISSION)
+    msg_in = MF.recvMatchAndLog(master, mlog, None, ['MISSION_REQUEST'])
+    if msg_in is None:
+        return False
+    msg_in = legacyWaypoint(master, mlog, wp_list[int(msg_in.seq)], int(msg_in.seq))
+    msg_in = legacyItem(master, mlog, 1, 0, mavutil.mavlink.MAV_CMD_DO_CHANGE_SPEED, 1, vel, (0, 0, 0))
+    while True:
+        if msg_in is None:
+            return False
+        if msg_in.get_type() == 'MISSION_ACK':
+            return int(msg_in.type) == 0
+        seq = int(msg_in.seq)
+        msg_in = legacyWaypoint(master, mlog, wp_list[seq - 1], seq)
+
+
+def legacyDownload(master, mlog, deadline):
+    # the old requestWaypoints loop, it asks again for an item forever,
+    # here it gives up at the deadline
+    master.mav.mission_request_list_send(master.target_system, MP.getComponent(master),
+                                         mavutil.mavlink.MAV_MISSION_TYPE_MISSION)
+    msg_in = MF.recvMatchAndLog(master, mlog, None, ['MISSION_COUNT'])
+    if msg_in is None:
+        return False
+    i = 0
+    while i < msg_in.count:
+        if time.time() > deadline:
+            return False
+        master.mav.mission_request_send(master.target_system, MP.getComponent(master), i,
+                                        mavutil.mavlink.MAV_MISSION_TYPE_MISSION)
+        msg_item = MF.recvMatchAndLog(master, mlog, None, ['MISSION_ITEM'])
+        if msg_item is not None and msg_item.seq == i:
+            i += 1
+    return True
+
+
+def trial(kind, args, loss):
+    master, vehicle = connect(args.baud, args.latency / 1000.0, loss)
+    mlog = open(os.devnull, 'wb')
+    wp_list = waypoints(args.items)
+    items = MP.waypointItems(wp_list, 10, 5.0)
+    del MF.held[:]
+    try:
+        if 'download' in kind:
+            # load the aircraft without loss first
+            vehicle.mission = [mavutil.mavlink.MAVLink_mission_item_message(
+                1, 1, seq, *item[:10], 0) for seq, item in enumerate(items)]
+            for m, item in zip(vehicle.mission, items):
+                m.z = item[10]
+        start = time.time()
+        if kind == 'legacy upload':
+            ok = legacyUpload(master, mlog, wp_list, 5.0)
+        elif kind == 'upload':
+            upload = MF.runBlocking(MP.upload(master, mlog, None, items), master, mlog, None)
+            ok = upload.state == MP.DONE
+        elif kind == 'legacy download':
+            ok = legacyDownload(master, mlog, start + args.max_time)
+        else:
+            window = 1 if kind == 'download w1' else MP.WINDOW
+            d = MP.MissionDownload(master, mlog, None, mavutil.mavlink.MAV_MISSION_TYPE_MISSION,
+                                   window=window)
+            ok = d.run() and len(d.getItems()) == len(items)
+        return ok, time.time() - start
+    finally:
+        vehicle.close()
+        master.close()
+        mlog.close()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Mission transfer over a lossy link")
+    parser.add_argument("--items", default=50, type=int, help="waypoints in the mission")
+    parser.add_argument("--loss", default=[0, .01, .05, .1], type=float, nargs='+',
+                        help="packet loss in each direction")
+    parser.add_argument("--baud", default=57600, type=int, help="radio baud rate")
+    parser.add_argument("--latency", default=20, type=float, help="one way latency ms")
+    parser.add_argument("--trials", default=3, type=int, help="transfers per case")
+    parser.add_argument("--max-time", default=120, type=float, help="legacy download gives up after this")
+    parser.add_argument("--seed", default=1, type=int)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    kinds = ['legacy upload', 'upload', 'legacy download', 'download w1', 'download']
+    print('{} waypoints ({} items), {} baud, {} ms latency, window {}'.format(
+        args.items, args.items + 1, args.baud, args.latency, MP.WINDOW))
+    print('{:>16} {:>6} {:>8} {:>10} {:>10}'.format('transfer', 'loss', 'ok', 'mean s', 'max s'))
+    for loss in args.loss:
+        for kind in kinds:
+            times = []
+            ok = 0
+            for i in range(args.trials):
+                good, took = trial(kind, args, loss)
+                ok += good
+                times.append(took)
+            print('{:>16} {:>6.2f} {:>5}/{:<2} {:>10.2f} {:>10.2f}'.format(
+                kind, loss, ok, args.trials, sum(times) / len(times), max(times)))
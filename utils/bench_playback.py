@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+#
+# Author: Andrew Peters
+#
+# Copyright 2019 United States Government as represented by the Administrator of the National Aeronautics
+# and Space Administration. All Rights Reserved.
+#  
+# Disclaimers
+# No Warranty: THE SUBJECT SOFTWARE IS PROVIDED "AS IS" WITHOUT ANY WARRANTY OF ANY
+# KIND, EITHER EXPRESSED, IMPLIED, OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, ANY
+# WARRANTY THAT THE SUBJECT SOFTWARE WILL CONFORM TO SPECIFICATIONS, ANY IMPLIED
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, OR FREEDOM FROM
+# INFRINGEMENT, ANY WARRANTY THAT THE SUBJECT SOFTWARE WILL BE ERROR FREE, OR ANY
+# WARRANTY THAT DOCUMENTATION, IF PROVIDED, WILL CONFORM TO THE SUBJECT SOFTWARE.
+# THIS AGREEMENT DOES NOT, IN ANY MANNER, CONSTITUTE AN ENDORSEMENT BY GOVERNMENT
+# AGENCY OR ANY PRIOR RECIPIENT OF ANY RESULTS, RESULTING DESIGNS, HARDWARE,
+# SOFTWARE PRODUCTS OR ANY OTHER APPLICATIONS RESULTING FROM USE OF THE SUBJECT
+# SOFTWARE.  FURTHER, GOVERNMENT AGENCY DISCLAIMS ALL WARRANTIES AND LIABILITIES
+# REGARDING THIRD-PARTY SOFTWARE, IF PRESENT IN THE ORIGINAL SOFTWARE, AND
+# DISTRIBUTES IT "AS IS."
+#  
+# Waiver and Indemnity:  RECIPIENT AGREES TO WAIVE ANY AND ALL CLAIMS AGAINST THE UNITED
+# STATES GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR
+# RECIPIENT.  IF RECIPIENT'S USE OF THE SUBJECT SOFTWARE RESULTS IN ANY LIABILITIES,
+# DEMANDS, DAMAGES, EXPENSES OR LOSSES ARISING FROM SUCH USE, INCLUDING ANY
+# DAMAGES FROM PRODUCTS BASED ON, OR RESULTING FROM, RECIPIENT'S USE OF THE SUBJECT
+# SOFTWARE, RECIPIENT SHALL INDEMNIFY AND HOLD HARMLESS THE UNITED STATES
+# GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR RECIPIENT,
+# TO THE EXTENT PERMITTED BY LAW.  RECIPIENT'S SOLE REMEDY FOR ANY SUCH MATTER SHALL
+# BE THE IMMEDIATE, UNILATERAL TERMINATION OF THIS AGREEMENT.
+#
+
+# Playback pacing, how much log time is played per second of wall time.
+# Compares the old per message time.sleep(delta / speed) with the LogPlayer
+# schedule, on a synthetic tlog with --hz messages per second.
+#
+# python3 bench_playback.py --speeds 1 4 16 --seconds 5
+
+import os
+import sys
+import time
+import struct
+import shutil
+import tempfile
+from argparse import ArgumentParser
+from pymavlink.dialects.v20 import ardupilotmega as mavlink
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'SocketServer'))
+
+import GsProcesses.playback as P
+
+
+def synthetic_tlog(path, hz, seconds):
+    mav = mavlink.MAVLink(None, srcSystem=1, srcComponent=1)
+    t0 = int(time.time() * 1e6)
+    with open(path, 'wb') as f:
+        for i in range(int(hz * seconds)):
+            t = t0 + int(i * 1e6 / hz)
+            if i % 2:
+                m = mav.global_position_int_encode(i, 371020000 + i, -763870000, 10000, 5000, 10, -5, 0, 9000)
+            else:
+                m = mav.attitude_encode(i, 0.01, -0.02, 1.57, 0.001, 0.002, 0.003)
+            f.write(struct.pack('>Q', t) + m.pack(mav))
+
+
+def legacy(player, speed, seconds):
+    # getNext before the schedule, one message and one sleep at a time
+    messages = player.messages
+    position = 0
+    start = time.monotonic()
+    count = 0
+    while time.monotonic() - start < seconds and position < len(messages) - 1:
+        position += 1
+        x = messages[position]
+        time.sleep(x[3] / speed)
+        count += 1
+    wall = time.monotonic() - start
+    played = messages.getTime(position)
+    return played, wall, count, wall - played / speed
+
+
+def scheduled(player, speed, seconds):
+    if player.paused:
+        player.Play()
+    player.SeekTime(0)
+    player.set_speed(speed)
+    player.anchor()
+    start = time.monotonic()
+    count = 0
+    while time.monotonic() - start < seconds and not player.paused:
+        wake = player.nextDue()
+        if wake:
+            time.sleep(wake)
+        count += len(player.getBatch())
+    wall = time.monotonic() - start
+    played = player.messages.getTime(max(player.position, 0))
+    return played, wall, count, player.getDrift()[2]
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--hz", default=50, type=float, help="messages per second in the log")
+    parser.add_argument("--speeds", default=[1, 4, 16], type=float, nargs='+', help="playback speeds")
+    parser.add_argument("--seconds", default=5, type=float, help="wall time per case")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(workdir, 'LogFiles'))
+    os.chdir(workdir)
+    synthetic_tlog('LogFiles/bench.tlog', args.hz, max(args.speeds) * args.seconds * 1.2)
+    player = P.LogPlayer('bench.tlog', 'tlog')
+    player.getMessages()
+
+    print('{:>10} {:>6} {:>12} {:>10} {:>10} {:>10}'.format(
+        'pacing', 'speed', 'log s/wall s', 'msg/s', 'behind s', 'max drift'))
+    for speed in args.speeds:
+        played, wall, count, behind = legacy(player, speed, args.seconds)
+        print('{:>10} {:>6} {:>12.2f} {:>10.0f} {:>10.3f} {:>10}'.format(
+            'sleep', speed, played / wall, count / wall, behind, ''))
+        played, wall, count, drift = scheduled(player, speed, args.seconds)
+        print('{:>10} {:>6} {:>12.2f} {:>10.0f} {:>10} {:>10.4f}'.format(
+            'schedule', speed, played / wall, count / wall, '', drift))
+    player.messages.close()
+    shutil.rmtree(workdir)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+#
+# Author: Andrew Peters
+#
+# Copyright 2019 United States Government as represented by the Administrator of the National Aeronautics
+# and Space Administration. All Rights Reserved.
+#  
+# Disclaimers
+# No Warranty: THE SUBJECT SOFTWARE IS PROVIDED "AS IS" WITHOUT ANY WARRANTY OF ANY
+# KIND, EITHER EXPRESSED, IMPLIED, OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, ANY
+# WARRANTY THAT THE SUBJECT SOFTWARE WILL CONFORM TO SPECIFICATIONS, ANY IMPLIED
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, OR FREEDOM FROM
+# INFRINGEMENT, ANY WARRANTY THAT THE SUBJECT SOFTWARE WILL BE ERROR FREE, OR ANY
+# WARRANTY THAT DOCUMENTATION, IF PROVIDED, WILL CONFORM TO THE SUBJECT SOFTWARE.
+# THIS AGREEMENT DOES NOT, IN ANY MANNER, CONSTITUTE AN ENDORSEMENT BY GOVERNMENT
+# AGENCY OR ANY PRIOR RECIPIENT OF ANY RESULTS, RESULTING DESIGNS, HARDWARE,
+# SOFTWARE PRODUCTS OR ANY OTHER APPLICATIONS RESULTING FROM USE OF THE SUBJECT
+# SOFTWARE.  FURTHER, GOVERNMENT AGENCY DISCLAIMS ALL WARRANTIES AND LIABILITIES
+# REGARDING THIRD-PARTY SOFTWARE, IF PRESENT IN THE ORIGINAL SOFTWARE, AND
+# DISTRIBUTES IT "AS IS."
+#  
+# Waiver and Indemnity:  RECIPIENT AGREES TO WAIVE ANY AND ALL CLAIMS AGAINST THE UNITED
+# STATES GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR
+# RECIPIENT.  IF RECIPIENT'S USE OF THE SUBJECT SOFTWARE RESULTS IN ANY LIABILITIES,
+# DEMANDS, DAMAGES, EXPENSES OR LOSSES ARISING FROM SUCH USE, INCLUDING ANY
+# DAMAGES FROM PRODUCTS BASED ON, OR RESULTING FROM, RECIPIENT'S USE OF THE SUBJECT
+# SOFTWARE, RECIPIENT SHALL INDEMNIFY AND HOLD HARMLESS THE UNITED STATES
+# GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR RECIPIENT,
+# TO THE EXTENT PERMITTED BY LAW.  RECIPIENT'S SOLE REMEDY FOR ANY SUCH MATTER SHALL
+# BE THE IMMEDIATE, UNILATERAL TERMINATION OF THIS AGREEMENT.
+#
+
+# Receive throughput of mavlinkCommands.recvAndLog.
+# Replays the messages from a tlog over udp, --per-datagram messages packed in
+# each datagram, and compares the old one recv and one parse_char per call with
+# the batched recvAndLog. Without --tlog a synthetic tlog is generated.
+#
+# python3 bench_recv_batch.py --tlog ../SocketServer/LogFiles/flight_log_ac_1.tlog
+
+import os
+import sys
+import time
+import socket
+import struct
+import tempfile
+from argparse import ArgumentParser
+from pymavlink import mavutil
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'SocketServer'))
+
+import GsProcesses.mavlinkCommands as MF
+
+CHUNK = 100  # datagrams sent before draining, stays under the socket buffer
+
+
+def synthetic_tlog(path, count):
+    mavutil.set_dialect('ardupilotmega')
+    mav = mavutil.mavlink.MAVLink(None, srcSystem=1, srcComponent=1)
+    with open(path, 'wb') as f:
+        for i in range(count):
+            t = 123456 + i * 20
+            k = i % 10
+            if k == 0:
+                m = mav.heartbeat_encode(2, 3, 89, 4, 4, 3)
+            elif k < 5:
+                m = mav.global_position_int_encode(t, 371020000 + i, -763870000, 10000, 5000, 10, -5, 0, 9000)
+            elif k < 9:
+                m = mav.attitude_encode(t, 0.01, -0.02, 1.57, 0.001, 0.002, 0.003)
+            else:
+                m = mav.vfr_hud_encode(5.0, 5.0, 90, 50, 10.0, 0.0)
+            f.write(struct.pack('>Q', int(time.time() * 1e6)) + m.pack(mav))
+
+
+def load_tlog(path):
+    mlog = mavutil.mavlink_connection(path, dialect='ardupilotmega')
+    bufs = []
+    while True:
+        m = mlog.recv_match()
+        if m is None:
+            break
+        if m.get_type() != 'BAD_DATA':
+            bufs.append(bytes(m.get_msgbuf()))
+    return bufs
+
+
+def legacy(master, mlog):
+    # recvAndLog before batching, one datagram and one parse_char
+    m = master.recv()
+    if len(m) == 0:
+        return None
+    if master.first_byte:
+        master.auto_mavlink_version(m)
+    msg = master.mav.parse_char(m)
+    if msg is not None:
+        master.post_message(msg)
+        usec = int(time.time() * 1.0e6)
+        mlog.write(bytearray(struct.pack('>Q', usec)) + m)
+    if msg is not None:
+        MF.links.add(msg, time.time())
+    return [msg]
+
+
+def batched(master, mlog):
+    m = MF.recvAndLog(master, mlog, None)[0]
+    if m[0] is None:
+        return None
+    return m
+
+
+def run(name, recv, bufs, per, port):
+    master = mavutil.mavlink_connection('udpin:127.0.0.1:{}'.format(port), dialect='ardupilotmega')
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    datagrams = [b''.join(bufs[i:i + per]) for i in range(0, len(bufs), per)]
+    received = 0
+    calls = 0
+    elapsed = 0
+    with open(os.devnull, 'wb') as mlog:
+        for c in range(0, len(datagrams), CHUNK):
+            for d in datagrams[c:c + CHUNK]:
+                sock.sendto(d, ('127.0.0.1', port))
+            t = time.perf_counter()
+            while True:
+                msgs = recv(master, mlog)
+                if msgs is None:
+                    break
+                calls += 1
+                received += len([x for x in msgs if x is not None])
+            elapsed += time.perf_counter() - t
+    master.close()
+    sock.close()
+    print('{:>8} {:>6} {:>10} {:>10} {:>8} {:>12.0f}'.format(
+        name, per, len(bufs), received, calls, received / elapsed))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--tlog", help="tlog to replay")
+    parser.add_argument("--count", default=20000, type=int, help="messages in the synthetic tlog")
+    parser.add_argument("--per-datagram", default=[1, 4, 16], type=int, nargs='+', help="messages per datagram")
+    parser.add_argument("--port", default=14800, type=int, help="udp port")
+    args = parser.parse_args()
+
+    tlog = args.tlog
+    if tlog is None:
+        tlog = os.path.join(tempfile.mkdtemp(), 'synthetic.tlog')
+        synthetic_tlog(tlog, args.count)
+    bufs = load_tlog(tlog)
+
+    print('{:>8} {:>6} {:>10} {:>10} {:>8} {:>12}'.format(
+        'recv', 'per dg', 'sent', 'received', 'calls', 'msg/s'))
+    for per in args.per_datagram:
+        run('legacy', legacy, bufs, per, args.port)
+        run('batched', batched, bufs, per, args.port)
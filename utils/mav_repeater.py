@@ -34,120 +34,341 @@
 # BE THE IMMEDIATE, UNILATERAL TERMINATION OF THIS AGREEMENT.
 #
 
+# Repeats mavlink between masters and their outputs, many routes in one
+# process. Each route has one master and any number of outputs, everything
+# from the master goes to every output and everything coming back from an
+# output goes to the master.
+# UDP links run on an asyncio event loop and datagrams are forwarded as
+# they are, without decoding. Packets are only framed from their headers
+# when a route inserts messages. Serial links use a mavutil connection read
+# by a thread.
+# Each master is sent a REQUEST_DATA_STREAM for all streams when its link
+# opens and whenever it comes back, unless the route has request_stream:
+# false or --no-request-stream is given.
+#
+# python mav_repeater.py --master udp:0.0.0.0:14560 --out udp:192.168.1.91:14550 udp:127.0.0.1:14570 --insert HEARTBEAT
+# python mav_repeater.py --config repeater.yaml
+#
+# repeater.yaml:
+#   stats: 10
+#   routes:
+#     - master: udp:0.0.0.0:14510
+#       out: [udp:127.0.0.1:14510]
+#       insert: [HEARTBEAT]
+#     - master: /dev/ttyUSB0,57600
+#       out: [udp:127.0.0.1:14520, udp:192.168.1.91:14520]
+#       request_stream: false
+
+import os
+import sys
 import time
-import struct
-from operator import itemgetter
+import signal
+import asyncio
+import threading
 from argparse import ArgumentParser
-from pymavlink import mavutil, mavwp, mavparm
+from pymavlink import mavutil
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'SocketServer'))
+
+import GsProcesses.logIndex as LI
+
+
+BAUD = 57600
+LINK_TIMEOUT = 3
+INSERTS = ['HEARTBEAT']
+HEARTBEAT_ID = 0
+
+
+def parseAddress(device):
+    # 'udp:host:port' -> (kind, (host, port)), anything else is a mavutil device
+    for kind in ['udpin', 'udpout', 'udp']:
+        if device.startswith(kind + ':'):
+            host, port = device[len(kind) + 1:].rsplit(':', 1)
+            return kind, (host, int(port))
+    return 'mavutil', device
+
+
+class UdpProtocol(asyncio.DatagramProtocol):
+    def __init__(self, callback):
+        self.callback = callback
+        self.transport = None
+        self.peer = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        # listening sockets reply to whoever sent to them last
+        self.peer = addr
+        self.callback(data, addr)
+
+    def reply(self, data):
+        if self.peer is not None:
+            self.transport.sendto(data, self.peer)
+
+    def error_received(self, exc):
+        # nothing listening on the other end yet
+        pass
+
+
+class MavutilLink:
+    # serial (or anything else mavutil opens), read by a daemon thread
+    def __init__(self, device, callback, loop):
+        self.device = device
+        self.callback = callback
+        self.loop = loop
+        self.running = True
+        if ',' in device:
+            device, baud = device.split(',', 1)
+            baud = int(baud)
+        else:
+            baud = BAUD
+        self.conn = mavutil.mavlink_connection(
+            device, dialect='ardupilotmega', baud=baud, force_connected=True)
+        self.thread = threading.Thread(target=self.read, daemon=True)
+        self.thread.start()
+
+    def read(self):
+        while self.running:
+            try:
+                data = self.conn.recv()
+            except Exception as ecpt:
+                print(self.device, ecpt)
+                time.sleep(1)
+                continue
+            if len(data) > 0:
+                self.loop.call_soon_threadsafe(self.callback, bytes(data), None)
+            else:
+                time.sleep(.001)
+
+    def write(self, data):
+        self.conn.write(data)
+
+    def close(self):
+        self.running = False
+        self.conn.close()
+
 
+class Route:
+    def __init__(self, master, out, insert=None, request_stream=True):
+        self.master = master
+        self.request_stream = request_stream
+        self.out = list(out)
+        self.insert = [x for x in (insert or []) if x in INSERTS]
+        for x in insert or []:
+            if x not in INSERTS:
+                print('Insert not supported:', x)
+        self.master_link = None
+        self.master_addr = None
+        self.outputs = []  # [send(data)]
+        self.closers = []
 
-def connect_master(master):
-    BAUD = 57600
+        mavutil.set_dialect('ardupilotmega')
+        self.mav = mavutil.mavlink.MAVLink(None, srcSystem=1, srcComponent=1)
+
+        # counters, packets are datagrams (or serial reads)
+        self.packets_in = 0
+        self.bytes_in = 0
+        self.packets_out = 0
+        self.bytes_out = 0
+        self.packets_back = 0
+        self.bytes_back = 0
+        self.inserted = 0
+        self.handler_count = 0
+        self.handler_total = 0
+        self.handler_max = 0
+        self.last_msg = 0
+        self.status = False
+
+    async def open(self, loop):
+        kind, addr = parseAddress(self.master)
+        if kind == 'mavutil':
+            link = MavutilLink(addr, self.fromMaster, loop)
+            self.master_link = link.write
+            self.closers.append(link.close)
+        else:
+            if kind == 'udpout':
+                transport, _ = await loop.create_datagram_endpoint(
+                    lambda: UdpProtocol(self.fromMaster), remote_addr=addr)
+                self.master_link = transport.sendto
+            else:
+                transport, protocol = await loop.create_datagram_endpoint(
+                    lambda: UdpProtocol(self.fromMaster), local_addr=addr)
+                self.master_link = protocol.reply
+            self.closers.append(transport.close)
+        if kind != 'udp' and kind != 'udpin':
+            # a listening master gets it with its first packet, see fromMaster
+            self.requestStream()
+
+        for device in self.out:
+            kind, addr = parseAddress(device)
+            if kind == 'mavutil':
+                link = MavutilLink(addr, self.fromOutput, loop)
+                self.outputs.append(link.write)
+                self.closers.append(link.close)
+            elif kind == 'udpin':
+                transport, protocol = await loop.create_datagram_endpoint(
+                    lambda: UdpProtocol(self.fromOutput), local_addr=addr)
+                self.outputs.append(protocol.reply)
+                self.closers.append(transport.close)
+            else:
+                transport, _ = await loop.create_datagram_endpoint(
+                    lambda: UdpProtocol(self.fromOutput), remote_addr=addr)
+                self.outputs.append(transport.sendto)
+                self.closers.append(transport.close)
+        print('Route:', self.master, '->', ' '.join(self.out),
+              'insert ' + ' '.join(self.insert) if self.insert else '')
+
+    def requestStream(self):
+        # autopilots that wait for a ground station to ask send nothing
+        # until they get this, as in mavlinkCommands.requestDataStream
+        if self.request_stream:
+            self.master_link(self.mav.request_data_stream_encode(
+                0, 0, mavutil.mavlink.MAV_DATA_STREAM_ALL, BAUD, 1).pack(self.mav))
+
+    def inserts(self, data):
+        # frame the packets in the datagram from their headers, no decoding
+        out = []
+        pos = 0
+        while pos < len(data):
+            n = LI.packetLength(data, pos)
+            if n == 0:
+                break
+            if LI.packetId(data, pos) == HEARTBEAT_ID and 'HEARTBEAT' in self.insert:
+                out.append(self.mav.heartbeat_encode(14, 3, 81, 0, 3, 3).pack(self.mav))
+            pos += n
+        return out
+
+    def fromMaster(self, data, addr):
+        start = time.perf_counter()
+        self.packets_in += 1
+        self.bytes_in += len(data)
+        extra = self.inserts(data) if self.insert else []
+        for send in self.outputs:
+            for x in extra:
+                send(x)
+                self.inserted += 1
+            send(data)
+            self.packets_out += 1
+            self.bytes_out += len(data)
+        # time in this callback, from the datagram to the last output's
+        # sendto, not counting time in the socket buffers either side
+        dt = time.perf_counter() - start
+        self.handler_count += 1
+        self.handler_total += dt
+        if dt > self.handler_max:
+            self.handler_max = dt
+        self.last_msg = time.time()
+        if not self.status:
+            print('LINK GOOD:', self.master)
+            self.status = True
+            self.requestStream()
+
+    def fromOutput(self, data, addr):
+        self.packets_back += 1
+        self.bytes_back += len(data)
+        self.master_link(data)
+
+    def checkLink(self):
+        if self.status and time.time() - self.last_msg > LINK_TIMEOUT:
+            print('NO LINK:', self.master)
+            self.status = False
+
+    def getStats(self):
+        mean = self.handler_total / self.handler_count if self.handler_count else 0
+        return {'master': self.master,
+                'packets_in': self.packets_in, 'bytes_in': self.bytes_in,
+                'packets_out': self.packets_out, 'bytes_out': self.bytes_out,
+                'packets_back': self.packets_back, 'bytes_back': self.bytes_back,
+                'inserted': self.inserted,
+                'handler_mean_us': mean * 1e6, 'handler_max_us': self.handler_max * 1e6}
+
+    def close(self):
+        for close in self.closers:
+            close()
+
+
+def printStats(routes):
+    print('{:>24} {:>10} {:>12} {:>10} {:>10} {:>10} {:>10} {:>9}'.format(
+        'master', 'in', 'in bytes', 'out', 'back', 'inserted', 'handler us', 'max us'))
+    for route in routes:
+        s = route.getStats()
+        print('{:>24} {:>10} {:>12} {:>10} {:>10} {:>10} {:>10.1f} {:>9.1f}'.format(
+            s['master'], s['packets_in'], s['bytes_in'], s['packets_out'],
+            s['packets_back'], s['inserted'], s['handler_mean_us'], s['handler_max_us']))
+
+
+def loadConfig(path):
+    import yaml
+    with open(path) as f:
+        config = yaml.safe_load(f)
+    if isinstance(config, list):
+        config = {'routes': config}
+    routes = []
+    for r in config.get('routes', []):
+        out = r.get('out', [])
+        if isinstance(out, str):
+            out = [out]
+        routes.append(Route(r['master'], out, r.get('insert'), r.get('request_stream', True)))
+    return routes, config.get('stats', 0)
+
+
+async def runRoutes(routes, stats=0):
+    loop = asyncio.get_event_loop()
+    for route in routes:
+        await route.open(loop)
+
+    stop = asyncio.Event()
+    for sig in [signal.SIGINT, signal.SIGTERM]:
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    last_stats = time.time()
     try:
-        print(master)
-        m = mavutil.mavlink_connection(
-            master, dialect='ardupilotmega', baud=BAUD, force_connected=True)
-
-        m.mav.request_data_stream_send(m.target_system,
-                                       m.target_component,
-                                       mavutil.mavlink.MAV_DATA_STREAM_ALL,
-                                       BAUD,
-                                       1)
-    except Exception as ecpt:
-        print(ecpt)
-        m = 'NONE'
-    print('m', m)
-    return m
-
-
-def connect_outputs(out):
-    BAUD = 57600
-    out_list = []
-    for item in out:
-        forwarding = mavutil.mavlink_connection(
-            item, baud=BAUD, dialect='ardupilotmega', input=False)
-        out_list.append(forwarding)
-    print('out', out_list)
-    return out_list
-
-
-def handle_messages_in(master, out_list, insert, LAST_MSG, LAST_PRINT, STATUS):
-
-    master.pre_message()
-    m = master.recv()
-    if len(m) > 0:
-        if master.first_byte:
-            master.auto_mavlink_version(m)
-
-        msg = master.mav.parse_char(m)
-
-        if msg is not None:
-            master.post_message(msg)
-            if 'BAD_DATA' not in str(msg):
-                for out in out_list:
-                    out.mav.srcComponent = 1
-                    out.mav.srcSystem = 1
-                    if insert is not None:
-                        for i in insert:
-                            if i == 'HEARTBEAT' and msg.name == "HEARTBEAT":
-
-                                new_m = out.mav.heartbeat_encode(
-                                    14, 3, 81, 0, 3, 3)
-                                y = new_m.pack(out.mav)
-                                out.write(y)
-
-                    out.write(m)
-                    LAST_MSG = time.time()
-                    if STATUS == False:
-                        print('LINK GOOD')
-                        STATUS = True
-                    # print(out, STATUS, m)
-
-    if time.time() - LAST_MSG > 3 and time.time() - LAST_PRINT > 3:
-        print('NO LINK:', master.port)
-        LAST_PRINT = time.time()
-        STATUS = False
-    return LAST_MSG, LAST_PRINT, STATUS
-
-
-def handle_messages_out(master, out_list):
-    for link in out_list:
-        link.pre_message()
-        m = link.recv()
-        if len(m) > 0:
-            if link.first_byte:
-                link.auto_mavlink_version(m)
-
-            msg = link.mav.parse_char(m)
-
-            if msg is not None:
-                # print(msg)
-                master.write(m)
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), 1)
+            except asyncio.TimeoutError:
+                pass
+            for route in routes:
+                route.checkLink()
+            if stats > 0 and time.time() - last_stats >= stats:
+                printStats(routes)
+                last_stats = time.time()
+    finally:
+        printStats(routes)
+        for route in routes:
+            route.close()
 
 
 if __name__ == '__main__':
 
     parser = ArgumentParser(description=__doc__)
-    parser.add_argument("--master", required=True,
-                        default=None, help="input tlog file")
-    parser.add_argument("--out", nargs='*',
+    parser.add_argument("--master", default=None,
+                        help="master connection. Format: udp:<address>:<port> or <path>,<baud>")
+    parser.add_argument("--out", nargs='*', default=[],
                         help="outputs, can have multiple. Format: udp:<address>:<port> or <path>,<baud>")
     parser.add_argument("--insert", nargs='*', default=None,
                         help="msg to insert. Format <type>. Currently support HEARTBEAT.")
-
-    LAST_MSG = time.time()
-    LAST_PRINT = time.time()
-    STATUS = False
+    parser.add_argument("--no-request-stream", action='store_true',
+                        help="do not send the master a REQUEST_DATA_STREAM")
+    parser.add_argument("--config", default=None,
+                        help="yaml file with a list of routes, each with master, out and insert")
+    parser.add_argument("--stats", default=0, type=float,
+                        help="print route counters every STATS seconds")
 
     args = parser.parse_args()
     print(args)
-    master = connect_master(args.master)
-    out_list = connect_outputs(args.out)
-
-    running = True
-    while running:
-        LAST_MSG, LAST_PRINT, STATUS = handle_messages_in(
-            master, out_list, args.insert, LAST_MSG, LAST_PRINT, STATUS)
-        handle_messages_out(master, out_list)
+    routes = []
+    stats = args.stats
+    if args.config is not None:
+        routes, config_stats = loadConfig(args.config)
+        stats = stats or config_stats
+    if args.master is not None:
+        routes.append(Route(args.master, args.out, args.insert, not args.no_request_stream))
+    if len(routes) == 0:
+        parser.error('--master or --config is required')
 
-    # python mav_repeater.py --master udp:0.0.0.0:14560 --out udp:192.168.1.91:14550 udp:127.0.0.1:14570 --insert HEARTBEAT
+    asyncio.get_event_loop().run_until_complete(runRoutes(routes, stats))
@@ -0,0 +1,673 @@
+#!/usr/bin/env python3
+
+#
+# Author: Andrew Peters
+#
+# Copyright 2019 United States Government as represented by the Administrator of the National Aeronautics
+# and Space Administration. All Rights Reserved.
+#  
+# Disclaimers
+# No Warranty: THE SUBJECT SOFTWARE IS PROVIDED "AS IS" WITHOUT ANY WARRANTY OF ANY
+# KIND, EITHER EXPRESSED, IMPLIED, OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, ANY
+# WARRANTY THAT THE SUBJECT SOFTWARE WILL CONFORM TO SPECIFICATIONS, ANY IMPLIED
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, OR FREEDOM FROM
+# INFRINGEMENT, ANY WARRANTY THAT THE SUBJECT SOFTWARE WILL BE ERROR FREE, OR ANY
+# WARRANTY THAT DOCUMENTATION, IF PROVIDED, WILL CONFORM TO THE SUBJECT SOFTWARE.
+# THIS AGREEMENT DOES NOT, IN ANY MANNER, CONSTITUTE AN ENDORSEMENT BY GOVERNMENT
+# AGENCY OR ANY PRIOR RECIPIENT OF ANY RESULTS, RESULTING DESIGNS, HARDWARE,
+# SOFTWARE PRODUCTS OR ANY OTHER APPLICATIONS RESULTING FROM USE OF THE SUBJECT
+# SOFTWARE.  FURTHER, GOVERNMENT AGENCY DISCLAIMS ALL WARRANTIES AND LIABILITIES
+# REGARDING THIRD-PARTY SOFTWARE, IF PRESENT IN THE ORIGINAL SOFTWARE, AND
+# DISTRIBUTES IT "AS IS."
+#  
+# Waiver and Indemnity:  RECIPIENT AGREES TO WAIVE ANY AND ALL CLAIMS AGAINST THE UNITED
+# STATES GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR
+# RECIPIENT.  IF RECIPIENT'S USE OF THE SUBJECT SOFTWARE RESULTS IN ANY LIABILITIES,
+# DEMANDS, DAMAGES, EXPENSES OR LOSSES ARISING FROM SUCH USE, INCLUDING ANY
+# DAMAGES FROM PRODUCTS BASED ON, OR RESULTING FROM, RECIPIENT'S USE OF THE SUBJECT
+# SOFTWARE, RECIPIENT SHALL INDEMNIFY AND HOLD HARMLESS THE UNITED STATES
+# GOVERNMENT, ITS CONTRACTORS AND SUBCONTRACTORS, AS WELL AS ANY PRIOR RECIPIENT,
+# TO THE EXTENT PERMITTED BY LAW.  RECIPIENT'S SOLE REMEDY FOR ANY SUCH MATTER SHALL
+# BE THE IMMEDIATE, UNILATERAL TERMINATION OF THIS AGREEMENT.
+#
+
+# A lightweight stand-in for ArduPilot SITL and Icarous, hundreds of
+# simulated vehicles over UDP in one process. Each vehicle has its own
+# socket and sysid and sends to --target on --port + i * --port-step, the
+# ports a ground station is told to listen on, and speaks what
+# mavlinkCommands and missionProtocol use:
+#   HEARTBEAT, GLOBAL_POSITION_INT and ATTITUDE at their own rates
+#   COMMAND_LONG and SET_MODE answered with COMMAND_ACK, arm, takeoff and
+#     mission start put the vehicle in the air
+#   mission upload and download for every mission_type, MISSION_CLEAR_ALL,
+#     MISSION_ITEM_REACHED while flying the mission in AUTO
+#   DO_FENCE_ENABLE, FENCE_FETCH_POINT and FENCE_POINT, acked after the
+#     last point the way Icarous does
+#   PARAM_REQUEST_LIST, PARAM_REQUEST_READ and PARAM_SET
+#   ADSB_VEHICLE for --traffic intruders around each vehicle
+# Both directions drop --loss of the datagrams and deliver the rest after
+# --latency ms plus up to --jitter ms.
+# Every vehicle is driven from one asyncio loop, a vehicle only does work
+# when a message comes in or its next telemetry is due.
+#
+# python3 mav_simulator.py --vehicles 200 --port 14553 --port-step 10 --stats 10
+# python3 mav_simulator.py --vehicles 4 --port-step 0 --loss .05 --latency 100 --traffic 3 --flying
+#
+# Many vehicles need one file descriptor each, raise ulimit -n above 1024
+# for more than about a thousand.
+
+import os
+import sys
+import math
+import time
+import random
+import signal
+import asyncio
+from argparse import ArgumentParser
+
+# the mission messages carry mission_type, a mavlink 2 field
+os.environ['MAVLINK20'] = '1'
+from pymavlink import mavutil
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'SocketServer'))
+
+import GsProcesses.missionProtocol as MP
+
+mavutil.set_dialect('ardupilotmega')
+mavlink = mavutil.mavlink
+
+
+HOME = (37.0866, -76.3789, 5.0)  # the SITL home in Scripts/StartAutopilot.sh
+SPACING = 500       # m between vehicles on the grid of circle centres
+RADIUS = 100        # m, circle flown when not on a mission
+SPEED = 5           # m/s
+TAKEOFF_ALT = 15    # m, when the takeoff command has none
+REACHED = 3         # m from a waypoint to count it reached
+RESEND = .5         # s before an unanswered mission request or fence fetch is sent again
+TICK = .01          # s between telemetry checks
+EARTH = 6378137.0
+
+# ArduCopter custom modes
+STABILIZE = 0
+AUTO = 3
+GUIDED = 4
+
+PARAMS = {'WPNAV_SPEED': 500.0, 'WPNAV_RADIUS': 200.0, 'WPNAV_SPEED_UP': 250.0,
+          'RTL_ALT': 1500.0, 'FENCE_ENABLE': 0.0, 'ARMING_CHECK': 1.0,
+          'SYSID_MYGCS': 255.0, 'SYSID_THISMAV': 1.0}
+
+NAV_COMMANDS = [mavlink.MAV_CMD_NAV_WAYPOINT, mavlink.MAV_CMD_NAV_TAKEOFF,
+                mavlink.MAV_CMD_NAV_LOITER_UNLIM, mavlink.MAV_CMD_NAV_LAND]
+
+
+def toDegrees(frame, x, y):
+    if frame in MP.GLOBAL_FRAMES:
+        return x * 1e-7, y * 1e-7
+    return float(x), float(y)
+
+
+def offset(lat, lon, north, east):
+    # small offsets in m on a flat earth
+    return (lat + math.degrees(north / EARTH),
+            lon + math.degrees(east / (EARTH * math.cos(math.radians(lat)))))
+
+
+def distance(lat1, lon1, lat2, lon2):
+    # (north, east) in m from 1 to 2
+    return (math.radians(lat2 - lat1) * EARTH,
+            math.radians(lon2 - lon1) * EARTH * math.cos(math.radians(lat1)))
+
+
+class Channel:
+    # one direction of the radio link, shared by every vehicle
+    def __init__(self, loop, loss, latency, jitter):
+        self.loop = loop
+        self.loss = loss
+        self.latency = latency
+        self.jitter = jitter
+        self.packets = 0
+        self.bytes = 0
+        self.dropped = 0
+
+    def deliver(self, callback, data):
+        if self.loss > 0 and random.random() < self.loss:
+            self.dropped += 1
+            return
+        self.packets += 1
+        self.bytes += len(data)
+        delay = self.latency
+        if self.jitter > 0:
+            delay += random.random() * self.jitter
+        if delay > 0:
+            self.loop.call_later(delay, callback, data)
+        else:
+            callback(data)
+
+
+class Simulator:
+    # settings and counters shared by the vehicles
+    def __init__(self, loop, args):
+        self.loop = loop
+        self.args = args
+        self.uplink = Channel(loop, args.loss, args.latency / 1000.0, args.jitter / 1000.0)
+        self.downlink = Channel(loop, args.loss, args.latency / 1000.0, args.jitter / 1000.0)
+        self.params = dict(PARAMS)
+        for i in range(max(0, args.params - len(PARAMS))):
+            self.params['SIM_PARAM_{:03d}'.format(i)] = float(i)
+        self.counts = {}
+        self.vehicles = []
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def addVehicle(self, index):
+        args = self.args
+        # sysids wrap after 255, each vehicle has its own port to tell them apart
+        sysid = (args.sysid + index - 1) % 255 + 1
+        port = args.port + index * args.port_step
+        columns = max(1, int(math.ceil(math.sqrt(args.vehicles))))
+        centre = offset(HOME[0], HOME[1], (index // columns) * SPACING, (index % columns) * SPACING)
+        vehicle = Vehicle(self, index, sysid, (args.target, port), centre)
+        self.vehicles.append(vehicle)
+        return vehicle
+
+    def getStats(self):
+        stats = dict(self.counts)
+        stats.update({'vehicles': len(self.vehicles),
+                      'packets_out': self.downlink.packets, 'bytes_out': self.downlink.bytes,
+                      'dropped_out': self.downlink.dropped,
+                      'packets_in': self.uplink.packets, 'bytes_in': self.uplink.bytes,
+                      'dropped_in': self.uplink.dropped})
+        return stats
+
+
+class Vehicle(asyncio.DatagramProtocol):
+    def __init__(self, sim, index, sysid, target, centre):
+        self.sim = sim
+        self.index = index
+        self.sysid = sysid
+        self.target = target
+        self.centre = centre
+        self.transport = None
+        self.mav = mavlink.MAVLink(self, srcSystem=sysid, srcComponent=1)
+        self.mav.robust_parsing = True
+        self.gcs = (255, 0)  # sysid, compid of the last sender, replies go there
+
+        now = time.monotonic()
+        args = sim.args
+        self.boot = now
+        self.custom_mode = STABILIZE
+        self.armed = args.flying
+        self.flying = args.flying
+        self.lat, self.lon = offset(centre[0], centre[1], 0, RADIUS)
+        self.alt = TAKEOFF_ALT if args.flying else 0.0
+        self.target_alt = self.alt
+        self.vel = (0.0, 0.0)
+        self.roll = 0.0
+        self.yaw = 0.0
+        self.moved = now
+
+        self.missions = {}   # {mission_type: [item]}, items as in missionProtocol
+        self.upload = None   # [mission_type, count, next seq, items, time requested]
+        self.current = 0     # mission seq flown in AUTO
+        self.fences = {}     # {index: [(lat, lng)]}
+        self.fence = None    # [index, total, next idx, points, time fetched]
+        self.last_fence = None
+        self.params = dict(sim.params)
+        self.params['SYSID_THISMAV'] = float(sysid)
+        self.param_names = list(self.params)
+        self.param_next = None
+        self.param_last = now
+
+        # [period, next due, send], spread so the vehicles do not send together
+        self.streams = []
+        for rate, send in [(args.heartbeat, self.sendHeartbeat),
+                           (args.position, self.sendPosition),
+                           (args.attitude, self.sendAttitude),
+                           (args.traffic_rate if args.traffic > 0 else 0, self.sendTraffic)]:
+            if rate > 0:
+                self.streams.append([1.0 / rate, now + random.random() / rate, send])
+        self.due = min([s[1] for s in self.streams] + [now + RESEND])
+
+        self.handlers = {'COMMAND_LONG': self.onCommandLong,
+                         'SET_MODE': self.onSetMode,
+                         'MISSION_COUNT': self.onMissionCount,
+                         'MISSION_ITEM': self.onMissionItem,
+                         'MISSION_ITEM_INT': self.onMissionItem,
+                         'MISSION_REQUEST_LIST': self.onMissionRequestList,
+                         'MISSION_REQUEST': self.onMissionRequest,
+                         'MISSION_REQUEST_INT': self.onMissionRequest,
+                         'MISSION_CLEAR_ALL': self.onMissionClearAll,
+                         'MISSION_SET_CURRENT': self.onMissionSetCurrent,
+                         'FENCE_POINT': self.onFencePoint,
+                         'PARAM_REQUEST_LIST': self.onParamRequestList,
+                         'PARAM_REQUEST_READ': self.onParamRequestRead,
+                         'PARAM_SET': self.onParamSet}
+
+    # link
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.sim.uplink.deliver(self.receive, data)
+
+    def error_received(self, exc):
+        # nothing listening on the other end yet
+        pass
+
+    def write(self, buf):
+        # the MAVLink object's file, everything sent goes through here
+        self.sim.downlink.deliver(self.sendto, buf)
+
+    def sendto(self, buf):
+        if self.transport is not None:
+            self.transport.sendto(buf, self.target)
+
+    def receive(self, data):
+        for msg in self.mav.parse_buffer(data) or []:
+            self.handle(msg)
+
+    def handle(self, msg):
+        handler = self.handlers.get(msg.get_type())
+        if handler is None:
+            return
+        if getattr(msg, 'target_system', 0) not in (0, self.sysid):
+            return
+        self.gcs = (msg.get_srcSystem(), msg.get_srcComponent())
+        self.sim.count(msg.get_type())
+        handler(msg)
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+    # telemetry
+
+    def tick(self, now):
+        if now < self.due:
+            return
+        due = now + RESEND
+        for stream in self.streams:
+            if now >= stream[1]:
+                stream[2](now)
+                # fall behind rather than burst after a stall
+                stream[1] = max(stream[1] + stream[0], now)
+            due = min(due, stream[1])
+        if self.upload is not None and now - self.upload[4] > RESEND:
+            self.requestNext(now)
+        if self.fence is not None and now - self.fence[4] > RESEND:
+            self.fetchNext(now)
+        if self.param_next is not None:
+            self.sendParams(now)
+            due = now
+        self.due = due
+
+    def timeBoot(self, now):
+        return int((now - self.boot) * 1000) & 0xFFFFFFFF
+
+    def move(self, now):
+        dt = now - self.moved
+        self.moved = now
+        if not self.flying or dt <= 0:
+            self.vel = (0.0, 0.0)
+            return
+        self.alt += max(-SPEED * dt, min(SPEED * dt, self.target_alt - self.alt))
+        waypoint = self.nextWaypoint(now) if self.custom_mode == AUTO else None
+        if waypoint is not None:
+            # nextWaypoint only returns points further than REACHED
+            north, east = distance(self.lat, self.lon, waypoint[0], waypoint[1])
+            d = math.hypot(north, east)
+            step = min(d, SPEED * dt) / d
+            self.lat, self.lon = offset(self.lat, self.lon, north * step, east * step)
+            self.vel = (north / d * SPEED, east / d * SPEED)
+            self.roll = 0.0
+        else:
+            # circle the centre clockwise
+            north, east = distance(self.centre[0], self.centre[1], self.lat, self.lon)
+            angle = math.atan2(east, north) + SPEED * dt / RADIUS
+            self.lat, self.lon = offset(self.centre[0], self.centre[1],
+                                        RADIUS * math.cos(angle), RADIUS * math.sin(angle))
+            self.vel = (-SPEED * math.sin(angle), SPEED * math.cos(angle))
+            self.roll = math.atan(SPEED * SPEED / (RADIUS * 9.81))
+        self.yaw = math.atan2(self.vel[1], self.vel[0])
+
+    def nextWaypoint(self, now):
+        # the position of the mission item being flown, reports and skips
+        # the ones reached
+        items = self.missions.get(mavlink.MAV_MISSION_TYPE_MISSION, [])
+        while self.current < len(items):
+            frame, command, current, autocontinue, p1, p2, p3, p4, x, y, z = items[self.current]
+            if command in NAV_COMMANDS and frame in MP.GLOBAL_FRAMES and (x != 0 or y != 0):
+                north, east = distance(self.lat, self.lon, x, y)
+                if math.hypot(north, east) > REACHED:
+                    if z > 0:
+                        self.target_alt = z
+                    return x, y
+            if command in NAV_COMMANDS:
+                self.mav.mission_item_reached_send(self.current)
+                self.sim.count('reached')
+            self.current += 1
+            self.mav.mission_current_send(min(self.current, len(items) - 1))
+        return None
+
+    def sendHeartbeat(self, now):
+        base_mode = mavlink.MAV_MODE_FLAG_CUSTOM_MODE_ENABLED
+        if self.armed:
+            base_mode |= mavlink.MAV_MODE_FLAG_SAFETY_ARMED
+        self.mav.heartbeat_send(mavlink.MAV_TYPE_QUADROTOR, mavlink.MAV_AUTOPILOT_ARDUPILOTMEGA,
+                                base_mode, self.custom_mode,
+                                mavlink.MAV_STATE_ACTIVE if self.flying else mavlink.MAV_STATE_STANDBY)
+
+    def sendPosition(self, now):
+        self.move(now)
+        self.mav.global_position_int_send(self.timeBoot(now),
+                                          int(self.lat * 1e7), int(self.lon * 1e7),
+                                          int((HOME[2] + self.alt) * 1000), int(self.alt * 1000),
+                                          int(self.vel[0] * 100), int(self.vel[1] * 100), 0,
+                                          int(math.degrees(self.yaw) % 360 * 100))
+
+    def sendAttitude(self, now):
+        self.move(now)
+        yawspeed = SPEED / RADIUS if self.flying and self.roll != 0 else 0.0
+        self.mav.attitude_send(self.timeBoot(now), self.roll, 0.0, self.yaw, 0.0, 0.0, yawspeed)
+
+    def sendTraffic(self, now):
+        # intruders circle the vehicle's centre the other way, further out
+        t = now - self.boot
+        flags = (mavlink.ADSB_FLAGS_VALID_COORDS | mavlink.ADSB_FLAGS_VALID_ALTITUDE |
+                 mavlink.ADSB_FLAGS_VALID_HEADING | mavlink.ADSB_FLAGS_VALID_VELOCITY |
+                 mavlink.ADSB_FLAGS_VALID_CALLSIGN)
+        for i in range(self.sim.args.traffic):
+            radius = RADIUS * (2 + i)
+            angle = -SPEED * t / radius + i
+            lat, lon = offset(self.centre[0], self.centre[1],
+                              radius * math.cos(angle), radius * math.sin(angle))
+            heading = math.degrees(math.atan2(-math.cos(angle), math.sin(angle))) % 360
+            self.mav.adsb_vehicle_send((self.index + 1) * 100 + i, int(lat * 1e7), int(lon * 1e7),
+                                       mavlink.ADSB_ALTITUDE_TYPE_GEOMETRIC,
+                                       int((HOME[2] + TAKEOFF_ALT) * 1000), int(heading * 100),
+                                       SPEED * 100, 0,
+                                       'S{:04d}{:02d}'.format(self.index % 10000, i % 100).encode('utf8'),
+                                       mavlink.ADSB_EMITTER_TYPE_LIGHT, 1, flags, 1200)
+
+    # commands
+
+    def ack(self, command, result=mavlink.MAV_RESULT_ACCEPTED):
+        self.mav.command_ack_send(command, result)
+
+    def onCommandLong(self, msg):
+        command = msg.command
+        result = mavlink.MAV_RESULT_ACCEPTED
+        if command == mavlink.MAV_CMD_DO_FENCE_ENABLE:
+            self.startFence(msg)
+            return
+        elif command == mavlink.MAV_CMD_COMPONENT_ARM_DISARM:
+            self.armed = msg.param1 == 1
+            if not self.armed:
+                self.flying = False
+                self.alt = 0.0
+        elif command == mavlink.MAV_CMD_NAV_TAKEOFF:
+            if self.armed:
+                self.takeoff(msg.param7)
+            else:
+                result = mavlink.MAV_RESULT_FAILED
+        elif command == mavlink.MAV_CMD_MISSION_START:
+            # Icarous, param1 1 starts it without taking off
+            self.armed = True
+            self.custom_mode = AUTO
+            self.current = 0
+            if msg.param1 == 0:
+                self.takeoff(0)
+        self.ack(command, result)
+
+    def onSetMode(self, msg):
+        self.custom_mode = msg.custom_mode
+        if self.custom_mode == AUTO and not self.flying and self.armed:
+            self.takeoff(0)
+        # ArduPilot acks SET_MODE with the message id as the command
+        self.ack(mavlink.MAVLINK_MSG_ID_SET_MODE)
+
+    def takeoff(self, alt):
+        self.flying = True
+        self.target_alt = alt if alt > 0 else TAKEOFF_ALT
+        self.moved = time.monotonic()
+
+    # geofences, the Icarous handshake: DO_FENCE_ENABLE with the index and
+    # total, the vehicle fetches each point and acks the command after the last
+
+    def startFence(self, msg):
+        total = int(msg.param4)
+        if total <= 0:
+            self.fences[int(msg.param2)] = []
+            self.ack(mavlink.MAV_CMD_DO_FENCE_ENABLE)
+            return
+        self.fence = [int(msg.param2), total, 0, [None] * total, 0]
+        self.fetchNext(time.monotonic())
+
+    def fetchNext(self, now):
+        self.fence[4] = now
+        self.mav.fence_fetch_point_send(self.gcs[0], self.gcs[1], self.fence[2])
+
+    def onFencePoint(self, msg):
+        if self.fence is None:
+            # the gcs missed the ack and sent the last point again
+            if self.last_fence is not None and msg.idx == self.last_fence - 1:
+                self.ack(mavlink.MAV_CMD_DO_FENCE_ENABLE)
+            return
+        index, total, idx, points, fetched = self.fence
+        if msg.idx != idx:
+            return
+        points[idx] = (msg.lat, msg.lng)
+        self.fence[2] += 1
+        if self.fence[2] < total:
+            self.fetchNext(time.monotonic())
+            return
+        self.fences[index] = points
+        self.fence = None
+        self.last_fence = total
+        self.sim.count('fences')
+        self.ack(mavlink.MAV_CMD_DO_FENCE_ENABLE)
+
+    # missions
+
+    def missionAck(self, mission_type, result=mavlink.MAV_MISSION_ACCEPTED):
+        self.mav.mission_ack_send(self.gcs[0], self.gcs[1], result, mission_type)
+
+    def requestNext(self, now):
+        mission_type, count, seq, items, requested = self.upload
+        self.upload[4] = now
+        if self.sim.args.request_int:
+            self.mav.mission_request_int_send(self.gcs[0], self.gcs[1], seq, mission_type)
+        else:
+            self.mav.mission_request_send(self.gcs[0], self.gcs[1], seq, mission_type)
+
+    def onMissionCount(self, msg):
+        mission_type = getattr(msg, 'mission_type', 0)
+        if msg.count == 0:
+            self.missions[mission_type] = []
+            self.upload = None
+            self.missionAck(mission_type)
+            return
+        self.upload = [mission_type, msg.count, 0, [None] * msg.count, 0]
+        self.requestNext(time.monotonic())
+
+    def onMissionItem(self, msg):
+        mission_type = getattr(msg, 'mission_type', 0)
+        if self.upload is None or self.upload[0] != mission_type:
+            # the gcs missed the ack and sent the last item again
+            mission = self.missions.get(mission_type, [])
+            if len(mission) > 0 and msg.seq == len(mission) - 1:
+                self.missionAck(mission_type)
+            return
+        count, seq, items = self.upload[1], self.upload[2], self.upload[3]
+        if msg.seq == seq - 1:
+            # the gcs missed the request and sent the last item again
+            self.requestNext(time.monotonic())
+        elif msg.seq == seq:
+            x, y = msg.x, msg.y
+            if msg.get_type() == 'MISSION_ITEM_INT':
+                x, y = toDegrees(msg.frame, x, y)
+            items[seq] = (msg.frame, msg.command, msg.current, msg.autocontinue,
+                          msg.param1, msg.param2, msg.param3, msg.param4, x, y, msg.z)
+            self.upload[2] += 1
+            if self.upload[2] == count:
+                self.missions[mission_type] = items
+                if mission_type == mavlink.MAV_MISSION_TYPE_MISSION:
+                    self.current = 0
+                self.upload = None
+                self.sim.count('uploads')
+                self.missionAck(mission_type)
+            else:
+                self.requestNext(time.monotonic())
+
+    def onMissionRequestList(self, msg):
+        mission_type = getattr(msg, 'mission_type', 0)
+        self.mav.mission_count_send(self.gcs[0], self.gcs[1],
+                                    len(self.missions.get(mission_type, [])), mission_type)
+
+    def onMissionRequest(self, msg):
+        mission_type = getattr(msg, 'mission_type', 0)
+        mission = self.missions.get(mission_type, [])
+        if msg.seq >= len(mission):
+            self.missionAck(mission_type, mavlink.MAV_MISSION_INVALID_SEQUENCE)
+            return
+        frame, command, current, autocontinue, p1, p2, p3, p4, x, y, z = mission[msg.seq]
+        current = 1 if mission_type == mavlink.MAV_MISSION_TYPE_MISSION and msg.seq == self.current else 0
+        if msg.get_type() == 'MISSION_REQUEST_INT':
+            x, y = MP.toInt(frame, x, y)
+            self.mav.mission_item_int_send(self.gcs[0], self.gcs[1], msg.seq, frame, command,
+                                           current, autocontinue, p1, p2, p3, p4, x, y, z,
+                                           mission_type)
+        else:
+            self.mav.mission_item_send(self.gcs[0], self.gcs[1], msg.seq, frame, command,
+                                       current, autocontinue, p1, p2, p3, p4, x, y, z,
+                                       mission_type)
+
+    def onMissionClearAll(self, msg):
+        mission_type = getattr(msg, 'mission_type', 0)
+        self.missions[mission_type] = []
+        self.missionAck(mission_type)
+
+    def onMissionSetCurrent(self, msg):
+        self.current = msg.seq
+        self.mav.mission_current_send(msg.seq)
+
+    # parameters
+
+    def sendParam(self, name):
+        self.mav.param_value_send(name.encode('utf8'), self.params[name],
+                                  mavlink.MAV_PARAM_TYPE_REAL32,
+                                  len(self.param_names), self.param_names.index(name))
+
+    def sendParams(self, now):
+        # the list goes out at --param-rate, a few per tick
+        n = int((now - self.param_last) * self.sim.args.param_rate)
+        if n <= 0:
+            return
+        self.param_last = now
+        while n > 0 and self.param_next < len(self.param_names):
+            self.sendParam(self.param_names[self.param_next])
+            self.param_next += 1
+            n -= 1
+        if self.param_next >= len(self.param_names):
+            self.param_next = None
+
+    def onParamRequestList(self, msg):
+        self.param_next = 0
+        self.param_last = time.monotonic()
+        self.due = self.param_last
+
+    def onParamRequestRead(self, msg):
+        if 0 <= msg.param_index < len(self.param_names):
+            self.sendParam(self.param_names[msg.param_index])
+        elif msg.param_id in self.params:
+            self.sendParam(msg.param_id)
+
+    def onParamSet(self, msg):
+        # unknown names are added, the real vehicles would ignore them and
+        # leave the gcs waiting
+        if msg.param_id not in self.params:
+            self.param_names.append(msg.param_id)
+        self.params[msg.param_id] = float(msg.param_value)
+        self.sendParam(msg.param_id)
+
+
+def printStats(sim, elapsed):
+    s = sim.getStats()
+    print('{:>8} {:>10} {:>9} {:>12} {:>10} {:>9} {:>8} {:>8} {:>8} {:>8}'.format(
+        'vehicles', 'out', 'out/s', 'out bytes', 'in', 'dropped', 'uploads', 'fences', 'params', 'reached'))
+    print('{:>8} {:>10} {:>9.0f} {:>12} {:>10} {:>9} {:>8} {:>8} {:>8} {:>8}'.format(
+        s['vehicles'], s['packets_out'], s['packets_out'] / elapsed if elapsed > 0 else 0,
+        s['bytes_out'], s['packets_in'], s['dropped_out'] + s['dropped_in'],
+        s.get('uploads', 0), s.get('fences', 0), s.get('PARAM_SET', 0), s.get('reached', 0)))
+
+
+async def runVehicles(args):
+    loop = asyncio.get_event_loop()
+    sim = Simulator(loop, args)
+    for i in range(args.vehicles):
+        vehicle = sim.addVehicle(i)
+        await loop.create_datagram_endpoint(lambda vehicle=vehicle: vehicle,
+                                            local_addr=(args.bind, 0))
+
+    stop = asyncio.Event()
+    for sig in [signal.SIGINT, signal.SIGTERM]:
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    start = time.monotonic()
+    last_stats = start
+    try:
+        while not stop.is_set():
+            now = time.monotonic()
+            for vehicle in sim.vehicles:
+                vehicle.tick(now)
+            if args.stats > 0 and now - last_stats >= args.stats:
+                printStats(sim, now - start)
+                last_stats = now
+            if args.duration > 0 and now - start >= args.duration:
+                break
+            await asyncio.sleep(TICK)
+    finally:
+        printStats(sim, time.monotonic() - start)
+        for vehicle in sim.vehicles:
+            vehicle.close()
+
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser(description='Simulated MAVLink vehicles over UDP')
+    parser.add_argument("--vehicles", default=1, type=int, help="number of vehicles")
+    parser.add_argument("--target", default='127.0.0.1', help="address of the ground station")
+    parser.add_argument("--port", default=14553, type=int, help="ground station port of the first vehicle")
+    parser.add_argument("--port-step", default=10, type=int,
+                        help="port increment per vehicle, 0 sends every vehicle to --port")
+    parser.add_argument("--bind", default='0.0.0.0', help="local address of the vehicle sockets")
+    parser.add_argument("--sysid", default=1, type=int, help="sysid of the first vehicle")
+    parser.add_argument("--heartbeat", default=1, type=float, help="HEARTBEAT rate, Hz")
+    parser.add_argument("--position", default=4, type=float, help="GLOBAL_POSITION_INT rate, Hz, 0 for none")
+    parser.add_argument("--attitude", default=4, type=float, help="ATTITUDE rate, Hz, 0 for none")
+    parser.add_argument("--traffic", default=0, type=int, help="ADSB_VEHICLE intruders per vehicle")
+    parser.add_argument("--traffic-rate", default=1, type=float, help="ADSB_VEHICLE rate per intruder, Hz")
+    parser.add_argument("--params", default=100, type=int, help="number of parameters per vehicle")
+    parser.add_argument("--param-rate", default=200, type=float,
+                        help="PARAM_VALUE per second in reply to PARAM_REQUEST_LIST")
+    parser.add_argument("--request-int", action='store_true',
+                        help="ask for mission items with MISSION_REQUEST_INT")
+    parser.add_argument("--flying", action='store_true', help="start in the air, circling")
+    parser.add_argument("--loss", default=0, type=float, help="fraction of datagrams dropped each way")
+    parser.add_argument("--latency", default=0, type=float, help="one way delay, ms")
+    parser.add_argument("--jitter", default=0, type=float, help="up to this much more delay, ms")
+    parser.add_argument("--seed", default=None, type=int, help="random seed")
+    parser.add_argument("--duration", default=0, type=float, help="stop after DURATION seconds")
+    parser.add_argument("--stats", default=0, type=float, help="print counters every STATS seconds")
+
+    args = parser.parse_args()
+    print(args)
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    asyncio.get_event_loop().run_until_complete(runVehicles(args))
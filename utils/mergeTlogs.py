@@ -35,92 +35,115 @@
 # add a header to each packet based on ac name
 # merge and sort the files based on time stamp
 # output one file that contains all of the data
-
+#
+# Each tlog is read lazily and the readers are merged with heapq.merge, so
+# only one record per input is held in memory and records are written as
+# they come out of the merge. Each tlog is assumed to be in time order,
+# which is how the ground station writes them.
+# With --jobs the inputs are decoded in separate processes into temporary
+# files of mlog records, which are then merged without decoding again.
+
+import os
+import sys
+import heapq
+import shutil
 import struct
+import tempfile
 from operator import itemgetter
 from argparse import ArgumentParser
+from multiprocessing import Pool
 from pymavlink import mavutil, mavwp, mavparm
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'SocketServer'))
+
+import GsProcesses.logIndex as LI
 
-def fileMerge(filenames, newFileName, inpath, outpath):
-    all_unsorted = []
-    for i in range(len(filenames)):
-        x = bytearray(struct.pack('>Q', i+1))
-        # connect to the file
-        print('In:', inpath + filenames[i])
-        try:
-            tlog = mavutil.mavlink_connection(
-                inpath + filenames[i], dialect='ardupilotmega', baud=57600, write=False, planner_format=False, notimestamps=True)
-            mavutil.set_dialect("ardupilotmega")
-        except AttributeError:
-            print(
-                'File not found. Please check the filename and directory.', inpath+filenames[i])
-            return
 
-        # loop over all of the messages
-        unsorted = []
-        msg = ' '
-        while msg:
+BUFFER_SIZE = 1 << 20
+
+
+def readTlog(filename, ac):
+    # yields (timestamp usec, mlog record) for each message in the tlog
+    x = bytes(struct.pack('>Q', ac))
+    tlog = mavutil.mavlink_connection(
+        filename, dialect='ardupilotmega', baud=57600, write=False, planner_format=False, notimestamps=True)
+    mavutil.set_dialect("ardupilotmega")
+    try:
+        while True:
             # parse the timestamp for sorting
             t = tlog.f.read(8)
             if len(t) != 8:
                 break
             (timestamp,) = struct.unpack('>Q', t)
-            timestamp = timestamp * 1.0e-6
 
             # get the message and convert it back to bytearray
             msg = tlog.recv_msg()
-            if len(str(msg)) > 0:
-                msg = msg.get_msgbuf()
-
-                # create a list containing [id, timestamp, message]
-                group = [x, timestamp, msg]
-
-                # add it to unsorted
-                unsorted.append(group)
-            else:
+            if msg is None:
                 break
+            if msg.get_type() == 'BAD_DATA':
+                continue
+
+            # mlog record is ac, timestamp, message
+            yield timestamp, x + t + msg.get_msgbuf()
+    finally:
+        tlog.close()
+
+
+def readRecords(filename):
+    # yields (timestamp usec, mlog record) from a file of mlog records,
+    # the packets are framed from their headers without decoding
+    with open(filename, 'rb', buffering=BUFFER_SIZE) as f:
+        while True:
+            head = f.read(19)
+            if len(head) != 19:
+                break
+            n = LI.packetLength(head, 16)
+            if n == 0:
+                break
+            (timestamp,) = struct.unpack_from('>Q', head, 8)
+            yield timestamp, head + f.read(n - 3)
 
-        # add unsorted to all unsorted
-        all_unsorted.append(unsorted)
-
-    tlog.close()
-
-    # merge and sort based on timestamp
-    m_top = [[all_unsorted.index(x)]+x.pop(0) for x in all_unsorted]
-    m_sorted = []
-    while True:
-        # compare them
-        m_top.sort(key=itemgetter(2))
-
-        # put the smallest one into m_sorted
-        small = m_top.pop(0)
-        m_sorted.append(small[1:])
-
-        # get the next value from the same array that was smallest
-        if len(all_unsorted[small[0]]) > 0:
-            m_next = small[0]
-            m_top.append([m_next]+all_unsorted[m_next].pop(0))
 
-            # check if all of the sub lists are empty
-            z = [len(x) for x in all_unsorted if len(x) != 0]
-            if len(z) == 0:
-                break
+def decodeJob(job):
+    # worker: decode one tlog into a temporary file of mlog records
+    filename, ac, tmpname = job
+    with open(tmpname, 'wb', buffering=BUFFER_SIZE) as f:
+        for timestamp, record in readTlog(filename, ac):
+            f.write(record)
+    return tmpname
 
-    print('Out: ' + outpath + newFileName)
-    open(outpath + newFileName, 'a').close()
-    mlog = mavutil.mavlink_connection(
-        outpath + newFileName, dialect='ardupilotmega', baud=57600, write=True, planner_format=False,)
 
-    for x in m_sorted:
-            # convert timestamp back to bit array
-        timestamp = bytearray(struct.pack('>Q', int(x[1]*1.0e6)))
-        # merge the bitarrays back together
-        line = x[0]+timestamp+x[2]
-        mlog.write(line)
+def fileMerge(filenames, newFileName, inpath, outpath, jobs=1):
+    for name in filenames:
+        print('In:', inpath + name)
+        if not os.path.isfile(inpath + name):
+            print(
+                'File not found. Please check the filename and directory.', inpath+name)
+            return
 
-    mlog.close()
-    print('Done. File\'s merged into:', newFileName)
+    tmpdir = None
+    try:
+        if jobs > 1:
+            tmpdir = tempfile.mkdtemp(prefix='mergeTlogs', dir=outpath or '.')
+            work = [(inpath + name, i+1, os.path.join(tmpdir, str(i+1) + '.rec'))
+                    for i, name in enumerate(filenames)]
+            with Pool(jobs) as pool:
+                readers = [readRecords(x) for x in pool.map(decodeJob, work)]
+        else:
+            readers = [readTlog(inpath + name, i+1) for i, name in enumerate(filenames)]
+
+        print('Out: ' + outpath + newFileName)
+        count = 0
+        with open(outpath + newFileName, 'wb', buffering=BUFFER_SIZE) as mlog:
+            # merge based on timestamp, ties keep the order of the inputs
+            for timestamp, record in heapq.merge(*readers, key=itemgetter(0)):
+                mlog.write(record)
+                count += 1
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    print('Done. {} messages merged into: {}'.format(count, newFileName))
 
 
 if __name__ == '__main__':
@@ -133,9 +156,11 @@ if __name__ == '__main__':
     parser.add_argument("--inpath", default='', help="path to tlog files")
     parser.add_argument("--outpath", default='',
                         help='path to output directory')
+    parser.add_argument("--jobs", default=1, type=int,
+                        help='number of processes used to decode the inputs')
     args = parser.parse_args()
 
-    fileMerge(args.infiles, args.outfile, args.inpath, args.outpath)
+    fileMerge(args.infiles, args.outfile, args.inpath, args.outpath, args.jobs)
 
     # add option for mission planner format
     # input files seperatly
@@ -34,30 +34,13 @@
 # BE THE IMMEDIATE, UNILATERAL TERMINATION OF THIS AGREEMENT.
 #
 
+# Starts NUM repeater routes in one process, route i listens on
+# 0.0.0.0:14510+10*i and forwards to OUT on the same port.
 
 from argparse import ArgumentParser
-import subprocess
-import signal
+import asyncio
 
-pro = []
-x = True
-
-
-def kill_repeat(signum, frame):
-    global x
-    global pro
-    for item in pro:
-        if item.poll() is None:
-            print('Closing: ', item, signum)
-            item.send_signal(signum)
-        # time.sleep(1)
-        try:
-            os.kill(item.pid, 0)
-        except:
-            pass
-        else:
-            item.send_signal(9)
-    x = False
+import mav_repeater as MR
 
 
 if __name__ == '__main__':
@@ -70,25 +53,18 @@ if __name__ == '__main__':
     parser.add_argument("--insert", nargs='*', default=None,
                         help="msg to insert. Format <type>. Currently support HEARTBEAT.")
     parser.add_argument('--version', default='python3',
-                        help='Version of python to use')
+                        help='unused, the routes now run in this process')
+    parser.add_argument("--stats", default=0, type=float,
+                        help="print route counters every STATS seconds")
 
     args = parser.parse_args()
     print(args)
+    routes = []
     for i in range(int(args.num)):
         PORT = str(14510 + (i * 10))
-        command = [args.version, 'mav_repeater.py', '--master',
-                   'udp:0.0.0.0:'+PORT, '--out', 'udp:'+args.out+':'+PORT]
-        if args.insert is not None:
-            for insert in args.insert:
-                command.append('--insert')
-                command.append(insert)
-        print(command)
-        r = subprocess.Popen(command, shell=False)
-        pro.append(r)
+        routes.append(MR.Route('udp:0.0.0.0:'+PORT, ['udp:'+args.out+':'+PORT], args.insert))
 
-    while x:
-        signal.signal(signal.SIGINT, kill_repeat)
-        signal.signal(signal.SIGTERM, kill_repeat)
+    asyncio.get_event_loop().run_until_complete(MR.runRoutes(routes, args.stats))
 
-# python3 start_mav_repeat.py --num 4 --out 127.0.0.1 --version python3
+# python3 start_mav_repeat.py --num 4 --out 127.0.0.1
 # python mav_repeater.py --master udp:0.0.0.0:14560 --out udp:192.168.1.91:14550 udp:127.0.0.1:14570 --insert HEARTBEAT